@@ -0,0 +1,5 @@
+"""
+Benchmarks of pymatris against local HTTP, FTP and SFTP stand-in servers.
+
+Run ``python -m benchmarks --help`` from the repository root.
+"""
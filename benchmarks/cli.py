@@ -0,0 +1,241 @@
+import argparse
+import importlib.util
+import itertools
+import json
+import multiprocessing
+import platform
+import statistics
+import sys
+import time
+from importlib import metadata
+
+from pymatris.config import WRITERS
+
+from .runner import run_case
+from .servers import SERVERS, BenchServers
+
+LOOPS = {"asyncio": None, "uvloop": "uvloop"}  # --loop name: SessionConfig.loop_factory
+UNITS = {"": 1, "k": 1024, "m": 1024**2, "g": 1024**3}
+
+
+def parse_size(value: str) -> int:
+    """``"512"``, ``"64k"``, ``"10M"`` or ``"1G"`` in bytes."""
+    value = value.strip().lower().rstrip("ib").rstrip("b")
+    unit = value[-1] if value and value[-1] in UNITS else ""
+    return int(float(value[: len(value) - len(unit)]) * UNITS[unit])
+
+
+def parse_list(cast):
+    def parse(value: str):
+        return [cast(item) for item in value.split(",") if item]
+
+    return parse
+
+
+def parse_chunksize(value: str):
+    return value if value == "auto" else parse_size(value)
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks",
+        description="Benchmark pymatris against local HTTP/FTP/SFTP servers.",
+    )
+    parser.add_argument(
+        "--protocols",
+        type=parse_list(str),
+        default=["http", "ftp", "sftp"],
+        help="Comma separated protocols to benchmark. Default: http,ftp,sftp",
+    )
+    parser.add_argument(
+        "--files", type=int, default=4, help="Files per case. Default: 4"
+    )
+    parser.add_argument(
+        "--file-size",
+        type=parse_size,
+        default=parse_size("16M"),
+        help="Size of each file, e.g. 512k or 16M. Default: 16M",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="Seconds servers wait before answering each request. Default: 0",
+    )
+    parser.add_argument(
+        "--throttle",
+        type=parse_size,
+        default=None,
+        help="Bytes per second per server connection, e.g. 5M. Default: unthrottled",
+    )
+    parser.add_argument(
+        "--max-parallel",
+        type=parse_list(int),
+        default=[5],
+        help="Comma separated max_parallel values. Default: 5",
+    )
+    parser.add_argument(
+        "--max-splits",
+        type=parse_list(int),
+        default=[1, 5],
+        help="Comma separated max_splits values. Default: 1,5",
+    )
+    parser.add_argument(
+        "--chunksize",
+        type=parse_list(parse_chunksize),
+        default=[1024, 64 * 1024],
+        help="Comma separated chunksizes, 'auto' allowed. Default: 1024,64k",
+    )
+    parser.add_argument(
+        "--loop",
+        type=parse_list(str),
+        default=["asyncio"],
+        help="Comma separated event loops, asyncio and/or uvloop. Default: asyncio",
+    )
+    parser.add_argument(
+        "--writer",
+        type=parse_list(str),
+        default=["aiofiles"],
+        help=f"Comma separated writer backends, of {', '.join(WRITERS)}. Default: aiofiles",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Runs per case. Default: 3"
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="Seed of the file contents. Default: 0"
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="Write the JSON report here instead of to stdout.",
+    )
+    args = parser.parse_args(args)
+    unknown = set(args.protocols) - set(SERVERS)
+    if unknown:
+        parser.error(f"unknown protocols: {', '.join(sorted(unknown))}")
+    unknown = set(args.loop) - set(LOOPS)
+    if unknown:
+        parser.error(f"unknown loops: {', '.join(sorted(unknown))}")
+    unknown = set(args.writer) - set(WRITERS)
+    if unknown:
+        parser.error(f"unknown writers: {', '.join(sorted(unknown))}")
+    if "uvloop" in args.loop and importlib.util.find_spec("uvloop") is None:
+        parser.error("--loop uvloop needs the uvloop package")
+    return args
+
+
+def _version():
+    try:
+        return metadata.version("pymatris")
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def run(args) -> dict:
+    grid = list(
+        itertools.product(
+            args.loop, args.writer, args.max_parallel, args.max_splits, args.chunksize
+        )
+    )
+    results = []
+    context = multiprocessing.get_context("spawn")
+
+    with BenchServers(
+        args.protocols,
+        args.files,
+        args.file_size,
+        latency=args.latency,
+        throttle=args.throttle,
+        seed=args.seed,
+    ) as servers:
+        for protocol in args.protocols:
+            for loop, writer, max_parallel, max_splits, chunksize in grid:
+                case = {
+                    "protocol": protocol,
+                    "loop": loop,
+                    "writer": writer,
+                    "max_parallel": max_parallel,
+                    "max_splits": max_splits,
+                    "chunksize": chunksize,
+                }
+                runs = []
+                for _ in range(args.repeat):
+                    # A fresh process per run, so peak RSS is not carried over
+                    with context.Pool(1) as pool:
+                        runs.append(
+                            pool.apply(
+                                run_case,
+                                (
+                                    servers.urls[protocol],
+                                    servers.digests,
+                                    max_parallel,
+                                    max_splits,
+                                    chunksize,
+                                    LOOPS[loop],
+                                    writer,
+                                ),
+                            )
+                        )
+                throughputs = [r["throughput_bytes_per_sec"] or 0 for r in runs]
+                results.append(
+                    {
+                        **case,
+                        "median_throughput_bytes_per_sec": statistics.median(
+                            throughputs
+                        ),
+                        "median_wall_seconds": statistics.median(
+                            r["wall_seconds"] for r in runs
+                        ),
+                        "median_cpu_seconds": statistics.median(
+                            r["cpu_seconds"] for r in runs
+                        ),
+                        "max_peak_rss_bytes": max(r["peak_rss_bytes"] for r in runs),
+                        "median_loop_lag_p99_seconds": statistics.median(
+                            r["loop_lag_p99_seconds"] or 0 for r in runs
+                        ),
+                        "max_loop_lag_seconds": max(
+                            r["loop_lag_max_seconds"] or 0 for r in runs
+                        ),
+                        "runs": runs,
+                    }
+                )
+                print(
+                    "{protocol} loop={loop} writer={writer} parallel={max_parallel} "
+                    "splits={max_splits} chunksize={chunksize}: {mbps:.1f} MiB/s, "
+                    "loop lag p99 {lag:.1f} ms".format(
+                        mbps=results[-1]["median_throughput_bytes_per_sec"] / 1024**2,
+                        lag=results[-1]["median_loop_lag_p99_seconds"] * 1000,
+                        **case,
+                    ),
+                    file=sys.stderr,
+                )
+
+    return {
+        "meta": {
+            "pymatris_version": _version(),
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "cpu_count": multiprocessing.cpu_count(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "files": args.files,
+            "file_size": args.file_size,
+            "latency": args.latency,
+            "throttle": args.throttle,
+            "repeat": args.repeat,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+
+
+def main(args=None):
+    args = parse_args(args)
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
@@ -0,0 +1,101 @@
+"""One benchmark case, run in a fresh process so CPU time and peak RSS belong to that case alone."""
+import os
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+from .servers import sha256_file
+
+
+def _peak_rss() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class LoopLag:
+    """
+    Event loop factory that measures how late the loop is.
+
+    A callback due every ``interval`` seconds records by how much it missed its
+    time, which is how long the loop was busy with something else.
+    """
+
+    def __init__(self, loop_factory: Optional[str] = None, interval: float = 0.005):
+        self.loop_factory = loop_factory
+        self.interval = interval
+        self.lags: List[float] = []
+
+    def __call__(self):
+        from pymatris.utils import new_event_loop
+
+        loop = new_event_loop(self.loop_factory)
+        loop.call_later(self.interval, self._tick, loop, loop.time() + self.interval)
+        return loop
+
+    def _tick(self, loop, due: float) -> None:
+        now = loop.time()
+        self.lags.append(max(0.0, now - due))
+        loop.call_later(self.interval, self._tick, loop, now + self.interval)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.lags:
+            return None
+        lags = sorted(self.lags)
+        return lags[min(len(lags) - 1, int(q * len(lags)))]
+
+
+def run_case(
+    urls: List[str],
+    digests: Dict[str, str],
+    max_parallel: int,
+    max_splits: int,
+    chunksize: Union[int, str],
+    loop_factory: Optional[str] = None,
+    writer: str = "aiofiles",
+) -> Dict:
+    from pymatris import Downloader, SessionConfig
+
+    baseline_rss = _peak_rss()
+    lag = LoopLag(loop_factory)
+    with tempfile.TemporaryDirectory(prefix="pymatris-bench-out-") as out:
+        dm = Downloader(
+            max_parallel=max_parallel,
+            max_splits=max_splits,
+            all_progress=False,
+            overwrite=True,
+            session_config=SessionConfig(
+                chunksize=chunksize,
+                file_progress=False,
+                loop_factory=lag,
+                writer=writer,
+            ),
+        )
+        for url in urls:
+            dm.enqueue_file(url, path=out)
+
+        wall, cpu = time.perf_counter(), time.process_time()
+        results = dm.download()
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        peak_rss = _peak_rss()
+
+        nbytes = sum(os.path.getsize(path) for path in results)
+        verified = not results.errors and all(
+            sha256_file(path) == digests[Path(path).name] for path in results
+        )
+
+    return {
+        "wall_seconds": wall,
+        "cpu_seconds": cpu,
+        "bytes": nbytes,
+        "throughput_bytes_per_sec": nbytes / wall if wall else None,
+        "peak_rss_bytes": peak_rss,
+        "loop_lag_p99_seconds": lag.percentile(0.99),
+        "loop_lag_max_seconds": max(lag.lags, default=None),
+        "baseline_rss_bytes": baseline_rss,
+        "errors": len(results.errors),
+        "verified": verified,
+    }
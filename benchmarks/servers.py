@@ -0,0 +1,265 @@
+"""Local stand-in servers, each running in its own process so they do not skew the client's measurements."""
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import random
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+from functools import partial
+from pathlib import Path
+from typing import Dict, List, Optional
+
+USER = PASSWORD = "bench"
+BLOCK = 64 * 1024
+SEED_BLOCK = 1024 * 1024
+
+
+def generate_files(root: Path, count: int, size: int, seed: int) -> Dict[str, str]:
+    """Write ``count`` files of ``size`` bytes with seeded content, returns name -> sha256."""
+    block = random.Random(seed).randbytes(SEED_BLOCK)
+    digests = {}
+    for i in range(count):
+        name = f"bench{i}.bin"
+        sha = hashlib.sha256()
+        with open(root / name, "wb") as f:
+            written = 0
+            while written < size:
+                # Rotate the block per file, so files are not identical
+                data = block[i % SEED_BLOCK :] + block[: i % SEED_BLOCK]
+                data = data[: size - written]
+                f.write(data)
+                sha.update(data)
+                written += len(data)
+        digests[name] = sha.hexdigest()
+    return digests
+
+
+class Throttle:
+    """Per-connection cap of ``rate`` bytes per second, None for no cap."""
+
+    def __init__(self, rate: Optional[float]) -> None:
+        self.rate = rate
+        self.sent = 0
+        self.started = time.monotonic()
+
+    async def wait(self, n: int) -> None:
+        if not self.rate:
+            return
+        self.sent += n
+        delay = self.sent / self.rate - (time.monotonic() - self.started)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def _exit_on_sigterm() -> None:
+    # Exit cleanly on terminate(), so the server's own resources are released
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+
+
+def _parse_range(header: str, size: int):
+    start, _, end = header.replace("bytes=", "").partition("-")
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    return start, end
+
+
+def _run_http(root: str, latency: float, throttle: Optional[float], ports) -> None:
+    _exit_on_sigterm()
+    from aiohttp import web
+
+    async def handle(request):
+        path = Path(root) / request.match_info["name"]
+        if not path.is_file():
+            raise web.HTTPNotFound()
+        await asyncio.sleep(latency)
+
+        size = path.stat().st_size
+        start, end, status = 0, size - 1, 200
+        if "Range" in request.headers:
+            start, end = _parse_range(request.headers["Range"], size)
+            status = 206
+
+        resp = web.StreamResponse(status=status)
+        resp.headers["Accept-Ranges"] = "bytes"
+        if status == 206:
+            resp.headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        resp.content_length = end - start + 1
+        await resp.prepare(request)
+        if request.method == "HEAD":
+            return resp
+
+        limiter = Throttle(throttle)
+        with open(path, "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining:
+                data = f.read(min(BLOCK, remaining))
+                await resp.write(data)
+                await limiter.wait(len(data))
+                remaining -= len(data)
+        return resp
+
+    async def main():
+        app = web.Application()
+        app.router.add_get("/{name}", handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        await web.SockSite(runner, sock).start()
+        ports.put(sock.getsockname()[1])
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
+
+
+def _run_sftp(root: str, latency: float, throttle: Optional[float], ports) -> None:
+    _exit_on_sigterm()
+    import asyncssh
+
+    class NoAuthServer(asyncssh.SSHServer):
+        def begin_auth(self, username):
+            return False
+
+    class BenchSFTPServer(asyncssh.SFTPServer):
+        def __init__(self, chan):
+            super().__init__(chan, chroot=root.encode())
+            # One SFTP session per connection
+            self.throttle = Throttle(throttle)
+
+        async def open(self, path, pflags, attrs):
+            await asyncio.sleep(latency)
+            return super().open(path, pflags, attrs)
+
+        async def read(self, file_obj, offset, size):
+            data = super().read(file_obj, offset, size)
+            await self.throttle.wait(len(data))
+            return data
+
+    async def main():
+        key = asyncssh.generate_private_key("ssh-ed25519")
+        acceptor = await asyncssh.listen(
+            "127.0.0.1",
+            0,
+            server_host_keys=[key],
+            server_factory=NoAuthServer,
+            sftp_factory=BenchSFTPServer,
+        )
+        ports.put(acceptor.get_port())
+        await acceptor.wait_closed()
+
+    asyncio.run(main())
+
+
+def _run_ftp(root: str, latency: float, throttle: Optional[float], ports) -> None:
+    _exit_on_sigterm()
+    import logging
+
+    from pyftpdlib.authorizers import DummyAuthorizer
+    from pyftpdlib.handlers import FTPHandler, ThrottledDTPHandler
+    from pyftpdlib.servers import FTPServer
+
+    class Handler(FTPHandler):
+        def ftp_RETR(self, file):
+            if latency:
+                self.ioloop.call_later(latency, FTPHandler.ftp_RETR, self, file)
+            else:
+                FTPHandler.ftp_RETR(self, file)
+
+    authorizer = DummyAuthorizer()
+    authorizer.add_user(USER, PASSWORD, root, perm="elr")
+    Handler.authorizer = authorizer
+    if throttle:
+        # Every data connection, i.e. every split, gets its own cap
+        Handler.dtp_handler = type(
+            "Throttled", (ThrottledDTPHandler,), {"write_limit": int(throttle)}
+        )
+
+    # pyftpdlib logs every command unless a handler is configured
+    logger = logging.getLogger("pyftpdlib")
+    logger.addHandler(logging.NullHandler())
+    logger.setLevel(logging.WARNING)
+    server = FTPServer(("127.0.0.1", 0), Handler)
+    ports.put(server.address[1])
+    server.serve_forever()
+
+
+SERVERS = {"http": _run_http, "ftp": _run_ftp, "sftp": _run_sftp}
+
+
+class BenchServers:
+    """
+    Context manager that writes the benchmark files and serves them.
+
+    ``urls[protocol]`` lists the URLs of every file, ``digests`` maps each
+    file name to its sha256.
+    """
+
+    def __init__(
+        self,
+        protocols: List[str],
+        files: int,
+        file_size: int,
+        latency: float = 0.0,
+        throttle: Optional[float] = None,
+        seed: int = 0,
+    ) -> None:
+        self.protocols = protocols
+        self.files = files
+        self.file_size = file_size
+        self.latency = latency
+        self.throttle = throttle
+        self.seed = seed
+        self.urls: Dict[str, List[str]] = {}
+        self.digests: Dict[str, str] = {}
+        self._processes = []
+        self._root = None
+
+    def __enter__(self) -> "BenchServers":
+        self._root = tempfile.mkdtemp(prefix="pymatris-bench-")
+        self.digests = generate_files(
+            Path(self._root), self.files, self.file_size, self.seed
+        )
+        context = multiprocessing.get_context("spawn")
+        try:
+            for protocol in self.protocols:
+                ports = context.Queue()
+                target = partial(
+                    SERVERS[protocol], self._root, self.latency, self.throttle
+                )
+                process = context.Process(target=target, args=(ports,), daemon=True)
+                process.start()
+                self._processes.append(process)
+                port = ports.get(timeout=30)
+                ports.close()
+                credentials = "" if protocol == "http" else f"{USER}:{PASSWORD}@"
+                self.urls[protocol] = [
+                    f"{protocol}://{credentials}127.0.0.1:{port}/{name}"
+                    for name in sorted(self.digests)
+                ]
+        except BaseException:
+            self.__exit__(None, None, None)
+            raise
+        return self
+
+    def __exit__(self, *exc) -> None:
+        for process in self._processes:
+            process.terminate()
+            process.join(5)
+        self._processes = []
+        if self._root is not None:
+            shutil.rmtree(self._root, ignore_errors=True)
+            self._root = None
+
+
+def sha256_file(path: os.PathLike) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(partial(f.read, SEED_BLOCK), b""):
+            sha.update(block)
+    return sha.hexdigest()
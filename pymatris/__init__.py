@@ -4,7 +4,8 @@ import logging as _logging
 from .downloader import Downloader
 from .config import SessionConfig
 from .results import Results
+from .metrics import Metrics
 
-__all__ = ["Downloader", "Results", "SessionConfig"]
+__all__ = ["Downloader", "Metrics", "Results", "SessionConfig"]
 
 log = _logging.getLogger("pymatris")
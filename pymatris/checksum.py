@@ -0,0 +1,196 @@
+import asyncio
+import base64
+import binascii
+import hashlib
+import re
+import urllib.parse
+from typing import NamedTuple, Optional
+
+import aiohttp
+
+import pymatris
+from pymatris.exceptions import ChecksumMismatchError
+
+try:
+    import crc32c as _crc32c
+except ImportError:  # Optional dependency, only needed for crc32c checksums
+    _crc32c = None
+
+__all__ = [
+    "Checksum",
+    "StreamingHash",
+    "parse_checksum",
+    "checksum_from_headers",
+    "resolve_checksum",
+]
+
+READ_SIZE = 1024 * 1024  # Bytes per read when catching up from disk
+
+
+class _Crc32c:
+    name = "crc32c"
+
+    def __init__(self) -> None:
+        self.value = 0
+
+    def update(self, data) -> None:
+        self.value = _crc32c.crc32c(data, self.value)
+
+    def hexdigest(self) -> str:
+        return f"{self.value:08x}"
+
+
+ALGORITHMS = {
+    "sha256": hashlib.sha256,
+    "md5": hashlib.md5,
+    "crc32c": _Crc32c,
+}
+
+# Hex digest lengths, to tell the algorithm of a bare sidecar digest
+_HEX_LENGTHS = {64: "sha256", 32: "md5", 8: "crc32c"}
+
+# Names of the algorithms in Digest / Repr-Digest headers
+_HEADER_NAMES = {"sha-256": "sha256", "md5": "md5"}
+
+
+class Checksum(NamedTuple):
+    """Expected checksum of a file, or the sidecar ``url`` to fetch it from."""
+
+    algorithm: Optional[str]
+    hexdigest: Optional[str] = None
+    url: Optional[str] = None
+
+
+def _check_algorithm(algorithm: str) -> str:
+    algorithm = algorithm.lower().replace("-", "")
+    if algorithm not in ALGORITHMS:
+        raise ValueError(
+            f"Unsupported checksum algorithm {algorithm!r}, use one of {list(ALGORITHMS)}"
+        )
+    if algorithm == "crc32c" and _crc32c is None:
+        raise ValueError("crc32c checksums need the optional crc32c package")
+    return algorithm
+
+
+def parse_checksum(value: str) -> Checksum:
+    """
+    Parse the ``checksum`` argument of ``enqueue_file``.
+
+    Either ``"<algorithm>:<hexdigest>"``, e.g. ``"sha256:9f86d0..."``, or the
+    HTTP(S) URL of a sidecar file such as ``https://host/file.iso.sha256``.
+    """
+    scheme = urllib.parse.urlparse(value).scheme
+    if scheme in ("http", "https"):
+        extension = value.rsplit(".", 1)[-1].lower()
+        algorithm = _check_algorithm(extension) if extension in ALGORITHMS else None
+        return Checksum(algorithm, url=value)
+
+    algorithm, sep, hexdigest = value.partition(":")
+    if not sep or not hexdigest:
+        raise ValueError(
+            f"checksum must be '<algorithm>:<hexdigest>' or a sidecar URL, got {value!r}"
+        )
+    return Checksum(_check_algorithm(algorithm), hexdigest.strip().lower())
+
+
+def checksum_from_headers(headers) -> Optional[Checksum]:
+    """Checksum from ``Repr-Digest``/``Digest`` or ``Content-MD5`` response headers."""
+    # Decompressed bodies no longer match a digest of the encoded content
+    if headers.get("Content-Encoding", "identity") != "identity":
+        return None
+
+    for header in ("Repr-Digest", "Digest"):
+        for item in headers.get(header, "").split(","):
+            name, sep, value = item.strip().partition("=")
+            algorithm = _HEADER_NAMES.get(name.strip().lower())
+            if sep and algorithm:
+                digest = _b64_to_hex(value.strip().strip(":"))
+                if digest:
+                    return Checksum(algorithm, digest)
+
+    if "Content-MD5" in headers:
+        digest = _b64_to_hex(headers["Content-MD5"].strip())
+        if digest:
+            return Checksum("md5", digest)
+    return None
+
+
+def _b64_to_hex(value: str) -> Optional[str]:
+    try:
+        return base64.b64decode(value, validate=True).hex()
+    except (binascii.Error, ValueError):
+        return None
+
+
+async def _fetch_sidecar(session: aiohttp.ClientSession, config, checksum: Checksum):
+    async with session.get(
+        checksum.url, timeout=config.timeouts, headers=config.headers
+    ) as resp:
+        if resp.status < 200 or resp.status >= 300:
+            raise aiohttp.ClientResponseError(
+                resp.request_info, resp.history, status=resp.status
+            )
+        text = await resp.text()
+
+    # "<hexdigest>  <filename>" as written by sha256sum/md5sum, or just the digest
+    match = re.search(r"\b([0-9a-fA-F]{8,128})\b", text)
+    if match is None:
+        raise ValueError(f"No checksum found in {checksum.url}")
+    hexdigest = match.group(1).lower()
+    algorithm = checksum.algorithm or _HEX_LENGTHS.get(len(hexdigest))
+    if algorithm is None:
+        raise ValueError(f"Unknown checksum algorithm in {checksum.url}")
+    return Checksum(_check_algorithm(algorithm), hexdigest)
+
+
+async def resolve_checksum(
+    checksum: Optional[Checksum], session, config, headers=None
+) -> Optional[Checksum]:
+    """The checksum to verify a download against, or None to skip verification."""
+    if checksum is not None and checksum.url is not None:
+        return await _fetch_sidecar(session, config, checksum)
+    if checksum is None and headers is not None and config.verify_header_checksums:
+        return checksum_from_headers(headers)
+    return checksum
+
+
+class StreamingHash:
+    """
+    Hash of a file computed by its writer while the download is running.
+
+    Chunks are hashed as soon as they extend the contiguous prefix written so
+    far. Chunks that land past a gap (later splits, resumed ranges) are
+    hashed from the file by `verify` once all bytes are on disk.
+    """
+
+    def __init__(self, checksum: Checksum) -> None:
+        self.checksum = checksum
+        self.hash = ALGORITHMS[checksum.algorithm]()
+        self.position = 0  # Bytes of the file hashed so far
+
+    def update(self, offset: int, data) -> None:
+        end = offset + len(data)
+        if offset <= self.position < end:
+            self.hash.update(memoryview(data)[self.position - offset :])
+            self.position = end
+
+    def _catch_up(self, path) -> None:
+        with open(path, "rb") as f:
+            f.seek(self.position)
+            for block in iter(lambda: f.read(READ_SIZE), b""):
+                self.hash.update(block)
+                self.position += len(block)
+
+    async def verify(self, path, journal=None) -> None:
+        """Raise ChecksumMismatchError when the file at ``path`` does not match."""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._catch_up, path)
+        actual = self.hash.hexdigest()
+        if actual != self.checksum.hexdigest:
+            if journal is not None:
+                # A single digest cannot tell which bytes are bad, keep none of them
+                journal.reset(journal.size)
+            raise ChecksumMismatchError(
+                self.checksum.algorithm, self.checksum.hexdigest, actual
+            )
+        pymatris.log.debug("%s %s checksum verified", path, self.checksum.algorithm)
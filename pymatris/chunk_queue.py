@@ -0,0 +1,162 @@
+import time
+import asyncio
+import weakref
+from collections import deque
+from typing import Optional
+
+from pymatris.metrics import current_probe
+
+__all__ = ["MemoryBudget", "ChunkQueue"]
+
+FLUSH = (-1, b"")  # Item asking the writer to write all it holds back
+
+
+class MemoryBudget:
+    """
+    Bytes of downloaded chunks allowed to wait for a writer at once.
+
+    ``limit=None`` never blocks. A chunk larger than the whole budget is let
+    through once the budget is empty, so oversized chunks cannot deadlock.
+    """
+
+    def __init__(self, limit: Optional[int] = None) -> None:
+        self.limit = limit
+        self.used = 0
+        self.backpressure = 0  # Puts into queues sharing this budget that had to wait
+        self._waiters = deque()
+        self._queues = weakref.WeakSet()  # Queues whose writers may hold chunks back
+
+    def _cost(self, n: int) -> int:
+        return min(n, self.limit)
+
+    async def acquire(self, n: int) -> bool:
+        """Reserve ``n`` bytes, returns whether the caller had to wait for them."""
+        if self.limit is None:
+            return False
+        n = self._cost(n)
+        if not self._waiters and self.used + n <= self.limit:
+            self.used += n
+            return False
+
+        # Chunks held back by writers to merge them count against the budget,
+        # have them written out instead of waiting for them
+        for queue in list(self._queues):
+            queue.request_flush()
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append((n, waiter))
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release(n)  # Granted right before the cancellation
+            else:
+                if (n, waiter) in self._waiters:
+                    self._waiters.remove((n, waiter))
+                self._wake()
+            raise
+        return True
+
+    def release(self, n: int) -> None:
+        if self.limit is None:
+            return
+        self.used -= self._cost(n)
+        self._wake()
+
+    def _wake(self) -> None:
+        # First come, first served, so a large chunk is not starved by small ones
+        while self._waiters:
+            n, waiter = self._waiters[0]
+            if self.used + n > self.limit:
+                break
+            self._waiters.popleft()
+            if not waiter.done():
+                self.used += n
+                waiter.set_result(None)
+
+
+class ChunkQueue(asyncio.Queue):
+    """
+    Queue of ``(offset, chunk)`` between download workers and the writer.
+
+    ``put`` blocks while the chunks waiting in this queue exceed ``max_bytes``,
+    or while all queues sharing ``budget`` exceed its limit. Chunks count until
+    the writer marks them written with ``task_done(nbytes)``.
+    """
+
+    def __init__(
+        self, max_bytes: Optional[int] = None, budget: Optional[MemoryBudget] = None
+    ) -> None:
+        super().__init__()
+        self._budgets = [
+            b for b in (MemoryBudget(max_bytes), budget) if b and b.limit is not None
+        ]
+        for b in self._budgets:
+            b._queues.add(self)
+        self.shared_budget = budget
+        self._flush_requested = False
+        self.backpressure = 0  # Puts that had to wait for the writer
+        self._probe = current_probe()
+        # When the oldest waiting chunk was put, only kept while metrics are collected
+        self._waiting_since: Optional[float] = None
+
+    async def put(self, item) -> None:
+        n = len(item[1])
+        waited = False
+        acquired = []
+        try:
+            for budget in self._budgets:
+                waited = await budget.acquire(n) or waited
+                acquired.append(budget)
+        except asyncio.CancelledError:
+            for budget in acquired:
+                budget.release(n)
+            raise
+
+        if waited:
+            self.backpressure += 1
+            if self.shared_budget is not None:
+                self.shared_budget.backpressure += 1
+        self.put_nowait(item)
+
+    def starved(self) -> bool:
+        """Whether a producer waits for budget held by chunks of this queue or others."""
+        return any(budget._waiters for budget in self._budgets)
+
+    def request_flush(self) -> None:
+        """Have the writer write out the chunks it holds back, if any."""
+        # Chunks taken but not done are held back or being written
+        if not self._flush_requested and self._unfinished_tasks > self.qsize():
+            self._flush_requested = True
+            self.put_nowait(FLUSH)
+
+    def task_done(self, nbytes: int = 0) -> None:
+        """Mark an item as written, giving its ``nbytes`` back to the budgets."""
+        for budget in self._budgets:
+            budget.release(nbytes)
+        super().task_done()
+
+    async def join(self) -> None:
+        # The writer may hold chunks back to merge them, have it write them out
+        if self._unfinished_tasks:
+            self.put_nowait(FLUSH)
+        await super().join()
+
+    def batch_taken(self, n: int) -> None:
+        """Sample queue depth and writer lag for a batch of ``n`` items the writer took."""
+        if self._waiting_since is None:
+            return
+        now = time.monotonic()
+        self._probe.queued(n + self.qsize(), now - self._waiting_since)
+        # Chunks left behind were put since, counting them from now underestimates
+        self._waiting_since = now if self.qsize() else None
+
+    def _put(self, item) -> None:
+        super()._put(item)
+        if self._probe is not None and self._waiting_since is None:
+            self._waiting_since = time.monotonic()
+
+    def _get(self):
+        item = super()._get()
+        if item is FLUSH:
+            self._flush_requested = False
+        return item
@@ -1,14 +1,24 @@
 import platform
-from typing import Dict, Optional
+from typing import Callable, Dict, Optional, Union
+import asyncio
+import contextlib
 import os
+import ssl
 
 
 from dataclasses import field, dataclass
 
 import aiohttp
 
+from pymatris.segments import MIN_SEGMENT_SIZE
+from pymatris.progress import PROGRESS_MODES
+
 __all__ = ["DownloaderConfig", "SessionConfig"]
 
+WRITERS = ("aiofiles", "pwrite", "threads")
+LOOPS = ("uvloop",)  # Event loops that can be named instead of passing a factory
+HTTP2_MODES = (False, True, "prior_knowledge")
+
 
 def _default_headers():
     return {
@@ -18,27 +28,131 @@ def _default_headers():
     }
 
 
-def _default_aiohttp_session(config: "SessionConfig") -> aiohttp.ClientSession:
-    return aiohttp.ClientSession(headers=config.headers)
+def _connection_limit(config: "DownloaderConfig") -> int:
+    if config.connection_limit is not None:
+        return config.connection_limit
+    # Every parallel file with all of its splits, 0 is unlimited for aiohttp
+    return config.max_parallel * config.max_splits
+
+
+def _default_aiohttp_session(config: "DownloaderConfig") -> aiohttp.ClientSession:
+    if config.http2:
+        import httpx
+        from pymatris.http2 import HTTP2Session
+
+        return HTTP2Session(
+            headers=config.headers,
+            prior_knowledge=config.http2 == "prior_knowledge",
+            limits=httpx.Limits(
+                max_connections=_connection_limit(config) or None,
+                keepalive_expiry=config.keepalive_timeout,
+            ),
+            verify=config.ssl_context if config.ssl_context is not None else True,
+        )
+    connector = aiohttp.TCPConnector(
+        limit=_connection_limit(config),
+        limit_per_host=config.max_host_connections or 0,
+        ttl_dns_cache=config.dns_cache_ttl,
+        keepalive_timeout=config.keepalive_timeout,
+        ssl=config.ssl_context if config.ssl_context is not None else True,
+        resolver=config.resolver,
+    )
+    return aiohttp.ClientSession(headers=config.headers, connector=connector)
+
+
+@contextlib.asynccontextmanager
+async def _lent_session(session):
+    # The caller made the session and closes it
+    yield session
 
 
 @dataclass
 class SessionConfig:
     headers: Optional[Dict[str, str]] = field(default_factory=_default_headers)
-    chunksize: float = 1024
+    chunksize: Union[float, str] = 1024  # Bytes per read, or "auto" to adapt
     file_progress: bool = True
     timeouts: int = 300  # Default to 5 min timeout
     log_level: Optional[str] = None
+    resume: bool = False  # Keep partial tempfiles and continue them on the next run
+    writer: str = "aiofiles"  # Writer backend, one of WRITERS
+    writer_threads: int = 1  # Threads per filesystem of the "threads" writer
+    # Bytes of chunks waiting for the writer, per file and across all files,
+    # before download workers pause. None means unbounded.
+    file_buffer_bytes: Optional[int] = 64 * 1024 * 1024
+    total_buffer_bytes: Optional[int] = None
+    pool_idle_timeout: float = 60.0  # Seconds an idle FTP/SFTP connection is kept
+    # Open HTTP downloads with a GET for "bytes=0-" instead of a HEAD request,
+    # streaming that response as the first segment
+    skip_head: bool = False
+    # HTTP/SFTP workers that finish early split the largest unfinished segment,
+    # as long as both halves are at least this many bytes
+    min_segment_size: int = MIN_SEGMENT_SIZE
+    # Bandwidth caps in bytes per second: for the whole run, per hostname, and
+    # per file (enqueue_file(..., max_bytes_per_sec=...) overrides the latter)
+    max_bytes_per_sec: Optional[float] = None
+    per_host_limits: Optional[Dict[str, float]] = None
+    file_max_bytes_per_sec: Optional[float] = None
+    # Verify HTTP downloads against Repr-Digest/Digest/Content-MD5 headers
+    # when enqueue_file(..., checksum=...) is not given
+    verify_header_checksums: bool = False
+    # Sync mode: remember what was downloaded in this JSON manifest and skip
+    # files the server reports unchanged (ETag/Last-Modified, FTP MDTM, SFTP mtime)
+    manifest: Optional[Union[str, os.PathLike]] = None
+    # Event loop of Downloader.download(): None for asyncio's default, "uvloop",
+    # or a callable returning a new loop
+    loop_factory: Optional[Union[str, Callable[[], asyncio.AbstractEventLoop]]] = None
+    # File progress: a tqdm bar per file ("tqdm"), one bar of all bytes
+    # ("aggregate"), JSON lines on stderr ("json") or a callable given every
+    # snapshot. All but "tqdm" render every progress_interval seconds.
+    progress: Union[str, Callable[[Dict], None]] = "tqdm"
+    progress_interval: float = 0.5
+    # Files of at most this many bytes (by HEAD/stat size, or found out while
+    # streaming) are read into memory and written in one go, without a writer
+    # task. None disables it.
+    small_file_size: Optional[int] = None
+    # HTTP(S) over HTTP/2 with httpx, one multiplexed connection per host:
+    # True negotiates it over TLS, "prior_knowledge" also speaks it to http://
+    http2: Union[bool, str] = False
+    # HTTP connection pool: at most connection_limit connections (None for
+    # max_parallel * max_splits, 0 for unlimited), idle ones kept alive for
+    # keepalive_timeout seconds, and DNS answers cached for dns_cache_ttl
+    # seconds (None for as long as the session lives)
+    connection_limit: Optional[int] = None
+    keepalive_timeout: float = 60.0
+    dns_cache_ttl: Optional[int] = 300
+    # SSLContext shared by every HTTPS connection, and an aiohttp resolver
+    # (e.g. aiohttp.AsyncResolver) in place of the threaded getaddrinfo one
+    ssl_context: Optional[ssl.SSLContext] = None
+    resolver: Optional[aiohttp.abc.AbstractResolver] = None
 
     def __post_init__(self):
         if self.log_level is None:
             self.log_level = "DEBUG" if "PYMATRIS_DEBUG" in os.environ else None
 
         # Default minimum values
-        if self.chunksize < 1:
+        if isinstance(self.chunksize, str):
+            if self.chunksize != "auto":
+                raise ValueError(
+                    f"chunksize must be a number or 'auto', got {self.chunksize!r}"
+                )
+        elif self.chunksize < 1:
             self.chunksize = 1
         if self.timeouts < 1:
             self.timeouts = 1
+        if self.writer_threads < 1:
+            self.writer_threads = 1
+        if isinstance(self.loop_factory, str) and self.loop_factory not in LOOPS:
+            raise ValueError(
+                f"loop_factory must be a callable or one of {LOOPS}, got {self.loop_factory!r}"
+            )
+        if isinstance(self.progress, str) and self.progress not in PROGRESS_MODES:
+            raise ValueError(
+                f"progress must be a callable or one of {PROGRESS_MODES}, got {self.progress!r}"
+            )
+        if self.http2 not in HTTP2_MODES:
+            raise ValueError(f"http2 must be one of {HTTP2_MODES}, got {self.http2!r}")
+        if self.writer not in WRITERS:
+            raise ValueError(f"writer must be one of {WRITERS}, got {self.writer!r}")
 
 
 @dataclass
@@ -52,7 +166,11 @@ class DownloaderConfig:
     max_tries: int = 5
     all_progress: bool = True
     overwrite: bool = True
+    max_host_connections: Optional[int] = None  # Connections per host, unlimited if None
+    processes: int = 1  # Processes, each with its own event loop, to download with
     config: Optional[SessionConfig] = field(default_factory=SessionConfig)
+    # Session made by the caller, used instead of one per run and not closed
+    session: Optional[aiohttp.ClientSession] = None
 
     def __post_init__(self):
         if self.config is None:
@@ -69,9 +187,15 @@ class DownloaderConfig:
             self.max_splits = 1
         if self.max_tries < 1:
             self.max_tries = 1
+        if self.max_host_connections is not None and self.max_host_connections < 1:
+            self.max_host_connections = 1
+        if self.processes < 1:
+            self.processes = 1
 
     def __getattr__(self, __name: str):
         return getattr(self.config, __name)
 
     def aiohttp_client_session(self):
-        return _default_aiohttp_session(self.config)
+        if self.session is not None:
+            return _lent_session(self.session)
+        return _default_aiohttp_session(self)
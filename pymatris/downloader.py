@@ -1,17 +1,31 @@
 from functools import partial
-from typing import Callable, Optional, Union
+from collections import deque
+from dataclasses import dataclass
+from typing import AsyncIterable, AsyncIterator, Callable, Iterable, Optional, Union
 import contextlib
 import asyncio
 from pymatris.config import SessionConfig, DownloaderConfig
 from pymatris.protocol_handler import ProtocolResolver
 from pymatris.exceptions import FailedDownload
-from .utils import run_task_in_thread
-from .results import Results
+from pymatris.journal import journal_path
+from pymatris.chunk_queue import MemoryBudget
+from pymatris.pool import ConnectionPool
+from pymatris.io_threads import DeviceWriters
+from pymatris.rate_limit import BandwidthLimits
+from pymatris.host_limits import HostSlots, host_of
+from pymatris.metrics import Metrics
+from pymatris.checksum import parse_checksum
+from pymatris.manifest import Manifest
+from pymatris.progress import FileProgress, ProgressAggregator
+from pymatris.process_pool import download_in_processes
+from .utils import new_event_loop, run_task_in_thread
+from .results import Error, Results, Success
 import pathlib
 import os
 import aiohttp
 from pymatris.utils import (
     default_name,
+    given_name,
     replace_tempfile,
     remove_file,
     _QueueList,
@@ -35,6 +49,9 @@ class Downloader:
         all_progress: bool = True,
         overwrite: bool = False,
         session_config: Optional[SessionConfig] = None,
+        max_host_connections: Optional[int] = None,
+        processes: int = 1,
+        session: Optional[aiohttp.ClientSession] = None,
     ):
         self.config = DownloaderConfig(
             max_parallel=max_parallel,
@@ -42,11 +59,17 @@ class Downloader:
             max_tries=max_tries,
             all_progress=all_progress,
             overwrite=overwrite,
+            max_host_connections=max_host_connections,
+            processes=processes,
             config=session_config,
+            session=session,
         )
         self.download_queue = _QueueList()  # Queue that will hold all download task
         self._configure_logging()  # Configure logging
         self.tqdm = tqdm_std  # Configure progress bar writer
+        self.backpressure = 0  # Chunks that waited for a writer in the last run
+        self.metrics = Metrics()  # Accumulated over all runs of this downloader
+        self.manifest = None  # Manifest of the last run, in sync mode
 
     def enqueue_file(
         self,
@@ -55,6 +78,18 @@ class Downloader:
         filename: Optional[Union[str, os.PathLike]] = None,
         overwrite: Optional[bool] = None,
         **kwargs,
+    ):
+        self.download_queue.append(
+            self._build_download(url, path, filename, overwrite, **kwargs)
+        )
+
+    def _build_download(
+        self,
+        url: str,
+        path: Optional[Union[str, os.PathLike]] = None,
+        filename: Optional[Union[str, os.PathLike]] = None,
+        overwrite: Optional[bool] = None,
+        **kwargs,
     ):
         # Build filepath function
         # if not path and not filename:
@@ -69,11 +104,15 @@ class Downloader:
             filepath = partial(default_name, path)
         else:
             # If filename is provided, then use it, make it a callback
-            def filepath(url, resp):
-                return path / filename
+            filepath = partial(given_name, path, filename)
 
         overwrite = overwrite or self.config.overwrite
 
+        if isinstance(kwargs.get("checksum"), str):
+            kwargs["checksum"] = parse_checksum(kwargs["checksum"])
+
+        if not isinstance(url, str):
+            raise TypeError(f"url must be a string, got {url!r}")
         # Restrict unsupported protocols
         scheme = urllib.parse.urlparse(url).scheme
         if scheme not in ProtocolResolver.supported_protocols():
@@ -81,7 +120,7 @@ class Downloader:
                 f"URL must start with either:  {ProtocolResolver.supported_protocols()}"
             )
 
-        self.download_queue.append((url, filepath, overwrite, kwargs))
+        return (url, filepath, overwrite, kwargs)
 
     @property
     def queued_downloads(self):
@@ -93,6 +132,134 @@ class Downloader:
             queue.put_nowait(Token(i + 1))
         return queue
 
+    def _new_run(self, session):
+        progress = None
+        if self.config.file_progress and self.config.progress != "tqdm":
+            progress = ProgressAggregator(
+                self.config.progress, self.config.progress_interval, tqdm=self.tqdm
+            )
+            progress.start()
+        return _Run(
+            session=session,
+            memory_budget=MemoryBudget(self.config.total_buffer_bytes),
+            pool=ConnectionPool(
+                self.config.max_host_connections, self.config.pool_idle_timeout
+            ),
+            limits=BandwidthLimits(
+                self.config.max_bytes_per_sec,
+                self.config.per_host_limits,
+                self.config.file_max_bytes_per_sec,
+            ),
+            host_slots=HostSlots(self.config.max_host_connections),
+            manifest=Manifest.load(self.config.manifest)
+            if self.config.manifest
+            else None,
+            progress=progress,
+            writers=DeviceWriters(self.config.writer_threads)
+            if self.config.writer == "threads"
+            else None,
+        )
+
+    async def _close_run(self, run):
+        await run.pool.close()
+        if run.writers is not None:
+            run.writers.close()
+        if run.progress is not None:
+            await run.progress.stop()
+        if run.manifest is not None:
+            run.manifest.save()
+        self.manifest = run.manifest
+        self.backpressure = run.memory_budget.backpressure
+        self.metrics.inc("backpressure_total", self.backpressure)
+        if self.backpressure:
+            pymatris.log.debug(
+                "Download workers waited for writers %d times",
+                self.backpressure,
+            )
+
+    def _wanted_slots(self, download):
+        # As many connections as the protocol opens for the splits of the file
+        max_splits = download[3].get("max_splits") or self.config.max_splits
+        scheme = download[0].split("://")[0]
+        return ProtocolResolver.host_connections(scheme, max_splits)
+
+    def _start_download(self, download, token, run, slots):
+        url, filepath_partial, overwrite, kwargs = download
+        kwargs = dict(kwargs)
+        rate_limiter = run.limits.for_file(url, kwargs.pop("max_bytes_per_sec", None))
+        if slots < self._wanted_slots(download):
+            # More splits than slots would go over the host's connection budget
+            kwargs["max_splits"] = slots
+
+        scheme = url.split("://")[0]
+        handler = ProtocolResolver.get_handler(scheme)
+
+        if run.progress is not None:
+            file_pb = run.progress.file
+        else:
+            file_pb = self.tqdm if self.config.file_progress else False
+
+        def close_pb_callback(pb):
+            if isinstance(pb, (self.tqdm, FileProgress)):
+                pb.close()
+
+        # Tasks inherit the probe, so retries and workers deep down can find it
+        probe = self.metrics.file_probe(url)
+        bound = self.metrics.bind(probe)
+        try:
+            task = asyncio.create_task(
+                handler.run_download(
+                    self.config,  # pass configuration
+                    run.session,  # pass session
+                    url,  # user defined
+                    filepath_partial,  # user defined
+                    overwrite,  # user defined
+                    token=token,  # injected
+                    file_pb=file_pb,  # injected
+                    pb_callback=close_pb_callback,  # injected
+                    memory_budget=run.memory_budget,  # injected
+                    pool=run.pool,  # injected
+                    rate_limiter=rate_limiter,  # injected
+                    manifest=run.manifest,  # injected
+                    writers=run.writers,  # injected
+                    **kwargs,  # user defined, include headers, etc
+                )
+            )
+        finally:
+            self.metrics.unbind(bound)
+        task.add_done_callback(
+            lambda t: probe.finish(
+                asyncio.CancelledError() if t.cancelled() else t.exception()
+            )
+        )
+        host = host_of(url)
+        task.add_done_callback(lambda _: run.host_slots.release(host, slots))
+        return task
+
+    def _finalize_download(self, res) -> Union[Success, Error]:
+        """Move a finished tempfile into place, or clean up after a failed one."""
+        if isinstance(res, FailedDownload):
+            tempfile = str(res.filepath_partial) + ".matris"
+            # Partial downloads with a journal are continued on the next run
+            if not (self.config.resume and journal_path(tempfile).exists()):
+                remove_file(tempfile)
+                remove_file(journal_path(tempfile))
+            pymatris.log.info(
+                "%s failed to download with exception\n" "%s",
+                res.url,
+                res.exception,
+            )
+            return Error(res.filepath_partial, res.url, res.exception)
+        elif isinstance(res, BaseException):
+            raise res
+        else:
+            requested_url, filepath, tempfilepath = res
+            # No tempfile when the file was unchanged and skipped
+            if tempfilepath is not None:
+                replace_tempfile(str(tempfilepath))
+                remove_file(journal_path(tempfilepath))
+            return Success(filepath, requested_url)
+
     def _format_results_and_remove_tempfile(
         self, dl_results: Results, main_pb: Optional[tqdm_std]
     ):
@@ -107,20 +274,11 @@ class Downloader:
 
         results = Results()
         for res in dl_results:
-            if isinstance(res, FailedDownload):
-                remove_file(str(res.filepath_partial) + ".matris")
-                results.add_error(res.filepath_partial, res.url, res.exception)
-                pymatris.log.info(
-                    "%s failed to download with exception\n" "%s",
-                    res.url,
-                    res.exception,
-                )
-            elif isinstance(res, Exception):
-                raise res
+            result = self._finalize_download(res)
+            if isinstance(result, Error):
+                results.add_error(*result)
             else:
-                requested_url, filepath, tempfilepath = res
-                replace_tempfile(str(tempfilepath))
-                results.append(path=filepath, url=requested_url)
+                results.append(path=result.path, url=result.url)
 
         return results
 
@@ -128,43 +286,25 @@ class Downloader:
         futures = []
         tokens = self._generate_tokens()
         total_files = self.queued_downloads
-        dl_queue = self.download_queue.generate_queue()
+        waiting = deque(self.download_queue)
+        self.download_queue.clear()
         results = ret_results = None
 
         with self._get_main_pb(total_files) as main_pb:
             async with self.config.aiohttp_client_session() as session:
+                run = self._new_run(session)
                 try:
-                    while not dl_queue.empty():
-                        (
-                            url,
-                            filepath_partial,
-                            overwrite,
-                            kwargs,
-                        ) = await dl_queue.get()
-
-                        scheme = url.split("://")[0]
-                        handler = ProtocolResolver.get_handler(scheme)
-
-                        file_pb = self.tqdm if self.config.file_progress else False
+                    while waiting:
                         token = await tokens.get()
-
-                        def close_pb_callback(pb):
-                            if isinstance(pb, self.tqdm):
-                                pb.close()
-
-                        future = asyncio.create_task(
-                            handler.run_download(
-                                self.config,  # pass configuration
-                                session,  # pass session
-                                url,  # user defined
-                                filepath_partial,  # user defined
-                                overwrite,  # user defined
-                                token=token,  # injected
-                                file_pb=file_pb,  # injected
-                                pb_callback=close_pb_callback,  # injected
-                                **kwargs,  # user defined, include headers, etc
+                        # Skip files of hosts that are out of connections
+                        ready = run.host_slots.take_ready(waiting, self._wanted_slots)
+                        while ready is None:
+                            await run.host_slots.wait_release()
+                            ready = run.host_slots.take_ready(
+                                waiting, self._wanted_slots
                             )
-                        )
+                        download, slots = ready
+                        future = self._start_download(download, token, run, slots)
 
                         def callback(token, future, main_pb):
                             try:
@@ -185,12 +325,99 @@ class Downloader:
                         task.cancel()
                     results = await asyncio.gather(*futures, return_exceptions=True)
                 finally:
+                    await self._close_run(run)
                     ret_results = self._format_results_and_remove_tempfile(
                         results, main_pb
                     )
         return ret_results
 
+    async def stream(
+        self,
+        downloads: Union[AsyncIterable, Iterable],
+        path: Optional[Union[str, os.PathLike]] = None,
+    ) -> AsyncIterator[Union[Success, Error]]:
+        """
+        Download files pulled lazily from ``downloads``, yielding each result as it finishes.
+
+        Items are URLs, or dicts of `enqueue_file` arguments with a ``url`` key.
+        The next item is only pulled once a download slot is free, so neither the
+        items nor their tasks and results are held in memory all at once.
+        """
+        tokens = self._generate_tokens()
+        if not hasattr(downloads, "__aiter__"):
+            downloads = _iterate(downloads)
+        downloads = downloads.__aiter__()
+        exhausted = False
+        waiting = deque()  # Pulled, but their hosts are out of connections
+        pending = {}  # task -> token
+
+        with self._get_main_pb(None) as main_pb:
+            async with self.config.aiohttp_client_session() as session:
+                run = self._new_run(session)
+                try:
+                    while True:
+                        while not tokens.empty():
+                            ready = run.host_slots.take_ready(
+                                waiting, self._wanted_slots
+                            )
+                            if ready is not None:
+                                download, slots = ready
+                                token = tokens.get_nowait()
+                                task = self._start_download(download, token, run, slots)
+                                pending[task] = token
+                                continue
+                            if exhausted or len(waiting) >= self.config.max_parallel:
+                                break
+
+                            try:
+                                item = await downloads.__anext__()
+                            except StopAsyncIteration:
+                                exhausted = True
+                                continue
+                            if not isinstance(item, dict):
+                                item = {"url": item}
+                            try:
+                                waiting.append(
+                                    self._build_download(**{"path": path, **item})
+                                )
+                            except (TypeError, ValueError) as e:
+                                yield Error(None, item.get("url"), e)
+
+                        if not pending:
+                            break
+
+                        done, _ = await asyncio.wait(
+                            pending, return_when=asyncio.FIRST_COMPLETED
+                        )
+                        for task in done:
+                            tokens.put_nowait(pending.pop(task))
+                            result = self._finalize_download(
+                                task.exception() or task.result()
+                            )
+                            if main_pb is not None and isinstance(result, Success):
+                                main_pb.update(1)
+                            yield result
+                finally:
+                    for task in pending:
+                        task.cancel()
+                    for res in await asyncio.gather(*pending, return_exceptions=True):
+                        if isinstance(res, FailedDownload) or not isinstance(
+                            res, BaseException
+                        ):
+                            self._finalize_download(res)
+                    await self._close_run(run)
+
     def download(self):
+        if self.config.session is not None:
+            # A session only works on the event loop it was made on
+            raise RuntimeError(
+                "download() runs on its own event loop, await run_download() or "
+                "use stream() on the loop of the given session instead"
+            )
+        if self.config.processes > 1 and self.queued_downloads > 1:
+            # Spread over several event loops to use more than one core
+            return download_in_processes(self, self.config.processes)
+
         try:
             loop = asyncio.get_running_loop()
         except RuntimeError:
@@ -199,17 +426,21 @@ class Downloader:
         should_run_in_thread = loop and loop.is_running()
 
         if should_run_in_thread or loop is None:
-            loop = asyncio.new_event_loop()
+            loop = new_event_loop(self.config.loop_factory)
 
         task = loop.create_task(self.run_download())
 
         # Add signal handlers to the loop
         self._add_signal_handler(loop, task)
 
-        if should_run_in_thread:
-            return run_task_in_thread(loop, task)
+        try:
+            if should_run_in_thread:
+                return run_task_in_thread(loop, task)
 
-        return loop.run_until_complete(task)
+            return loop.run_until_complete(task)
+        finally:
+            # Give SIGINT/SIGTERM back to the application once we are done
+            self._remove_signal_handler(loop)
 
     @staticmethod
     def _add_signal_handler(loop, task):
@@ -225,6 +456,16 @@ class Downloader:
         for sig in (signal.SIGINT, signal.SIGTERM):
             loop.add_signal_handler(sig, task.cancel)
 
+    @staticmethod
+    def _remove_signal_handler(loop):
+        if os.name == "nt" or threading.current_thread() != threading.main_thread():
+            return
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(sig)
+        # uvloop puts its own handler back, which swallows later signals
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
     def _get_main_pb(self, total: int):
         if self.config.all_progress:
             return self.tqdm(
@@ -267,3 +508,22 @@ class Downloader:
         asyncssh_logger.addHandler(sh)
         asyncssh_logger.setLevel(self.config.log_level)
         pymatris.log.debug("pymatris configured to debug level logging...")
+
+
+@dataclass
+class _Run:
+    """Objects shared by all downloads of one run."""
+
+    session: aiohttp.ClientSession
+    memory_budget: MemoryBudget
+    pool: ConnectionPool
+    limits: BandwidthLimits
+    host_slots: HostSlots
+    manifest: Optional[Manifest] = None
+    progress: Optional[ProgressAggregator] = None
+    writers: Optional[DeviceWriters] = None
+
+
+async def _iterate(items: Iterable):
+    for item in items:
+        yield item
@@ -72,3 +72,13 @@ class FailedHTTPRequestError(Exception):
                 self.__class__,
                 str(self.response),
             )
+
+
+class ChecksumMismatchError(Exception):
+    def __init__(self, algorithm: str, expected: str, actual: str) -> None:
+        self.algorithm = algorithm
+        self.expected = expected
+        self.actual = actual
+        super().__init__(
+            f"{algorithm} checksum mismatch: expected {expected}, got {actual}"
+        )
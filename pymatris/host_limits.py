@@ -0,0 +1,63 @@
+import asyncio
+import urllib.parse
+from collections import defaultdict
+from typing import Deque, Dict, Optional, Tuple
+
+__all__ = ["HostSlots", "host_of"]
+
+
+def host_of(url: str) -> Optional[str]:
+    return urllib.parse.urlparse(url).hostname
+
+
+class HostSlots:
+    """
+    Connections each host may have open at once, across all files of a run.
+
+    A file takes one slot to start, plus one for every extra split its
+    protocol opens a connection for, so files and their splits share the same
+    per-host budget.
+    ``limit=None`` never runs out of slots.
+    """
+
+    def __init__(self, limit: Optional[int] = None) -> None:
+        self.limit = limit
+        self.used: Dict[Optional[str], int] = defaultdict(int)
+        self._released = asyncio.Event()
+
+    def free(self, host: Optional[str]) -> Optional[int]:
+        if self.limit is None:
+            return None
+        return self.limit - self.used[host]
+
+    def take(self, host: Optional[str], wanted: int) -> int:
+        """Take up to ``wanted`` slots, returns how many were taken (0 if the host is full)."""
+        free = self.free(host)
+        n = wanted if free is None else min(wanted, free)
+        n = max(n, 0)
+        self.used[host] += n
+        return n
+
+    def release(self, host: Optional[str], n: int) -> None:
+        self.used[host] -= n
+        if not self.used[host]:
+            del self.used[host]
+        self._released.set()
+
+    async def wait_release(self) -> None:
+        self._released.clear()
+        await self._released.wait()
+
+    def take_ready(self, waiting: Deque, wanted) -> Optional[Tuple[object, int]]:
+        """
+        Pop the first download in ``waiting`` whose host has a free slot.
+
+        Returns the download with the slots it got, ``wanted(download)`` being
+        how many it would like, or None when every host in ``waiting`` is full.
+        """
+        for i, download in enumerate(waiting):
+            slots = self.take(host_of(download[0]), wanted(download))
+            if slots:
+                del waiting[i]
+                return download, slots
+        return None
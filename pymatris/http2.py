@@ -0,0 +1,219 @@
+import asyncio
+import contextlib
+from typing import Dict, NamedTuple, Optional
+
+import aiohttp
+
+__all__ = ["HTTP2Session", "HTTP2Response"]
+
+DEFAULT_TIMEOUT = 300  # Seconds, as aiohttp's default total timeout
+
+
+class RequestInfo(NamedTuple):
+    url: str
+    method: str
+    headers: Dict[str, str]
+    real_url: str
+
+
+@contextlib.contextmanager
+def _client_errors(error=aiohttp.ClientConnectionError):
+    # The HTTP handler retries aiohttp errors and timeouts, not httpx's
+    import httpx
+
+    try:
+        yield
+    except httpx.TimeoutException as e:
+        raise asyncio.TimeoutError(str(e)) from e
+    except httpx.HTTPError as e:
+        raise error(f"{type(e).__name__}: {e}") from e
+
+
+def _timeout(timeout):
+    # aiohttp takes a ClientTimeout or a total in seconds, httpx a timeout per
+    # operation, so the total of a ClientTimeout applies to each read instead
+    if isinstance(timeout, aiohttp.ClientTimeout):
+        return timeout.total
+    return timeout
+
+
+class _Content:
+    """Body of an `HTTP2Response`, read like aiohttp's ``StreamReader``."""
+
+    def __init__(self, response) -> None:
+        self._chunks = response.aiter_bytes()
+        self._buffer = bytearray()
+        self._eof = False
+
+    async def _fill(self) -> None:
+        with _client_errors(aiohttp.ClientPayloadError):
+            try:
+                self._buffer += await self._chunks.__anext__()
+            except StopAsyncIteration:
+                self._eof = True
+
+    def _take(self, n: int) -> bytes:
+        data = bytes(self._buffer[:n])
+        del self._buffer[:n]
+        return data
+
+    async def read(self, n: int = -1) -> bytes:
+        if n < 0:
+            while not self._eof:
+                await self._fill()
+            return self._take(len(self._buffer))
+        while not self._buffer and not self._eof:
+            await self._fill()
+        return self._take(n)
+
+    def is_eof(self) -> bool:
+        return self._eof
+
+    async def readexactly(self, n: int) -> bytes:
+        while len(self._buffer) < n and not self._eof:
+            await self._fill()
+        if len(self._buffer) < n:
+            raise asyncio.IncompleteReadError(self._take(len(self._buffer)), n)
+        return self._take(n)
+
+
+class HTTP2Response:
+    """The parts of ``aiohttp.ClientResponse`` the HTTP handler uses, over httpx."""
+
+    def __init__(self, session: "HTTP2Session", response, method: str) -> None:
+        self._session = session
+        self._response = response
+        self._released = False
+        self.status = response.status_code
+        self.reason = response.reason_phrase
+        self.version = response.http_version
+        self.headers = response.headers  # Case insensitive, like aiohttp's
+        self.url = str(response.url)
+        self.history = tuple(response.history)
+        self.request_info = RequestInfo(
+            self.url, method, response.request.headers, self.url
+        )
+        self.content = _Content(response)
+
+    def __repr__(self) -> str:
+        return f"<HTTP2Response({self.url}) [{self.status} {self.reason}]>"
+
+    @property
+    def content_length(self) -> Optional[int]:
+        size = self.headers.get("content-length", None)
+        return int(size) if size is not None else None
+
+    async def read(self) -> bytes:
+        return await self.content.read()
+
+    async def text(self) -> str:
+        body = await self.read()
+        return body.decode(self._response.encoding or "utf-8", errors="replace")
+
+    def release(self) -> None:
+        # Synchronous in aiohttp, so the stream is closed in the background
+        if not self._released:
+            self._released = True
+            self._session._close_response(self._response)
+
+    close = release
+
+    async def __aenter__(self) -> "HTTP2Response":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.release()
+
+
+class _RequestContext:
+    """Like aiohttp's, awaited for the response or used with ``async with``."""
+
+    def __init__(self, coro) -> None:
+        self._coro = coro
+        self._resp: Optional[HTTP2Response] = None
+
+    def __await__(self):
+        return self._coro.__await__()
+
+    async def __aenter__(self) -> HTTP2Response:
+        self._resp = await self._coro
+        return self._resp
+
+    async def __aexit__(self, *exc) -> None:
+        self._resp.release()
+
+
+class HTTP2Session:
+    """
+    Session with the methods of ``aiohttp.ClientSession`` the HTTP handler uses,
+    sending requests over HTTP/2 with httpx.
+
+    Files and splits to the same host are multiplexed as streams of a single
+    connection instead of opening a TCP+TLS connection each. HTTP/2 is
+    negotiated over TLS, and falls back to HTTP/1.1 for servers without it.
+    ``prior_knowledge`` only speaks HTTP/2, which also works over plain http://.
+    """
+
+    def __init__(
+        self,
+        headers: Optional[Dict[str, str]] = None,
+        prior_knowledge: bool = False,
+        **kwargs,
+    ) -> None:
+        try:
+            import httpx
+        except ImportError as e:
+            raise ImportError(
+                'http2 needs the optional httpx package, pip install "httpx[http2]"'
+            ) from e
+        kwargs.setdefault("timeout", DEFAULT_TIMEOUT)
+        self._client = httpx.AsyncClient(
+            http1=not prior_knowledge, http2=True, headers=headers, **kwargs
+        )
+        self._closing = set()
+
+    def head(self, url: str, allow_redirects: bool = False, **kwargs):
+        return _RequestContext(
+            self._request("HEAD", url, allow_redirects=allow_redirects, **kwargs)
+        )
+
+    def get(self, url: str, allow_redirects: bool = True, **kwargs):
+        return _RequestContext(
+            self._request("GET", url, allow_redirects=allow_redirects, **kwargs)
+        )
+
+    async def _request(
+        self, method, url, allow_redirects, timeout=None, headers=None
+    ) -> HTTP2Response:
+        options = {} if timeout is None else {"timeout": _timeout(timeout)}
+        request = self._client.build_request(method, url, headers=headers, **options)
+        with _client_errors():
+            response = await self._client.send(
+                request, stream=True, follow_redirects=allow_redirects
+            )
+        return HTTP2Response(self, response, method)
+
+    def _close_response(self, response) -> None:
+        if response.is_closed:
+            return
+        task = asyncio.ensure_future(self._aclose(response))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    @staticmethod
+    async def _aclose(response) -> None:
+        try:
+            await response.aclose()
+        except Exception:
+            pass  # The stream is reset, there is nobody to report to
+
+    async def close(self) -> None:
+        if self._closing:
+            await asyncio.gather(*self._closing, return_exceptions=True)
+        await self._client.aclose()
+
+    async def __aenter__(self) -> "HTTP2Session":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
@@ -0,0 +1,92 @@
+import os
+import asyncio
+import queue
+import threading
+from typing import Callable, Dict, List
+
+__all__ = ["DeviceWriters"]
+
+_STOP = None  # Item telling a writer thread to exit
+
+
+def _set_result(future: asyncio.Future, error) -> None:
+    if future.cancelled():
+        return
+    if error is None:
+        future.set_result(None)
+    else:
+        future.set_exception(error)
+
+
+def _writer_thread(requests: queue.SimpleQueue) -> None:
+    while True:
+        request = requests.get()
+        if request is _STOP:
+            return
+        loop, future, func, args = request
+        error = None
+        try:
+            func(*args)
+        except BaseException as e:
+            error = e
+        try:
+            loop.call_soon_threadsafe(_set_result, future, error)
+        except RuntimeError:
+            pass  # The loop is closed, nobody waits for this write anymore
+
+
+class _Device:
+    """Threads doing the writes to one filesystem, fed through a `queue.SimpleQueue`."""
+
+    def __init__(self, device: int, threads: int) -> None:
+        self.requests = queue.SimpleQueue()
+        self.threads: List[threading.Thread] = []
+        for i in range(threads):
+            thread = threading.Thread(
+                target=_writer_thread,
+                args=(self.requests,),
+                name=f"pymatris-writer-{device}-{i}",
+                daemon=True,
+            )
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, func: Callable, *args) -> asyncio.Future:
+        """Future of calling ``func(*args)`` on one of the threads, like ``run_in_executor``."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.requests.put((loop, future, func, args))
+        return future
+
+    def close(self) -> None:
+        for _ in self.threads:
+            self.requests.put(_STOP)
+        for thread in self.threads:
+            thread.join()
+
+
+class DeviceWriters:
+    """
+    Dedicated writer threads of one download run, ``threads`` per filesystem.
+
+    The writers of every file on a filesystem hand their positional writes to
+    the same threads, instead of each going through the loop's default
+    executor, and the event loop is left with only the network to serve.
+    """
+
+    def __init__(self, threads: int = 1) -> None:
+        self.threads = threads
+        self._devices: Dict[int, _Device] = {}
+
+    def for_fd(self, fd: int) -> _Device:
+        """Writer threads of the filesystem ``fd`` is on, started on first use."""
+        device = os.fstat(fd).st_dev
+        if device not in self._devices:
+            self._devices[device] = _Device(device, self.threads)
+        return self._devices[device]
+
+    def close(self) -> None:
+        """Stop all threads once they are done with the writes handed to them."""
+        devices, self._devices = self._devices, {}
+        for device in devices.values():
+            device.close()
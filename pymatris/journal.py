@@ -0,0 +1,145 @@
+import os
+import json
+import time
+import pathlib
+from bisect import bisect_left
+from typing import List, Optional, Tuple
+
+import pymatris
+
+__all__ = ["RangeJournal", "journal_path"]
+
+JOURNAL_SUFFIX = ".journal"
+JOURNAL_INTERVAL = 1.0  # Seconds between two checkpoints of the journal
+
+
+def journal_path(tempfile: os.PathLike) -> pathlib.Path:
+    """Path of the range journal that sits next to a tempfile
+
+    Args:
+        tempfile (os.PathLike): tempfile's path, e.g. ``file.txt.matris``
+
+    Returns:
+        pathlib.Path: journal's path, e.g. ``file.txt.matris.journal``
+    """
+    tempfile = pathlib.Path(tempfile)
+    return tempfile.parent / (tempfile.name + JOURNAL_SUFFIX)
+
+
+class RangeJournal:
+    """
+    Byte ranges of a tempfile that are already written to disk.
+
+    The journal is checkpointed next to the tempfile while downloading, so an
+    interrupted download can request only the missing ranges on the next run.
+    Ranges are half-open ``[start, end)`` and kept sorted and merged.
+    """
+
+    # Tempfiles currently owned by a journal in this process, so a clashing
+    # filename in the same run is never resumed into a file being written.
+    _in_use = set()
+
+    def __init__(self, tempfile: os.PathLike):
+        self.tempfile = pathlib.Path(tempfile)
+        self.path = journal_path(self.tempfile)
+        self.size: Optional[int] = None
+        self.ranges: List[List[int]] = []
+        self._dirty = False
+        self._last_save = time.monotonic()
+
+    @classmethod
+    def load(cls, tempfile: os.PathLike) -> "RangeJournal":
+        journal = cls(tempfile)
+        RangeJournal._in_use.add(str(journal.tempfile))
+        if not journal.path.exists() or not journal.tempfile.exists():
+            return journal
+
+        try:
+            with open(journal.path) as f:
+                state = json.load(f)
+            journal.size = state.get("size", None)
+            for start, end in state.get("ranges", []):
+                journal.add(int(start), int(end) - int(start))
+            journal._dirty = False
+        except (OSError, ValueError, TypeError) as e:
+            pymatris.log.warning("Ignoring unreadable journal %s: %s", journal.path, e)
+            journal.size = None
+            journal.ranges = []
+        return journal
+
+    @classmethod
+    def in_use(cls, tempfile: os.PathLike) -> bool:
+        return str(pathlib.Path(tempfile)) in cls._in_use
+
+    def release(self) -> None:
+        RangeJournal._in_use.discard(str(self.tempfile))
+
+    @property
+    def completed(self) -> int:
+        return sum(end - start for start, end in self.ranges)
+
+    def validate(self, size: Optional[int]) -> bool:
+        """Keep the recorded ranges only if they describe a file of ``size`` bytes.
+
+        Returns:
+            bool: whether previously downloaded ranges can be reused
+        """
+        if size is None or self.size != size:
+            self.reset(size)
+            return False
+        return bool(self.ranges)
+
+    def reset(self, size: Optional[int]) -> None:
+        self.size = size
+        self.ranges = []
+        self._dirty = True
+
+    def add(self, offset: int, length: int) -> None:
+        if length <= 0:
+            return
+        start, end = offset, offset + length
+        ranges = self.ranges
+        i = bisect_left(ranges, [start, start])
+        # Merge with the previous range if it touches or overlaps
+        if i > 0 and ranges[i - 1][1] >= start:
+            i -= 1
+            start = ranges[i][0]
+            end = max(end, ranges[i][1])
+        j = i
+        while j < len(ranges) and ranges[j][0] <= end:
+            end = max(end, ranges[j][1])
+            j += 1
+        ranges[i:j] = [[start, end]]
+        self._dirty = True
+
+    def missing(self, size: int) -> List[Tuple[int, int]]:
+        """Half-open byte ranges of a ``size`` bytes file that are not written yet."""
+        gaps = []
+        pos = 0
+        for start, end in self.ranges:
+            if start > pos:
+                gaps.append((pos, min(start, size)))
+            pos = max(pos, end)
+            if pos >= size:
+                break
+        if pos < size:
+            gaps.append((pos, size))
+        return gaps
+
+    def checkpoint(self) -> None:
+        if self._dirty and time.monotonic() - self._last_save >= JOURNAL_INTERVAL:
+            self.save()
+
+    def save(self) -> None:
+        if not self._dirty:
+            return
+        tmp_path = self.path.parent / (self.path.name + ".tmp")
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump({"size": self.size, "ranges": self.ranges}, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            pymatris.log.warning("Failed to save journal %s: %s", self.path, e)
+            return
+        self._dirty = False
+        self._last_save = time.monotonic()
@@ -1,6 +1,26 @@
+import os
 import sys
+import json
+import asyncio
 import argparse
 from pymatris import Downloader, SessionConfig
+from pymatris.progress import PROGRESS_MODES
+from pymatris.results import Success
+from pymatris.utils import new_event_loop
+
+# enqueue_file() arguments a JSON line of --input-file may set
+INPUT_KEYS = (
+    "url",
+    "path",
+    "filename",
+    "overwrite",
+    "headers",
+    "checksum",
+    "max_splits",
+    "max_tries",
+    "chunksize",
+    "max_bytes_per_sec",
+)
 
 
 def parse_args(args):
@@ -11,9 +31,23 @@ def parse_args(args):
         "urls",
         metavar="URLS",
         type=str,
-        nargs="+",
+        nargs="*",
         help="URLs of files to be downloaded.",
     )
+    parser.add_argument(
+        "--input-file",
+        type=str,
+        default=None,
+        dest="input_file",
+        help="Read URLs from this file, '-' for stdin. One URL or JSON object of enqueue_file() arguments per line.",
+    )
+    parser.add_argument(
+        "--manifest-out",
+        type=str,
+        default=None,
+        dest="manifest_out",
+        help="Append a JSON line per finished file to this file, as files complete.",
+    )
     parser.add_argument(
         "--max-parallel",
         type=int,
@@ -35,6 +69,12 @@ def parse_args(args):
         dest="max_tries",
         help="Maximum number of download attempt per url.",
     )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="Number of processes to spread the downloads over, each with its own event loop.",
+    )
     parser.add_argument(
         "--timeouts",
         type=int,
@@ -55,6 +95,40 @@ def parse_args(args):
         default=False,
         help="Overwrite if file exists. Only one url with the clashing name will overwrite the file.",
     )
+    parser.add_argument(
+        "--resume",
+        action="store_const",
+        const=True,
+        default=False,
+        help="Keep partially downloaded files and continue them on the next run.",
+    )
+    parser.add_argument(
+        "--sync",
+        type=str,
+        default=None,
+        metavar="MANIFEST",
+        help="Record downloads in the MANIFEST file and skip files that are unchanged on the server.",
+    )
+    parser.add_argument(
+        "--uvloop",
+        action="store_const",
+        const=True,
+        default=False,
+        help="Run the downloads on uvloop instead of asyncio's event loop (needs uvloop).",
+    )
+    parser.add_argument(
+        "--http2",
+        action="store_const",
+        const=True,
+        default=False,
+        help="Download HTTPS over HTTP/2, one multiplexed connection per host (needs httpx[http2]).",
+    )
+    parser.add_argument(
+        "--progress",
+        choices=PROGRESS_MODES,
+        default="tqdm",
+        help="A progress bar per file, one bar of all bytes, or JSON lines on stderr.",
+    )
     parser.add_argument(
         "--quiet",
         action="store_const",
@@ -85,26 +159,127 @@ def parse_args(args):
         parser.print_help()
         exit()
 
+    if not args.urls and args.input_file is None:
+        parser.error("no URLs given, pass URLS or --input-file")
+    # Streamed downloads run on the one event loop of this process
+    streaming = args.input_file is not None or args.manifest_out is not None
+    if streaming and args.processes > 1:
+        parser.error(
+            "--processes cannot be combined with --input-file or --manifest-out"
+        )
+
     return args
 
 
+def parse_input_line(line: str, number: int = 0):
+    """A URL, or a dict of enqueue_file() arguments, or None to skip the line."""
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+    if not line.startswith("{"):
+        return line
+
+    try:
+        item = json.loads(line)
+    except ValueError as e:
+        print(f"Skipping input line {number}: {e}", file=sys.stderr)
+        return None
+    if not isinstance(item, dict) or "url" not in item:
+        print(f"Skipping input line {number}: no url", file=sys.stderr)
+        return None
+    if not isinstance(item["url"], str):
+        print(f"Skipping input line {number}: url is not a string", file=sys.stderr)
+        return None
+    unknown = set(item) - set(INPUT_KEYS)
+    if unknown:
+        print(
+            f"Skipping input line {number}: unknown keys {sorted(unknown)}",
+            file=sys.stderr,
+        )
+        return None
+    return item
+
+
+async def read_input(urls, f):
+    """Yield ``urls``, then the downloads of ``f`` one line at a time."""
+    for url in urls:
+        yield url
+    if f is None:
+        return
+
+    loop = asyncio.get_running_loop()
+    seekable = f.seekable()
+    number = 0
+    while True:
+        if seekable:
+            line = f.readline()
+        else:
+            # Pipes may block until their producer writes the next line
+            line = await loop.run_in_executor(None, f.readline)
+        if not line:
+            return
+        number += 1
+        item = parse_input_line(line, number)
+        if item is not None:
+            yield item
+
+
+def result_record(result) -> dict:
+    """JSON line of --manifest-out for a `Success` or `Error`."""
+    if isinstance(result, Success):
+        return {"url": result.url, "path": str(result.path), "status": "success"}
+    path = result.filepath_partial
+    return {
+        "url": result.url,
+        "path": str(path) if isinstance(path, (str, os.PathLike)) else None,
+        "status": "error",
+        "error": str(result.exception),
+    }
+
+
+async def stream_pymatris(downloader, args, f, out) -> int:
+    """Download everything of ``args.urls`` and ``f``, returning the number of errors."""
+    errors = 0
+    async for result in downloader.stream(read_input(args.urls, f), path=args.dir):
+        if isinstance(result, Success):
+            print(f"{result.path} downloaded")
+        else:
+            errors += 1
+            if args.show_errors:
+                print(repr(result), file=sys.stderr)
+        if out is not None:
+            out.write(json.dumps(result_record(result)) + "\n")
+            out.flush()
+    return errors
+
+
 def run_pymatris(args):
     log_level = "DEBUG" if args.verbose else None
     config = SessionConfig(
         timeouts=args.timeouts,
         file_progress=not args.quiet,
         log_level=log_level,
+        resume=args.resume,
+        manifest=args.sync,
+        loop_factory="uvloop" if args.uvloop else None,
+        progress=args.progress,
+        http2=args.http2,
     )
 
     downloader = Downloader(
         max_parallel=args.max_parallel,
         max_splits=args.max_splits,
         max_tries=args.max_tries,
+        processes=args.processes,
         all_progress=not args.quiet,
         overwrite=args.overwrite,
         session_config=config,
     )
 
+    if args.input_file is not None or args.manifest_out is not None:
+        # Pulled lazily and reported as they finish, so lists of any size fit
+        sys.exit(run_stream(downloader, args))
+
     for url in args.urls:
         downloader.enqueue_file(url, path=args.dir)
     results = downloader.download()
@@ -125,6 +300,35 @@ def run_pymatris(args):
     sys.exit(0)
 
 
+def run_stream(downloader, args) -> int:
+    f = out = None
+    loop = new_event_loop(downloader.config.loop_factory)
+    try:
+        if args.input_file == "-":
+            f = sys.stdin
+        elif args.input_file is not None:
+            f = open(args.input_file)
+        if args.manifest_out is not None:
+            out = open(args.manifest_out, "a")
+
+        task = loop.create_task(stream_pymatris(downloader, args, f, out))
+        downloader._add_signal_handler(loop, task)
+        try:
+            errors = loop.run_until_complete(task)
+        except asyncio.CancelledError:
+            return 1
+        finally:
+            downloader._remove_signal_handler(loop)
+    finally:
+        loop.close()
+        if f is not None and f is not sys.stdin:
+            f.close()
+        if out is not None:
+            out.close()
+
+    return 1 if errors and args.show_errors else 0
+
+
 def main():
     args = parse_args(sys.argv[1:])
     run_pymatris(args)
@@ -0,0 +1,147 @@
+import os
+import json
+import time
+import pathlib
+from typing import Dict, NamedTuple, Optional
+
+import pymatris
+
+__all__ = ["Manifest", "ManifestEntry"]
+
+MANIFEST_INTERVAL = 1.0  # Seconds between two saves of the manifest while running
+
+
+def _weak(etag: str) -> str:
+    # If-None-Match uses the weak comparison, W/"x" and "x" are the same version
+    return etag[2:] if etag.startswith("W/") else etag
+
+
+class ManifestEntry(NamedTuple):
+    """Where a URL was saved, and the validators the server sent for it."""
+
+    path: str
+    size: Optional[int]
+    etag: Optional[str] = None
+    modified: Optional[str] = None  # Last-Modified, FTP MDTM or SFTP mtime
+
+    def matches(
+        self,
+        size: Optional[int] = None,
+        etag: Optional[str] = None,
+        modified: Optional[str] = None,
+    ) -> bool:
+        """Whether the remote file described by the arguments is the one recorded.
+
+        A size alone says too little about a file, so an ETag or a modification
+        time has to match as well.
+        """
+        if size is not None and self.size is not None and size != self.size:
+            return False
+        if etag and self.etag:
+            return _weak(etag) == _weak(self.etag)
+        if modified and self.modified:
+            return modified == self.modified
+        return False
+
+    def conditional_headers(self) -> Dict[str, str]:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.modified:
+            headers["If-Modified-Since"] = self.modified
+        return headers
+
+
+class Manifest:
+    """
+    Files downloaded by previous runs, keyed by URL.
+
+    In sync mode, a file is skipped when it is still on disk as it was saved and
+    the server reports the same validators as when it was downloaded.
+    """
+
+    def __init__(self, path: os.PathLike):
+        self.path = pathlib.Path(path)
+        self.entries: Dict[str, ManifestEntry] = {}
+        self.changed: Dict[str, ManifestEntry] = {}  # Recorded by this process
+        self._dirty = False
+        self._last_save = time.monotonic()
+
+    @classmethod
+    def load(cls, path: os.PathLike) -> "Manifest":
+        manifest = cls(path)
+        manifest.entries = manifest._read()
+        return manifest
+
+    def _read(self) -> Dict[str, ManifestEntry]:
+        if not self.path.exists():
+            return {}
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+            return {
+                url: ManifestEntry(
+                    entry["path"],
+                    entry.get("size"),
+                    entry.get("etag"),
+                    entry.get("modified"),
+                )
+                for url, entry in state.get("files", {}).items()
+            }
+        except (OSError, ValueError, TypeError, KeyError) as e:
+            pymatris.log.warning("Ignoring unreadable manifest %s: %s", self.path, e)
+            return {}
+
+    def get(self, url: str) -> Optional[ManifestEntry]:
+        """The entry of ``url``, if its file is still on disk with the recorded size."""
+        entry = self.entries.get(url)
+        if entry is None:
+            return None
+        try:
+            size = os.stat(entry.path).st_size
+        except OSError:
+            return None
+        return entry if size == entry.size else None
+
+    def owns(self, url: str, path: os.PathLike) -> bool:
+        """Whether ``path`` is the file saved for ``url``, which may then be replaced."""
+        entry = self.entries.get(url)
+        return entry is not None and entry.path == str(path)
+
+    def record(
+        self,
+        url: str,
+        path: os.PathLike,
+        size: Optional[int],
+        etag: Optional[str] = None,
+        modified: Optional[str] = None,
+    ) -> None:
+        self.update({url: ManifestEntry(str(path), size, etag, modified)})
+        if time.monotonic() - self._last_save >= MANIFEST_INTERVAL:
+            self.save()
+
+    def update(self, entries: Dict[str, ManifestEntry]) -> None:
+        self.entries.update(entries)
+        self.changed.update(entries)
+        if entries:
+            self._dirty = True
+
+    def save(self) -> None:
+        if not self._dirty:
+            return
+        # Other processes may share the manifest, keep what they recorded meanwhile
+        self.entries = {**self._read(), **self.changed}
+        tmp_path = self.path.parent / (self.path.name + f".{os.getpid()}.tmp")
+        state = {
+            "files": {url: entry._asdict() for url, entry in self.entries.items()}
+        }
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp_path, "w") as f:
+                json.dump(state, f, indent=1)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            pymatris.log.warning("Failed to save manifest %s: %s", self.path, e)
+            return
+        self._dirty = False
+        self._last_save = time.monotonic()
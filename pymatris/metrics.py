@@ -0,0 +1,339 @@
+import time
+import threading
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+
+from pymatris.host_limits import host_of
+
+__all__ = ["Metrics", "FileProbe", "current_probe"]
+
+PREFIX = "pymatris_"
+
+Labels = Tuple[Tuple[str, str], ...]
+
+# Name: (type, help)
+METRICS = {
+    "files_total": ("counter", "Files finished, by outcome (success, skipped or error)"),
+    "bytes_total": ("counter", "Bytes downloaded"),
+    "retries_total": ("counter", "Requests retried after a failure"),
+    "backpressure_total": ("counter", "Chunks that waited for a writer"),
+    "head_seconds": ("summary", "Latency of the HEAD request made before a download"),
+    "time_to_first_byte_seconds": (
+        "summary",
+        "Time from the start of a download to its first chunk",
+    ),
+    "file_seconds": ("summary", "Duration of a file download"),
+    "segment_bytes": ("summary", "Bytes fetched by one segment or split"),
+    "segment_seconds": ("summary", "Duration of one segment or split"),
+    "chunk_queue_depth": (
+        "summary",
+        "Most chunks waiting for the writer in a segment",
+    ),
+    "writer_lag_seconds": (
+        "summary",
+        "Longest time a chunk waited in the queue for the writer in a segment",
+    ),
+    "host_throughput_bytes_per_second": (
+        "gauge",
+        "Bytes per second of a host, from its first start to its last finish",
+    ),
+}
+
+_current_probe: ContextVar[Optional["FileProbe"]] = ContextVar(
+    "pymatris_file_probe", default=None
+)
+
+
+def current_probe() -> Optional["FileProbe"]:
+    """Probe of the file downloaded by the current task, if any."""
+    return _current_probe.get()
+
+
+class FileProbe:
+    """
+    Hot path instrumentation of one file download.
+
+    Chunks are only counted here, and the writer's queue only keeps its
+    deepest and slowest batch. The registry is updated once per segment and
+    when the file finishes.
+    """
+
+    __slots__ = (
+        "metrics",
+        "url",
+        "host",
+        "protocol",
+        "started",
+        "first_byte",
+        "bytes",
+        "retries",
+        "skipped",
+        "queue_depth",
+        "queue_lag",
+    )
+
+    def __init__(self, metrics: "Metrics", url: str) -> None:
+        self.metrics = metrics
+        self.url = url
+        self.host = host_of(url) or ""
+        self.protocol = url.split("://")[0]
+        self.started = time.monotonic()
+        self.first_byte: Optional[float] = None
+        self.bytes = 0
+        self.retries = 0
+        self.skipped = False  # Unchanged since the last sync, nothing downloaded
+        # Worst writer batch since the registry was last updated
+        self.queue_depth = 0
+        self.queue_lag: Optional[float] = None
+
+    def chunk(self, n: int) -> None:
+        if self.first_byte is None:
+            self.first_byte = time.monotonic()
+            self.metrics.observe(
+                "time_to_first_byte_seconds",
+                self.first_byte - self.started,
+                host=self.host,
+            )
+        self.bytes += n
+
+    def head(self, seconds: float) -> None:
+        self.metrics.observe("head_seconds", seconds, host=self.host)
+
+    def segment(self, nbytes: int, seconds: float) -> None:
+        self._report_queue()
+        self.metrics.observe("segment_bytes", nbytes, host=self.host)
+        self.metrics.observe("segment_seconds", seconds, host=self.host)
+        self.metrics.emit("segment", self, bytes=nbytes, seconds=seconds)
+
+    def skip(self) -> None:
+        self.skipped = True
+
+    def retry(self) -> None:
+        self.retries += 1
+        self.metrics.inc("retries_total", host=self.host, protocol=self.protocol)
+        self.metrics.emit("retry", self, retries=self.retries)
+
+    def queued(self, depth: int, lag: float) -> None:
+        self.queue_depth = max(self.queue_depth, depth)
+        self.queue_lag = lag if self.queue_lag is None else max(self.queue_lag, lag)
+
+    def _report_queue(self) -> None:
+        if self.queue_lag is None:
+            return
+        self.metrics.observe("chunk_queue_depth", self.queue_depth, host=self.host)
+        self.metrics.observe("writer_lag_seconds", self.queue_lag, host=self.host)
+        self.queue_depth, self.queue_lag = 0, None
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        now = time.monotonic()
+        self._report_queue()
+        if error is not None:
+            outcome = "error"
+        else:
+            outcome = "skipped" if self.skipped else "success"
+        self.metrics.inc("files_total", outcome=outcome, protocol=self.protocol)
+        self.metrics.inc(
+            "bytes_total", self.bytes, host=self.host, protocol=self.protocol
+        )
+        self.metrics.observe("file_seconds", now - self.started, host=self.host)
+        self.metrics._host_finished(self.host, self.started, now, self.bytes)
+        self.metrics.emit(
+            "file",
+            self,
+            bytes=self.bytes,
+            seconds=now - self.started,
+            retries=self.retries,
+            error=error,
+        )
+
+
+class Metrics:
+    """
+    In-process registry of a Downloader's metrics.
+
+    Values are kept per label set. Callbacks registered with `subscribe` are
+    called with ``(event, probe, values)`` for every ``"file"``, ``"segment"``
+    and ``"retry"`` event.
+    """
+
+    def __init__(self) -> None:
+        self.values: Dict[str, Dict[Labels, float]] = {}
+        # [count, sum, max] of observed values
+        self.summaries: Dict[str, Dict[Labels, List[float]]] = {}
+        self._hosts: Dict[str, List[float]] = {}  # host -> [first start, last end, bytes]
+        self._callbacks: List[Callable] = []
+
+    def subscribe(self, callback: Callable) -> None:
+        self._callbacks.append(callback)
+
+    def emit(self, event: str, probe: FileProbe, **values) -> None:
+        for callback in self._callbacks:
+            callback(event, probe, values)
+
+    def file_probe(self, url: str) -> FileProbe:
+        return FileProbe(self, url)
+
+    def bind(self, probe: FileProbe):
+        """Make ``probe`` the current probe of tasks created until `unbind`."""
+        return _current_probe.set(probe)
+
+    @staticmethod
+    def unbind(token) -> None:
+        _current_probe.reset(token)
+
+    @staticmethod
+    def _labels(labels: Dict[str, str]) -> Labels:
+        return tuple(sorted(labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        series = self.values.setdefault(name, {})
+        key = self._labels(labels)
+        series[key] = series.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        self.values.setdefault(name, {})[self._labels(labels)] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        series = self.summaries.setdefault(name, {})
+        key = self._labels(labels)
+        summary = series.get(key)
+        if summary is None:
+            series[key] = [1, value, value]
+        else:
+            summary[0] += 1
+            summary[1] += value
+            if value > summary[2]:
+                summary[2] = value
+
+    def get(self, name: str, **labels) -> float:
+        """Value of a counter or gauge, summed over the series matching ``labels``."""
+        wanted = set(labels.items())
+        return sum(
+            value
+            for key, value in self.values.get(name, {}).items()
+            if wanted <= set(key)
+        )
+
+    def summary(self, name: str, **labels) -> Tuple[int, float, float]:
+        """``(count, sum, max)`` of a summary over the series matching ``labels``."""
+        wanted = set(labels.items())
+        count = total = peak = 0
+        for key, (c, s, m) in self.summaries.get(name, {}).items():
+            if wanted <= set(key):
+                count += c
+                total += s
+                peak = max(peak, m)
+        return count, total, peak
+
+    def state(self) -> tuple:
+        """Picklable snapshot of all values, to `merge` into another registry."""
+        return self.values, self.summaries, self._hosts
+
+    def merge(self, state: tuple) -> None:
+        """Add the metrics of another registry, e.g. of a download process."""
+        values, summaries, hosts = state
+        for name, series in values.items():
+            if name == "host_throughput_bytes_per_second":
+                continue  # Derived from the host spans below
+            for key, value in series.items():
+                self.inc(name, value, **dict(key))
+        for name, series in summaries.items():
+            mine = self.summaries.setdefault(name, {})
+            for key, (count, total, peak) in series.items():
+                summary = mine.get(key)
+                if summary is None:
+                    mine[key] = [count, total, peak]
+                else:
+                    summary[0] += count
+                    summary[1] += total
+                    summary[2] = max(summary[2], peak)
+        for host, (started, ended, nbytes) in hosts.items():
+            self._host_finished(host, started, ended, nbytes)
+
+    def _host_finished(self, host: str, started: float, ended: float, nbytes: int):
+        span = self._hosts.get(host)
+        if span is None:
+            span = self._hosts[host] = [started, ended, 0]
+        span[0] = min(span[0], started)
+        span[1] = max(span[1], ended)
+        span[2] += nbytes
+        if span[1] > span[0]:
+            self.set(
+                "host_throughput_bytes_per_second",
+                span[2] / (span[1] - span[0]),
+                host=host,
+            )
+
+    def host_throughput(self) -> Dict[str, float]:
+        return {
+            dict(key)["host"]: value
+            for key, value in self.values.get(
+                "host_throughput_bytes_per_second", {}
+            ).items()
+        }
+
+    def to_prometheus(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        lines = []
+        for name, (kind, description) in METRICS.items():
+            full_name = PREFIX + name
+            if kind == "summary":
+                series = list(self.summaries.get(name, {}).items())
+            else:
+                series = list(self.values.get(name, {}).items())
+            if not series:
+                continue
+            lines.append(f"# HELP {full_name} {description}")
+            lines.append(f"# TYPE {full_name} {kind}")
+            for key, value in series:
+                labels = _format_labels(key)
+                if kind == "summary":
+                    count, total, _ = value
+                    lines.append(f"{full_name}_count{labels} {count}")
+                    lines.append(f"{full_name}_sum{labels} {_format_value(total)}")
+                else:
+                    lines.append(f"{full_name}{labels} {_format_value(value)}")
+            if kind == "summary":
+                lines.append(f"# TYPE {full_name}_max gauge")
+                for key, (_, _, peak) in series:
+                    labels = _format_labels(key)
+                    lines.append(f"{full_name}_max{labels} {_format_value(peak)}")
+        return "\n".join(lines) + "\n"
+
+    def serve_prometheus(
+        self, port: int = 9090, addr: str = "127.0.0.1"
+    ) -> ThreadingHTTPServer:
+        """Serve `to_prometheus` over HTTP from a daemon thread, call ``.shutdown()`` to stop."""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.to_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((addr, port), Handler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        return server
+
+
+def _format_labels(key: Labels) -> str:
+    if not key:
+        return ""
+    escaped = (
+        (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in key
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
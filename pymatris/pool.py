@@ -0,0 +1,122 @@
+import time
+import asyncio
+import contextlib
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from urllib.parse import ParseResult
+
+import pymatris
+
+__all__ = ["ConnectionPool", "pool_key"]
+
+PoolKey = Tuple[str, Optional[str], Optional[int], Optional[str], Optional[str]]
+
+
+def pool_key(parse: ParseResult) -> PoolKey:
+    """Connections are only shared between URLs with the same host and credentials."""
+    return (parse.scheme, parse.hostname, parse.port, parse.username, parse.password)
+
+
+class ConnectionPool:
+    """
+    FTP/SFTP connections kept open between files of one download run.
+
+    At most ``max_per_host`` connections per key are handed out at a time,
+    and connections idle for longer than ``idle_timeout`` seconds are closed.
+    """
+
+    def __init__(
+        self, max_per_host: Optional[int] = None, idle_timeout: float = 60.0
+    ) -> None:
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.created = 0
+        self.reused = 0
+        self._idle: Dict[PoolKey, deque] = {}
+        self._slots: Dict[PoolKey, asyncio.Semaphore] = {}
+
+    def _slot(self, key: PoolKey) -> Optional[asyncio.Semaphore]:
+        if self.max_per_host is None:
+            return None
+        if key not in self._slots:
+            self._slots[key] = asyncio.Semaphore(self.max_per_host)
+        return self._slots[key]
+
+    async def acquire(self, key: PoolKey, connect: Callable[[], Awaitable[Any]]) -> Any:
+        slot = self._slot(key)
+        if slot is not None:
+            await slot.acquire()
+        try:
+            await self._evict_idle()
+            idle = self._idle.get(key)
+            if idle:
+                conn, _, _ = idle.pop()
+                self.reused += 1
+                pymatris.log.debug("Reusing pooled connection to %s", key[1])
+                return conn
+            conn = await connect()
+            self.created += 1
+            return conn
+        except BaseException:
+            if slot is not None:
+                slot.release()
+            raise
+
+    async def release(
+        self,
+        key: PoolKey,
+        conn: Any,
+        close: Callable[[Any], Awaitable[None]],
+        reuse: bool = True,
+    ) -> None:
+        """Give ``conn`` back, or close it when it may be broken."""
+        try:
+            if reuse and self.idle_timeout > 0:
+                self._idle.setdefault(key, deque()).append(
+                    (conn, close, time.monotonic())
+                )
+            else:
+                await self._close(conn, close)
+        finally:
+            slot = self._slot(key)
+            if slot is not None:
+                slot.release()
+
+    @contextlib.asynccontextmanager
+    async def connection(self, key, connect, close):
+        conn = await self.acquire(key, connect)
+        try:
+            yield conn
+        except BaseException:
+            await self.release(key, conn, close, reuse=False)
+            raise
+        else:
+            await self.release(key, conn, close)
+
+    async def _evict_idle(self) -> None:
+        deadline = time.monotonic() - self.idle_timeout
+        for idle in self._idle.values():
+            # Oldest connections sit on the left
+            while idle and idle[0][2] < deadline:
+                conn, close, _ = idle.popleft()
+                await self._close(conn, close)
+
+    async def drop_idle(self, key: PoolKey) -> None:
+        """Close the idle connections of ``key``, e.g. once one turned out broken."""
+        idle = self._idle.pop(key, None)
+        while idle:
+            conn, close, _ = idle.popleft()
+            await self._close(conn, close)
+
+    async def close(self) -> None:
+        for idle in self._idle.values():
+            while idle:
+                conn, close, _ = idle.popleft()
+                await self._close(conn, close)
+
+    @staticmethod
+    async def _close(conn, close) -> None:
+        try:
+            await close(conn)
+        except Exception as e:
+            pymatris.log.debug("Failed to close pooled connection: %s", e)
@@ -0,0 +1,219 @@
+import pickle
+import queue
+import dataclasses
+import multiprocessing
+from typing import Dict, List, Optional
+
+import pymatris
+from pymatris.manifest import Manifest
+from pymatris.results import Error, Results
+
+__all__ = ["download_in_processes"]
+
+POLL_INTERVAL = 0.2  # Seconds between checks that the download processes are alive
+
+
+def shard(downloads: list, n: int) -> List[list]:
+    """Deal ``downloads`` round robin into at most ``n`` non-empty shards."""
+    return [downloads[i::n] for i in range(min(n, len(downloads)))]
+
+
+def _divide(value, n: int):
+    if value is None:
+        return None
+    if isinstance(value, int):
+        return max(1, value // n)
+    return value / n
+
+
+def process_count(config, processes: int) -> int:
+    """Processes to use, at most one per parallel file and per host connection."""
+    limits = [config.max_parallel, config.max_host_connections]
+    return max(1, min([processes] + [limit for limit in limits if limit is not None]))
+
+
+def worker_options(config, n: int) -> dict:
+    """
+    ``Downloader`` arguments of one of ``n`` processes.
+
+    Limits that are meant for the whole run (parallel files, connections per
+    host, bandwidth, buffered bytes) are divided between the processes, rounding
+    down, so together they still honour them. ``n`` is at most `process_count`,
+    which leaves every process at least one file and connection.
+    """
+    session_config = dataclasses.replace(
+        config.config,
+        file_progress=False,
+        max_bytes_per_sec=_divide(config.max_bytes_per_sec, n),
+        per_host_limits=(
+            {host: limit / n for host, limit in config.per_host_limits.items()}
+            if config.per_host_limits
+            else config.per_host_limits
+        ),
+        total_buffer_bytes=_divide(config.total_buffer_bytes, n),
+    )
+    return dict(
+        max_parallel=_divide(config.max_parallel, n),
+        max_splits=config.max_splits,
+        max_tries=config.max_tries,
+        all_progress=False,
+        overwrite=config.overwrite,
+        max_host_connections=_divide(config.max_host_connections, n),
+        session_config=session_config,
+    )
+
+
+def _picklable(exception: BaseException) -> BaseException:
+    # Exceptions holding responses or connections cannot cross processes
+    try:
+        pickle.dumps(exception)
+        return exception
+    except Exception:
+        return RuntimeError(f"{type(exception).__name__}: {exception}")
+
+
+def _run_shard(index: int, options: dict, downloads: list, events) -> None:
+    """Entry point of a download process, reporting to the parent through ``events``."""
+    from pymatris.downloader import Downloader
+
+    dm = Downloader(**options)
+    dm.download_queue.extend(downloads)
+    reported: Dict[int, int] = {}  # Bytes already sent per file
+
+    def forward(event, probe, values):
+        if event == "segment":
+            reported[id(probe)] = reported.get(id(probe), 0) + values["bytes"]
+            events.put(("bytes", values["bytes"]))
+        elif event == "file":
+            rest = values["bytes"] - reported.pop(id(probe), 0)
+            if rest > 0:
+                events.put(("bytes", rest))
+            events.put(("file", values["error"] is None))
+
+    dm.metrics.subscribe(forward)
+    results = dm.download()
+    events.put(
+        (
+            "done",
+            index,
+            [tuple(success) for success in results.success],
+            [
+                (error.filepath_partial, error.url, _picklable(error.exception))
+                for error in results.errors
+            ],
+            dm.metrics.state(),
+            dm.manifest.changed if dm.manifest is not None else {},
+            dm.backpressure,
+        )
+    )
+
+
+def download_in_processes(downloader, processes: int) -> Results:
+    """
+    Download the queue of ``downloader`` in ``processes`` processes.
+
+    Each process runs its own event loop and session over a round robin shard
+    of the queue. Their progress, results, metrics and manifest records are
+    merged back into ``downloader``.
+    """
+    downloads = list(downloader.download_queue)
+    downloader.download_queue.clear()
+    shards = shard(downloads, process_count(downloader.config, processes))
+    options = worker_options(downloader.config, len(shards))
+
+    ctx = multiprocessing.get_context("spawn")
+    events = ctx.Queue()
+    procs = [
+        ctx.Process(target=_run_shard, args=(i, options, downloads_, events))
+        for i, downloads_ in enumerate(shards)
+    ]
+    for proc in procs:
+        proc.start()
+
+    done: Dict[int, tuple] = {}
+    bytes_pb = None
+    with downloader._get_main_pb(len(downloads)) as main_pb:
+        if main_pb is not None:
+            bytes_pb = downloader.tqdm(
+                unit="B",
+                unit_scale=True,
+                desc="Bytes Downloaded",
+                position=1,
+                leave=False,
+            )
+        try:
+            while len(done) < len(procs):
+                try:
+                    event = _next_event(events, procs, done)
+                except KeyboardInterrupt:
+                    # Each process cancels its downloads on SIGTERM and still reports
+                    for proc in procs:
+                        if proc.is_alive():
+                            proc.terminate()
+                    continue
+                if event is None:
+                    continue
+                kind = event[0]
+                if kind == "bytes" and bytes_pb is not None:
+                    bytes_pb.update(event[1])
+                elif kind == "file" and event[1] and main_pb is not None:
+                    main_pb.update(1)
+                elif kind == "done":
+                    done[event[1]] = event[2:]
+        finally:
+            if bytes_pb is not None:
+                bytes_pb.close()
+            for proc in procs:
+                proc.join()
+
+    return _merge(downloader, shards, procs, done)
+
+
+def _next_event(events, procs, done) -> Optional[tuple]:
+    try:
+        return events.get(timeout=POLL_INTERVAL)
+    except queue.Empty:
+        pass
+    for i, proc in enumerate(procs):
+        if i not in done and not proc.is_alive():
+            # Its last events may still be in flight
+            try:
+                return events.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                done[i] = None
+    return None
+
+
+def _merge(downloader, shards, procs, done) -> Results:
+    results = Results()
+    manifest_changes = {}
+    downloader.backpressure = 0
+    for i, downloads in enumerate(shards):
+        report = done.get(i)
+        if report is None:
+            error = RuntimeError(
+                f"Download process exited with code {procs[i].exitcode}"
+            )
+            for url, filepath_partial, _, _ in downloads:
+                results.add_error(filepath_partial, url, error)
+            continue
+
+        successes, errors, metrics, changes, backpressure = report
+        for path, url in successes:
+            results.append(path=path, url=url)
+        for error in errors:
+            results.add_error(*Error(*error))
+        downloader.metrics.merge(metrics)
+        manifest_changes.update(changes)
+        downloader.backpressure += backpressure
+
+    if downloader.config.manifest and manifest_changes:
+        manifest = Manifest.load(downloader.config.manifest)
+        manifest.update(manifest_changes)
+        manifest.save()
+
+    if results.errors:
+        pymatris.log.info(
+            "%d/%d files failed to download.", len(results.errors), sum(map(len, shards))
+        )
+    return results
@@ -0,0 +1,146 @@
+import sys
+import json
+import time
+import asyncio
+from typing import Callable, Dict, Optional, Union
+
+__all__ = ["FileProgress", "ProgressAggregator"]
+
+PROGRESS_MODES = ("tqdm", "aggregate", "json")
+
+
+class FileProgress:
+    """
+    Byte counter of one file, a drop-in for the per-file tqdm bar.
+
+    `update` only adds to counters, rendering is left to the aggregator.
+    """
+
+    __slots__ = ("aggregator", "desc", "n", "total", "closed")
+
+    def __init__(
+        self,
+        aggregator: "ProgressAggregator",
+        desc: str,
+        total: Optional[int],
+        initial: int,
+    ) -> None:
+        self.aggregator = aggregator
+        self.desc = desc
+        self.n = initial
+        self.total = total
+        self.closed = False
+
+    def update(self, n: int) -> None:
+        self.n += n
+        self.aggregator.bytes += n
+
+    def close(self) -> None:
+        if not self.closed:
+            self.closed = True
+            self.aggregator._closed(self)
+
+
+class ProgressAggregator:
+    """
+    Progress of all files of a run, rendered at a fixed rate.
+
+    ``mode`` is ``"aggregate"`` for a single tqdm bar of all bytes,
+    ``"json"`` for one JSON line per refresh on ``stream`` (stderr by
+    default), or a callable that is given every snapshot. Files get a
+    `FileProgress` from `file`, which takes the arguments of a tqdm bar.
+    """
+
+    def __init__(
+        self,
+        mode: Union[str, Callable[[Dict], None]] = "aggregate",
+        interval: float = 0.5,
+        tqdm=None,
+        stream=None,
+    ) -> None:
+        self.mode = mode
+        self.interval = interval
+        self.tqdm = tqdm
+        self.stream = stream
+        self.bytes = 0  # Downloaded by this run, resumed bytes are not counted
+        self.total = 0  # Known sizes of the files started so far
+        self.active: Dict[int, FileProgress] = {}
+        self.finished = 0
+        self._bar = None
+        self._task: Optional[asyncio.Task] = None
+        self._started = self._last_time = time.monotonic()
+        self._last_bytes = 0
+
+    def file(
+        self,
+        desc: str = "",
+        total: Optional[int] = None,
+        initial: int = 0,
+        **kwargs,
+    ) -> FileProgress:
+        progress = FileProgress(self, desc, total, initial)
+        self.active[id(progress)] = progress
+        if total:
+            self.total += total - initial
+        return progress
+
+    def _closed(self, progress: FileProgress) -> None:
+        del self.active[id(progress)]
+        self.finished += 1
+
+    def start(self) -> None:
+        if self.mode == "aggregate":
+            self._bar = self.tqdm(
+                unit="B",
+                unit_scale=True,
+                desc="Bytes Downloaded",
+                position=1,
+                leave=False,
+            )
+        self._task = asyncio.create_task(self._render_forever())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.render()
+        if self._bar is not None:
+            self._bar.close()
+            self._bar = None
+
+    async def _render_forever(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            self.render()
+
+    def snapshot(self) -> Dict:
+        now = time.monotonic()
+        elapsed = now - self._last_time
+        rate = (self.bytes - self._last_bytes) / elapsed if elapsed > 0 else 0.0
+        self._last_time, self._last_bytes = now, self.bytes
+        return {
+            "elapsed": now - self._started,
+            "bytes": self.bytes,
+            "total": self.total or None,
+            "bytes_per_sec": rate,
+            "files_active": len(self.active),
+            "files_done": self.finished,
+        }
+
+    def render(self) -> None:
+        snapshot = self.snapshot()
+        if self._bar is not None:
+            if snapshot["total"] is not None:
+                self._bar.total = snapshot["total"]
+            self._bar.update(snapshot["bytes"] - self._bar.n)
+            self._bar.set_postfix(files=snapshot["files_active"], refresh=False)
+        elif self.mode == "json":
+            stream = self.stream or sys.stderr
+            stream.write(json.dumps(snapshot) + "\n")
+            stream.flush()
+        elif callable(self.mode):
+            self.mode(snapshot)
@@ -1,10 +1,32 @@
 from .base_handler import ProtocolResolver, ProtocolHandler
-from .http_handler import HTTPHandler
-from .ftp_handler import FTPHandler
-from .sftp_handler import SFTPHandler
 
-ProtocolResolver.register_protocol(["http", "https"])(HTTPHandler)
-ProtocolResolver.register_protocol(["ftp"])(FTPHandler)
-ProtocolResolver.register_protocol(["sftp"])(SFTPHandler)
+# Handlers are registered by name and imported on first use, so runs that
+# only download over HTTP never load aioftp or asyncssh (and cryptography)
+ProtocolResolver.register_protocol(["http", "https"])(
+    "pymatris.protocol_handler.http_handler:HTTPHandler"
+)
+ProtocolResolver.register_protocol(["ftp"])(
+    "pymatris.protocol_handler.ftp_handler:FTPHandler"
+)
+ProtocolResolver.register_protocol(["sftp"])(
+    "pymatris.protocol_handler.sftp_handler:SFTPHandler"
+)
+
+_HANDLERS = {
+    "HTTPHandler": "http_handler",
+    "FTPHandler": "ftp_handler",
+    "SFTPHandler": "sftp_handler",
+}
+
+
+def __getattr__(name):
+    # Keep `from pymatris.protocol_handler import HTTPHandler` working
+    if name in _HANDLERS:
+        import importlib
+
+        module = importlib.import_module(f"{__name__}.{_HANDLERS[name]}")
+        return getattr(module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 __all__ = [ProtocolHandler]
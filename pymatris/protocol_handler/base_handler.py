@@ -1,6 +1,12 @@
 from abc import ABC, abstractmethod
+import importlib
 from pymatris.config import DownloaderConfig
-from typing import Optional, Callable
+from pymatris.chunk_queue import MemoryBudget
+from pymatris.pool import ConnectionPool
+from pymatris.rate_limit import RateLimiter
+from pymatris.manifest import Manifest
+from pymatris.io_threads import DeviceWriters
+from typing import Optional, Callable, Type, Union
 import aiohttp
 import asyncio
 from typing import List
@@ -10,6 +16,11 @@ class ProtocolHandler(ABC):
     def __init__(self) -> None:
         pass
 
+    @staticmethod
+    def host_connections(max_splits: int) -> int:
+        """Connections to its host a file opens when given ``max_splits`` splits."""
+        return max_splits
+
     @abstractmethod
     async def run_download(
         self,
@@ -24,6 +35,11 @@ class ProtocolHandler(ABC):
         max_splits: Optional[int] = None,
         max_tries: Optional[int] = None,
         pb_callback: Optional[Callable] = None,
+        memory_budget: Optional[MemoryBudget] = None,
+        pool: Optional[ConnectionPool] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        manifest: Optional[Manifest] = None,
+        writers: Optional[DeviceWriters] = None,
         **kwargs,
     ):
         raise NotImplementedError("run_download() must be implemented")
@@ -34,7 +50,9 @@ class ProtocolResolver:
 
     @classmethod
     def register_protocol(cls, protocols: List[str]):
-        def wrapper(handler_class):
+        """Register a handler class, or its ``"module:Class"`` name to import it on first use."""
+
+        def wrapper(handler_class: Union[Type[ProtocolHandler], str]):
             for protocol in protocols:
                 cls._protocols[protocol] = handler_class
             return handler_class
@@ -44,10 +62,31 @@ class ProtocolResolver:
     @classmethod
     def get_handler(cls, scheme: str) -> ProtocolHandler:
         if scheme in cls._protocols:
-            return cls._protocols[scheme]()
+            return cls._handler_class(scheme)()
         else:
             raise ValueError(f"No handler available for scheme: {scheme}")
 
+    @classmethod
+    def _handler_class(cls, scheme: str) -> Type[ProtocolHandler]:
+        handler_class = cls._protocols[scheme]
+        if isinstance(handler_class, str):
+            module, _, name = handler_class.partition(":")
+            imported = getattr(importlib.import_module(module), name)
+            # Every protocol registered under this name shares the import
+            for protocol, registered in cls._protocols.items():
+                if registered == handler_class:
+                    cls._protocols[protocol] = imported
+            handler_class = imported
+        return handler_class
+
+    @classmethod
+    def host_connections(cls, scheme: str, max_splits: int) -> int:
+        """`ProtocolHandler.host_connections` of the handler for ``scheme``."""
+        if scheme not in cls._protocols:
+            # Fails in get_handler, when the download starts
+            return max_splits
+        return cls._handler_class(scheme).host_connections(max_splits)
+
     @classmethod
     def supported_protocols(cls):
         return list(cls._protocols.keys())
@@ -1,17 +1,28 @@
 from .base_handler import ProtocolHandler
 import urllib
 from pymatris.utils import (
-    allocate_tempfile,
-    get_filepath,
-    get_ftp_size,
+    claim_filepath,
+    get_ftp_info,
+    remove_file,
     cancel_task,
     retry_ftp,
+    generate_range,
+    chunk_sizer,
+    read_chunk,
+    read_small,
 )
 import pymatris
 from pymatris.exceptions import FailedDownload
-from pymatris.write_worker import async_write_worker
+from pymatris.journal import RangeJournal
+from pymatris.chunk_queue import ChunkQueue
+from pymatris.pool import ConnectionPool, pool_key
+from pymatris.metrics import current_probe
+from pymatris.checksum import StreamingHash, resolve_checksum
+from functools import partial
+from pymatris.write_worker import write_buffer, write_worker
 import asyncio
 import aioftp
+import time
 
 
 class FTPHandler(ProtocolHandler):
@@ -28,10 +39,17 @@ class FTPHandler(ProtocolHandler):
         max_splits=None,
         max_tries=None,
         pb_callback=None,
+        memory_budget=None,
+        pool=None,
+        rate_limiter=None,
+        checksum=None,
+        manifest=None,
+        writers=None,
         **kwargs,
     ):
-        filepath = tmpfilepath = writer = None
+        filepath = tmpfilepath = writer = journal = None
         chunksize = chunksize or config.chunksize
+        max_splits = max_splits or config.max_splits
 
         parse = urllib.parse.urlparse(url)
 
@@ -40,21 +58,53 @@ class FTPHandler(ProtocolHandler):
         kwargs["url"] = url
         kwargs["config"] = config
 
+        entry = manifest.get(url) if manifest is not None else None
+
         # Prepare files
-        filepath = get_filepath(filepath_partial(None, url), overwrite)
-        tmpfilepath = allocate_tempfile(str(filepath))
+        candidate = filepath_partial(None, url)
+        # A changed file replaces the copy synced before, not a name.1.ext
+        if manifest is not None and manifest.owns(url, candidate):
+            overwrite = True
+        filepath, tmpfilepath = claim_filepath(
+            candidate, overwrite, config.resume
+        )
+        if config.resume:
+            journal = RangeJournal.load(tmpfilepath)
+
+        # Without a pool from the downloader, keep the connection for this file only
+        own_pool = pool is None
+        if own_pool:
+            pool = ConnectionPool()
 
         try:
-            await self._connect_and_download(
+            checksum = await resolve_checksum(checksum, session, config)
+            remote = await self._connect_and_download(
                 parse=parse,
                 filepath=filepath,
                 tmpfilepath=tmpfilepath,
                 token=token,
                 file_pb=file_pb,
                 chunksize=chunksize,
+                max_splits=max_splits,
                 writer=writer,
+                journal=journal,
+                memory_budget=memory_budget,
+                pool=pool,
+                rate_limiter=rate_limiter,
+                checksum=checksum,
+                entry=entry,
+                writers=writers,
                 **kwargs,
             )
+            if remote is None:
+                pymatris.log.info("%s is unchanged, skipping", url)
+                remove_file(tmpfilepath)
+                probe = current_probe()
+                if probe is not None:
+                    probe.skip()
+                return url, entry.path, None
+            if manifest is not None:
+                manifest.record(url, filepath, *remote)
             return url, str(filepath), str(tmpfilepath)
         except (Exception, asyncio.CancelledError) as e:
             if writer is not None:
@@ -64,6 +114,10 @@ class FTPHandler(ProtocolHandler):
         finally:
             if writer is not None:
                 writer.cancel()
+            if journal is not None:
+                journal.release()
+            if own_pool:
+                await pool.close()
             pb_callback(file_pb)
 
     @retry_ftp
@@ -75,58 +129,274 @@ class FTPHandler(ProtocolHandler):
         token,
         file_pb,
         chunksize,
+        max_splits,
         writer,
+        journal,
+        config,
+        memory_budget,
+        pool,
+        rate_limiter,
+        checksum=None,
+        entry=None,
+        writers=None,
         **kwargs,
     ):
-        async with aioftp.Client.context(
-            parse.hostname, parse.port, parse.username, parse.password
-        ) as client:
-            pymatris.log.debug(
-                "Connected to ftp server %s with credentials %s %s",
-                parse.hostname,
-                parse.username,
-                parse.password,
-            )
+        """
+        Download the file, returning its ``(size, etag, modified)`` for the
+        manifest, or None when ``entry`` shows it is unchanged.
+        """
+        key = pool_key(parse)
+        connect = partial(self._connect, parse)
+        async with pool.connection(key, connect, self._close) as client:
+            total_size, modified = await get_ftp_info(client, parse.path)
+        remote = (total_size, None, modified)
+        if entry is not None and entry.matches(*remote):
+            return None
+
+        resumed = journal is not None and journal.validate(total_size)
+        if resumed:
+            ranges = journal.missing(total_size)
+        elif total_size and max_splits > 1:
+            ranges = [
+                (start, end or None)
+                for start, end in generate_range(
+                    content_length=total_size, max_splits=max_splits
+                )
+            ]
+        else:
+            ranges = [(0, None)]
+        # Ranges up to EOF finish the transfer normally, so their connection is kept
+        ranges = [(start, None if end == total_size else end) for start, end in ranges]
+        pymatris.log.debug(
+            "Downloading ftp file %s from %s in %d ranges",
+            parse.path,
+            parse.hostname,
+            len(ranges),
+        )
+        if not ranges:
+            # All on disk from an earlier run, but it is checked all the same
+            if checksum:
+                await StreamingHash(checksum).verify(tmpfilepath, journal)
+            return remote
 
-            total_size = await get_ftp_size(client, parse.path)
+        if callable(file_pb):
+            file_pb = file_pb(
+                position=token.n,
+                unit="B",
+                unit_scale=True,
+                desc=filepath.name,
+                leave=False,
+                total=total_size,
+                initial=journal.completed if resumed else 0,
+            )
+        else:
+            file_pb = None
 
-            if callable(file_pb):
-                file_pb = file_pb(
-                    position=token.n,
-                    unit="B",
-                    unit_scale=True,
-                    desc=filepath.name,
-                    leave=False,
-                    total=total_size,
+        hasher = StreamingHash(checksum) if checksum else None
+        limit = config.small_file_size
+        small = (
+            limit is not None
+            and not resumed
+            and total_size is not None
+            and total_size <= limit
+        )
+        download_workers = []
+        try:
+            if small:
+                body = await self._download_small(
+                    pool, key, connect, parse.path, chunksize, rate_limiter
                 )
+                await write_buffer(tmpfilepath, body, file_pb, hasher)
             else:
-                file_pb = None
-            pymatris.log.debug(
-                "Downloading ftp file %s from %s", parse.path, parse.hostname
-            )
-            async with client.download_stream(parse.path) as stream:
-                downloaded_chunks_queue = asyncio.Queue()
-                download_workers = []
+                downloaded_chunks_queue = ChunkQueue(
+                    config.file_buffer_bytes, memory_budget
+                )
                 writer = asyncio.create_task(
-                    async_write_worker(downloaded_chunks_queue, file_pb, tmpfilepath)
+                    write_worker(
+                        config,
+                        downloaded_chunks_queue,
+                        file_pb,
+                        tmpfilepath,
+                        journal,
+                        size=total_size,
+                        checksum=hasher,
+                        writers=writers,
+                    )
                 )
-
-                download_workers.append(
-                    asyncio.create_task(
-                        self._download_worker(
-                            stream, chunksize, downloaded_chunks_queue
+                for start, end in ranges:
+                    download_workers.append(
+                        asyncio.create_task(
+                            self._download_range(
+                                pool,
+                                key,
+                                connect,
+                                parse.path,
+                                start,
+                                end,
+                                chunksize,
+                                downloaded_chunks_queue,
+                                rate_limiter,
+                            )
                         )
                     )
-                )
+                accepted = await asyncio.gather(*download_workers)
 
-                await asyncio.gather(*download_workers)
+                if not all(accepted):
+                    # No REST support, a single stream from the start is all we can do
+                    pymatris.log.debug(
+                        "%s rejected REST, downloading with a single stream",
+                        parse.hostname,
+                    )
+                    await self._download_range(
+                        pool,
+                        key,
+                        connect,
+                        parse.path,
+                        0,
+                        None,
+                        chunksize,
+                        downloaded_chunks_queue,
+                        rate_limiter,
+                    )
                 await downloaded_chunks_queue.join()
-                # Cleanup
-                writer.cancel()
+            if hasher is not None:
+                await hasher.verify(tmpfilepath, journal)
+            return remote
+        finally:
+            for task in download_workers:
+                task.cancel()
+            await asyncio.gather(*download_workers, return_exceptions=True)
+            # Cleanup, flushing the journal before the next retry
+            if writer is not None:
+                await cancel_task(writer)
+            # The bar is made per attempt, run_download only sees the factory
+            if file_pb is not None:
+                file_pb.close()
 
-    async def _download_worker(self, stream, chunksize, queue):
-        offset = 0
-        async for chunk in stream.iter_by_block(chunksize):
+    @staticmethod
+    async def _connect(parse):
+        client = aioftp.Client()
+        await client.connect(parse.hostname, parse.port or aioftp.DEFAULT_PORT)
+        try:
+            await client.login(
+                parse.username or aioftp.DEFAULT_USER,
+                parse.password or aioftp.DEFAULT_PASSWORD,
+            )
+        except BaseException:
+            client.close()
+            raise
+        pymatris.log.debug(
+            "Connected to ftp server %s with credentials %s %s",
+            parse.hostname,
+            parse.username,
+            parse.password,
+        )
+        return client
+
+    @staticmethod
+    async def _close(client):
+        try:
+            await client.quit()
+        finally:
+            client.close()
+
+    async def _download_range(
+        self, pool, key, connect, path, start, end, chunksize, queue, rate_limiter=None
+    ):
+        """
+        Download ``[start, end)`` of ``path`` over its own pooled control connection.
+
+        Returns ``False`` when the server rejects ``REST`` for a non-zero ``start``.
+        """
+        client = await pool.acquire(key, connect)
+        reuse = False
+        try:
+            try:
+                stream = await self._open_stream(client, path, start)
+            except aioftp.StatusCodeError as e:
+                if start and "350" in e.expected_codes:
+                    return False
+                raise
+            try:
+                await self._download_worker(
+                    stream, start, end, chunksize, queue, rate_limiter
+                )
+            except BaseException:
+                stream.close()
+                raise
+            if end is None:
+                await stream.finish()
+                reuse = True
+            else:
+                # Servers answer an interrupted transfer with different replies,
+                # so this control connection is not reused
+                stream.close()
+            return True
+        finally:
+            await pool.release(key, client, self._close, reuse=reuse)
+
+    @staticmethod
+    async def _open_stream(client, path, offset=0):
+        """
+        ``client.download_stream``, closing the passive data connection it
+        opened when the server refuses ``REST`` or ``RETR``.
+        """
+        reader, writer = await client.get_passive_connection("I")
+        try:
+            if offset:
+                await client.command(f"REST {offset}", "350")
+            await client.command(f"RETR {path}", "1xx")
+        except BaseException:
+            writer.close()
+            raise
+        return aioftp.DataConnectionThrottleStreamIO(
+            client,
+            reader,
+            writer,
+            throttles={"_": client.throttle},
+            timeout=client.socket_timeout,
+        )
+
+    async def _download_small(
+        self, pool, key, connect, path, chunksize, rate_limiter=None
+    ):
+        """Read all of ``path`` into memory over one pooled control connection."""
+        client = await pool.acquire(key, connect)
+        reuse = False
+        probe = current_probe()
+        started = time.monotonic()
+        try:
+            stream = await self._open_stream(client, path)
+            try:
+                body, _ = await read_small(stream, chunksize, None, rate_limiter)
+            except BaseException:
+                stream.close()
+                raise
+            await stream.finish()
+            reuse = True
+        finally:
+            await pool.release(key, client, self._close, reuse=reuse)
+        if probe is not None:
+            probe.segment(len(body), time.monotonic() - started)
+        return body
+
+    async def _download_worker(
+        self, stream, offset, end, chunksize, queue, rate_limiter=None
+    ):
+        # Read [offset, end), or until EOF
+        sizer = chunk_sizer(chunksize, queue)
+        probe = current_probe()
+        started, start_offset = time.monotonic(), offset
+        while end is None or offset < end:
+            chunk = await read_chunk(stream, sizer, None if end is None else end - offset)
+            if not chunk:
+                break
+            if probe is not None:
+                probe.chunk(len(chunk))
+            if rate_limiter is not None:
+                await rate_limiter.consume(len(chunk))
             # Write this chunk to the output file.
             await queue.put((offset, chunk))
             offset += len(chunk)
+        if probe is not None:
+            probe.segment(offset - start_offset, time.monotonic() - started)
@@ -1,21 +1,30 @@
 from pymatris.utils import (
-    get_filepath,
-    allocate_tempfile,
+    claim_filepath,
     get_http_size,
     cancel_task,
     retry_http,
-    generate_range,
+    chunk_sizer,
+    read_chunk,
+    read_small,
 )
+from pymatris.journal import RangeJournal
+from pymatris.chunk_queue import ChunkQueue
+from pymatris.segments import SegmentScheduler
+from pymatris.metrics import current_probe
+from pymatris.checksum import StreamingHash, resolve_checksum
 from pymatris.exceptions import (
     FailedDownload,
     FailedHTTPRequestError,
     MultiPartDownloadError,
 )
 import pymatris
-from pymatris.write_worker import async_write_worker
+from pymatris.write_worker import write_buffer, write_worker
 from .base_handler import ProtocolHandler
+import aiohttp
 import asyncio
+import time
 import urllib
+import os
 
 
 class HTTPHandler(ProtocolHandler):
@@ -32,6 +41,12 @@ class HTTPHandler(ProtocolHandler):
         max_splits=None,
         max_tries=None,
         pb_callback=None,
+        memory_budget=None,
+        pool=None,
+        rate_limiter=None,
+        checksum=None,
+        manifest=None,
+        writers=None,
         **kwargs,
     ):
         if chunksize is None:
@@ -40,13 +55,50 @@ class HTTPHandler(ProtocolHandler):
             max_splits = config.max_splits
         kwargs["max_tries"] = max_tries if max_tries else config.max_tries
 
-        filepath = writer = tmpfilepath = None
+        filepath = writer = tmpfilepath = journal = first = None
         tasks = []
+        requested_url = url
+        entry = manifest.get(url) if manifest is not None else None
+        conditional = entry.conditional_headers() if entry is not None else None
         try:
-            resp, url = await self._get_download_info(config, session, url, **kwargs)
+            if config.skip_head:
+                # Saves a round trip per file, the body is kept as the first segment
+                first, url = await self._open_download(
+                    config, session, url, conditional=conditional, **kwargs
+                )
+                resp = first
+            else:
+                resp, url = await self._get_download_info(
+                    config, session, url, conditional=conditional, **kwargs
+                )
+            if entry is not None and (
+                resp.status == 304 or entry.matches(*self._validators(resp))
+            ):
+                pymatris.log.info("%s is unchanged, skipping", requested_url)
+                probe = current_probe()
+                if probe is not None:
+                    probe.skip()
+                return url, entry.path, None
+
             parse = urllib.parse.urlparse(url)
-            filepath = get_filepath(filepath_partial(resp, parse.path), overwrite)
-            tmpfilepath = allocate_tempfile(str(filepath))
+            candidate = filepath_partial(resp, parse.path)
+            # A changed file replaces the copy synced before, not a name.1.ext
+            if manifest is not None and manifest.owns(requested_url, candidate):
+                overwrite = True
+            filepath, tmpfilepath = claim_filepath(
+                candidate, overwrite, config.resume
+            )
+            checksum = await resolve_checksum(checksum, session, config, resp.headers)
+            hasher = StreamingHash(checksum) if checksum else None
+
+            ranged = (
+                resp.headers.get("Accept-Ranges", None) == "bytes" or resp.status == 206
+            ) and "Content-length" in resp.headers
+            resumed = False
+            if config.resume:
+                journal = RangeJournal.load(tmpfilepath)
+                # Only a ranged response lets us skip what is already on disk
+                resumed = journal.validate(get_http_size(resp) if ranged else None)
 
             if callable(file_pb):
                 file_pb = file_pb(
@@ -56,59 +108,122 @@ class HTTPHandler(ProtocolHandler):
                     desc=filepath.name,
                     leave=False,
                     total=get_http_size(resp),
+                    initial=journal.completed if resumed else 0,
                 )
             else:
                 file_pb = None
 
-            downloaded_chunk_queue = asyncio.Queue()
+            if resumed:
+                content_length = get_http_size(resp)
+                scheduler = SegmentScheduler(
+                    journal.missing(content_length),
+                    content_length,
+                    config.min_segment_size,
+                )
+            elif max_splits and ranged:
+                content_length = get_http_size(resp)
+                scheduler = SegmentScheduler.split(
+                    content_length, max_splits, config.min_segment_size
+                )
+            else:
+                scheduler = None
 
-            writer = asyncio.create_task(
-                async_write_worker(downloaded_chunk_queue, file_pb, tmpfilepath)
-            )
+            body = None
+            limit = config.small_file_size
+            size = get_http_size(resp)
+            if limit is not None and not resumed and size == 0 and first is None:
+                # Nothing to GET, and a range from byte 0 of nothing is a 416
+                body = bytearray()
+            elif limit is not None and not resumed and (size is None or size <= limit):
+                body, first, url = await self._read_small(
+                    config, session, url, chunksize, first, rate_limiter, **kwargs
+                )
 
-            if (
-                max_splits
-                and resp.headers.get("Accept-Ranges", None) == "bytes"
-                and "Content-length" in resp.headers
-            ):
-                content_length = int(resp.headers["Content-length"])
-                ranges = generate_range(
-                    content_length=content_length, max_splits=max_splits
+            if body is not None and first is None:
+                await write_buffer(tmpfilepath, body, file_pb, hasher)
+            else:
+                if body is not None:
+                    # Bigger than announced, the rest streams after what was read
+                    scheduler = None
+                downloaded_chunk_queue = ChunkQueue(
+                    config.file_buffer_bytes, memory_budget
+                )
+
+                # Ranged bodies are never content-encoded, so their size is exact
+                writer = asyncio.create_task(
+                    write_worker(
+                        config,
+                        downloaded_chunk_queue,
+                        file_pb,
+                        tmpfilepath,
+                        journal,
+                        size=content_length if scheduler is not None else None,
+                        checksum=hasher,
+                        writers=writers,
+                    )
                 )
-                for _range in ranges:
+
+                if first is not None and resumed:
+                    # Everything is requested from the journal's missing ranges
+                    first.close()
+                    first = None
+                if body:
+                    await downloaded_chunk_queue.put((0, bytes(body)))
+
+                if scheduler is not None:
+                    for i, segment in enumerate(list(scheduler.segments)):
+                        tasks.append(
+                            asyncio.create_task(
+                                self._segment_worker(
+                                    config,
+                                    session,
+                                    url,
+                                    chunksize,
+                                    scheduler,
+                                    segment,
+                                    downloaded_chunk_queue,
+                                    # The opening GET starts at 0, like segment 0
+                                    first if i == 0 else None,
+                                    rate_limiter,
+                                    **kwargs,
+                                )
+                            )
+                        )
+                else:
                     tasks.append(
                         asyncio.create_task(
-                            self._download_worker(
+                            self._stream_worker(
                                 config,
                                 session,
                                 url,
                                 chunksize,
-                                _range,
                                 downloaded_chunk_queue,
+                                first,
+                                rate_limiter,
+                                offset=len(body) if body else 0,
                                 **kwargs,
                             )
                         )
                     )
-            else:
-                tasks.append(
-                    asyncio.create_task(
-                        self._download_worker(
-                            config,
-                            session,
-                            url,
-                            chunksize,
-                            None,
-                            downloaded_chunk_queue,
-                            **kwargs,
-                        )
-                    )
-                )
 
-            await asyncio.gather(*tasks)
-            await downloaded_chunk_queue.join()
+                await asyncio.gather(*tasks)
+                await downloaded_chunk_queue.join()
+            if hasher is not None:
+                await hasher.verify(tmpfilepath, journal)
+            if manifest is not None:
+                _, etag, modified = self._validators(resp)
+                manifest.record(
+                    requested_url,
+                    filepath,
+                    os.path.getsize(tmpfilepath),
+                    etag,
+                    modified,
+                )
 
             # Cleanup
-            writer.cancel()
+            if writer is not None:
+                await cancel_task(writer)
+                writer = None
             return url, str(filepath), str(tmpfilepath)
 
         except (Exception, asyncio.CancelledError) as e:
@@ -122,20 +237,67 @@ class HTTPHandler(ProtocolHandler):
             # Cancel idle writer
             if writer is not None:
                 writer.cancel()
+            if first is not None:
+                first.close()
+            if journal is not None:
+                journal.release()
             pb_callback(file_pb)
 
+    async def _read_small(
+        self, config, session, url, chunksize, resp=None, rate_limiter=None, **kwargs
+    ):
+        """
+        Read a body of at most ``config.small_file_size`` bytes into memory.
+
+        Returns ``(body, None, url)`` once the body is complete. A body that
+        turns out bigger comes back with its open response, to be streamed on
+        through the writer. After a failed read the body is None and the
+        download is left to the writer path.
+        """
+        if resp is None:
+            resp, url = await self._open_download(config, session, url, **kwargs)
+        try:
+            body, complete = await read_small(
+                resp.content, chunksize, config.small_file_size, rate_limiter
+            )
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            pymatris.log.debug("%s download failed: %s", url, e)
+            resp.close()
+            return None, None, url
+        if complete:
+            resp.release()
+            return body, None, url
+        return body, resp, url
+
+    @staticmethod
+    def _validators(resp):
+        """``(size, etag, modified)`` a response reports for the file."""
+        # The size of an encoded body says nothing about the file on disk
+        size = None if "Content-Encoding" in resp.headers else get_http_size(resp)
+        return (
+            size,
+            resp.headers.get("ETag", None),
+            resp.headers.get("Last-Modified", None),
+        )
+
     @retry_http
-    async def _get_download_info(self, config, session, url, **kwargs):
+    async def _get_download_info(
+        self, config, session, url, conditional=None, **kwargs
+    ):
         additional_headers = kwargs.pop("headers", {})
-        headers = {**config.headers, **additional_headers}
+        headers = {**config.headers, **additional_headers, **(conditional or {})}
         # Might get no response at all, which is likely a client error, including ssl, proxy, auth, etc.
         # But they are handled in retry decorator.
+        started = time.monotonic()
         async with session.head(
             url,
             timeout=config.timeouts,
             headers=headers,
             allow_redirects=True,
         ) as resp:
+            probe = current_probe()
+            if probe is not None:
+                probe.head(time.monotonic() - started)
             pymatris.log.debug(
                 "%s request made to %s with headers=%s",
                 resp.request_info.method,
@@ -154,25 +316,205 @@ class HTTPHandler(ProtocolHandler):
             return resp, redirectUrl
 
     @retry_http
-    async def _download_worker(
-        self, config, session, url, chunksize, http_range, queue, **kwargs
+    async def _open_download(self, config, session, url, conditional=None, **kwargs):
+        additional_headers = kwargs.pop("headers", {})
+        headers = {
+            **config.headers,
+            **additional_headers,
+            **(conditional or {}),
+            "Range": "bytes=0-",
+        }
+        resp = await session.get(
+            url,
+            timeout=config.timeouts,
+            headers=headers,
+            allow_redirects=True,
+        )
+        if resp.status == 416 and resp.headers.get("Content-Range") == "bytes */0":
+            # An empty file has no byte 0 to range from, ask for all of it
+            resp.release()
+            del headers["Range"]
+            resp = await session.get(
+                url,
+                timeout=config.timeouts,
+                headers=headers,
+                allow_redirects=True,
+            )
+        pymatris.log.debug(
+            "%s Response received from %s with headers=%s",
+            resp.status,
+            resp.request_info.url,
+            resp.headers,
+        )
+        if (resp.status < 200 or resp.status >= 300) and resp.status != 304:
+            resp.release()
+            raise FailedHTTPRequestError(resp)
+        redirectUrl = resp.headers.get("Location", url)
+        return resp, redirectUrl
+
+    async def _segment_worker(
+        self,
+        config,
+        session,
+        url,
+        chunksize,
+        scheduler,
+        segment,
+        queue,
+        resp=None,
+        rate_limiter=None,
+        **kwargs,
     ):
+        probe = current_probe()
+        if resp is not None:
+            started, start_offset = time.monotonic(), segment.offset
+            try:
+                await self._read_segment(
+                    resp, segment, chunksize, queue, rate_limiter
+                )
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                # The rest of the segment is requested again below
+                pymatris.log.debug(
+                    "%s first segment failed at %d: %s", url, segment.offset, e
+                )
+            finally:
+                resp.close()
+            if probe is not None:
+                probe.segment(segment.offset - start_offset, time.monotonic() - started)
+
+        # Once our own segment is done, help with the largest unfinished one
+        while segment is not None:
+            started, start_offset = time.monotonic(), segment.offset
+            await self._download_segment(
+                config,
+                session,
+                url,
+                chunksize,
+                scheduler,
+                segment,
+                queue,
+                rate_limiter,
+                **kwargs,
+            )
+            if probe is not None and segment.offset > start_offset:
+                probe.segment(segment.offset - start_offset, time.monotonic() - started)
+            segment = scheduler.steal()
+
+    @retry_http
+    async def _download_segment(
+        self,
+        config,
+        session,
+        url,
+        chunksize,
+        scheduler,
+        segment,
+        queue,
+        rate_limiter=None,
+        **kwargs,
+    ):
+        if not segment.remaining:
+            return
         additionl_headers = kwargs.pop("headers", {})
         headers = {**config.headers, **additionl_headers}
-        if http_range:
-            headers["Range"] = "bytes={}-{}".format(*http_range)
-            # make the offset from file
-            offset, _ = http_range
+        # Like generate_range, a range ends on the first byte of the next one
+        # and the last range is left open
+        end = segment.end if segment.end < scheduler.size else ""
+        headers["Range"] = f"bytes={segment.offset}-{end}"
+
+        async with session.get(url, timeout=config.timeouts, headers=headers) as resp:
+            if resp.status < 200 or resp.status >= 300:
+                raise MultiPartDownloadError(resp)
+            try:
+                await self._read_segment(
+                    resp, segment, chunksize, queue, rate_limiter
+                )
+            except BaseException:
+                resp.close()
+                raise
+
+    @staticmethod
+    async def _read_segment(resp, segment, chunksize, queue, rate_limiter=None):
+        sizer = chunk_sizer(chunksize, queue)
+        probe = current_probe()
+        received = 0
+        while segment.remaining:
+            chunk = await read_chunk(resp.content, sizer, segment.remaining)
+            if not chunk:
+                raise aiohttp.ClientPayloadError(
+                    f"Response ended {segment.remaining} bytes before its range"
+                )
+            received += len(chunk)
+            if probe is not None:
+                probe.chunk(len(chunk))
+            if rate_limiter is not None:
+                await rate_limiter.consume(len(chunk))
+            # Another worker may have taken over the end of the segment meanwhile
+            chunk = chunk[: segment.remaining]
+            offset = segment.offset
+            segment.offset += len(chunk)
+            await queue.put((offset, chunk))
+
+        # Read the overlapping byte of an inclusive range end, or the rest of
+        # a body that already arrived: aiohttp pooled its connection then, and
+        # only reading the buffer resumes a connection paused on a full one
+        if resp.content.is_eof() or (
+            resp.content_length is not None and resp.content_length - received <= 1
+        ):
+            await resp.content.read()
         else:
-            offset = 0
+            # Stopped short by a steal, the connection has the rest pending
+            resp.close()
+
+    async def _stream_worker(
+        self,
+        config,
+        session,
+        url,
+        chunksize,
+        queue,
+        resp=None,
+        rate_limiter=None,
+        offset=0,
+        **kwargs,
+    ):
+        # Single stream for servers without range support, ``resp`` is read
+        # from ``offset`` on
+        if resp is not None:
+            try:
+                await self._read_stream(resp, chunksize, queue, rate_limiter, offset)
+                return
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                pymatris.log.debug("%s download failed: %s", url, e)
+            finally:
+                resp.close()
+        await self._download_worker(
+            config, session, url, chunksize, queue, rate_limiter, **kwargs
+        )
+
+    @retry_http
+    async def _download_worker(
+        self, config, session, url, chunksize, queue, rate_limiter=None, **kwargs
+    ):
+        additionl_headers = kwargs.pop("headers", {})
+        headers = {**config.headers, **additionl_headers}
 
         async with session.get(url, timeout=config.timeouts, headers=headers) as resp:
             if resp.status < 200 or resp.status >= 300:
                 raise MultiPartDownloadError(resp)
+            await self._read_stream(resp, chunksize, queue, rate_limiter)
 
-            while True:
-                chunk = await resp.content.read(chunksize)
-                if not chunk:
-                    break
-                await queue.put((offset, chunk))
-                offset += len(chunk)
+    @staticmethod
+    async def _read_stream(resp, chunksize, queue, rate_limiter=None, offset=0):
+        sizer = chunk_sizer(chunksize, queue)
+        probe = current_probe()
+        while True:
+            chunk = await read_chunk(resp.content, sizer)
+            if not chunk:
+                break
+            if probe is not None:
+                probe.chunk(len(chunk))
+            if rate_limiter is not None:
+                await rate_limiter.consume(len(chunk))
+            await queue.put((offset, chunk))
+            offset += len(chunk)
@@ -2,20 +2,33 @@ import pymatris
 from .base_handler import ProtocolHandler
 import urllib
 from pymatris.utils import (
-    allocate_tempfile,
-    get_filepath,
-    get_ftp_size,
-    generate_range,
+    claim_filepath,
+    get_ftp_info,
+    remove_file,
     retry_ftp,
     cancel_task,
+    chunk_sizer,
 )
-from pymatris.write_worker import async_write_worker
+from pymatris.write_worker import write_buffer, write_worker
 from pymatris.exceptions import FailedDownload
+from pymatris.journal import RangeJournal
+from pymatris.chunk_queue import ChunkQueue
+from pymatris.segments import SegmentScheduler
+from pymatris.metrics import current_probe
+from pymatris.checksum import StreamingHash, resolve_checksum
+from pymatris.pool import ConnectionPool, pool_key
+from functools import partial
 import asyncio
 import asyncssh
+import time
 
 
 class SFTPHandler(ProtocolHandler):
+    @staticmethod
+    def host_connections(max_splits):
+        # Every split reads over the one pooled SSH connection of the file
+        return 1
+
     async def run_download(
         self,
         config,
@@ -29,9 +42,16 @@ class SFTPHandler(ProtocolHandler):
         max_splits=None,
         max_tries=None,
         pb_callback=None,
+        memory_budget=None,
+        pool=None,
+        rate_limiter=None,
+        checksum=None,
+        manifest=None,
+        writers=None,
         **kwargs,
     ):
-        filepath = tmpfilepath = writer = conn = sftp_client = file_reader = None
+        filepath = tmpfilepath = writer = connection = file_reader = None
+        journal = None
         chunksize = chunksize or config.chunksize
         max_splits = max_splits or config.max_splits
 
@@ -42,14 +62,57 @@ class SFTPHandler(ProtocolHandler):
         kwargs["url"] = url
         kwargs["config"] = config
 
+        entry = manifest.get(url) if manifest is not None else None
+
         # Prepare files
-        filepath = get_filepath(filepath_partial(None, url), overwrite)
-        tmpfilepath = allocate_tempfile(str(filepath))
+        candidate = filepath_partial(None, url)
+        # A changed file replaces the copy synced before, not a name.1.ext
+        if manifest is not None and manifest.owns(url, candidate):
+            overwrite = True
+        filepath, tmpfilepath = claim_filepath(
+            candidate, overwrite, config.resume
+        )
+
+        # Without a pool from the downloader, keep the connection for this file only
+        own_pool = pool is None
+        if own_pool:
+            pool = ConnectionPool()
+        key = pool_key(parse)
 
         try:
-            conn, sftp_client = await self._connect_host(parse, **kwargs)
+            connect = partial(self._connect_host, parse, **kwargs)
+            connection = await pool.acquire(key, connect)
+            try:
+                total_size, modified = await get_ftp_info(connection[1], parse.path)
+            except (
+                asyncssh.SFTPNoConnection,
+                asyncssh.SFTPConnectionLost,
+                asyncssh.DisconnectError,
+                ConnectionError,
+            ):
+                # Pooled connections closed by the server while idle, connect afresh
+                await pool.release(key, connection, self._close_host, reuse=False)
+                connection = None
+                await pool.drop_idle(key)
+                connection = await pool.acquire(key, connect)
+                total_size, modified = await get_ftp_info(connection[1], parse.path)
+            conn, sftp_client = connection
+            if entry is not None and entry.matches(total_size, None, modified):
+                pymatris.log.info("%s is unchanged, skipping", url)
+                remove_file(tmpfilepath)
+                await pool.release(key, connection, self._close_host)
+                connection = None
+                probe = current_probe()
+                if probe is not None:
+                    probe.skip()
+                return url, entry.path, None
+            checksum = await resolve_checksum(checksum, session, config)
+            hasher = StreamingHash(checksum) if checksum else None
 
-            total_size = await get_ftp_size(sftp_client, parse.path)
+            resumed = False
+            if config.resume:
+                journal = RangeJournal.load(tmpfilepath)
+                resumed = journal.validate(total_size)
 
             if callable(file_pb) and total_size:
                 file_pb = file_pb(
@@ -59,40 +122,81 @@ class SFTPHandler(ProtocolHandler):
                     desc=filepath.name,
                     leave=False,
                     total=total_size,
+                    initial=journal.completed if resumed else 0,
                 )
             else:
                 file_pb = None
 
             # Generate tasks to read into queue
-            ranges = generate_range(content_length=total_size, max_splits=max_splits)
+            if resumed:
+                scheduler = SegmentScheduler(
+                    journal.missing(total_size), total_size, config.min_segment_size
+                )
+            else:
+                scheduler = SegmentScheduler.split(
+                    total_size, max_splits, config.min_segment_size
+                )
             # open for random binary access
             file_reader = await sftp_client.open(parse.path, "rb")
 
-            downloaded_chunks_queue = asyncio.Queue()
-            writer = asyncio.create_task(
-                async_write_worker(downloaded_chunks_queue, file_pb, tmpfilepath)
-            )
-            tasks = []
-            pymatris.log.debug(
-                "Downloading sftp file  %s from %s", parse.path, parse.hostname
+            limit = config.small_file_size
+            small = (
+                limit is not None
+                and not resumed
+                and total_size is not None
+                and total_size <= limit
             )
-            for _range in ranges:
-                tasks.append(
-                    asyncio.create_task(
-                        self._download_worker(
-                            file_reader, _range[0], chunksize, downloaded_chunks_queue
-                        )
+            if small:
+                body = await self._read_small(file_reader, total_size, rate_limiter)
+                await write_buffer(tmpfilepath, body, file_pb, hasher)
+            else:
+                downloaded_chunks_queue = ChunkQueue(
+                    config.file_buffer_bytes, memory_budget
+                )
+                writer = asyncio.create_task(
+                    write_worker(
+                        config,
+                        downloaded_chunks_queue,
+                        file_pb,
+                        tmpfilepath,
+                        journal,
+                        size=total_size,
+                        checksum=hasher,
+                        writers=writers,
                     )
                 )
+                tasks = []
+                pymatris.log.debug(
+                    "Downloading sftp file  %s from %s", parse.path, parse.hostname
+                )
+                for segment in list(scheduler.segments):
+                    tasks.append(
+                        asyncio.create_task(
+                            self._download_worker(
+                                file_reader,
+                                scheduler,
+                                segment,
+                                chunksize,
+                                downloaded_chunks_queue,
+                                rate_limiter,
+                            )
+                        )
+                    )
 
-            await asyncio.gather(*tasks)
-            await downloaded_chunks_queue.join()  # Ensure all chunks are written
+                await asyncio.gather(*tasks)
+                await downloaded_chunks_queue.join()  # Ensure all chunks are written
+            if hasher is not None:
+                await hasher.verify(tmpfilepath, journal)
+            if manifest is not None:
+                manifest.record(url, filepath, total_size, None, modified)
 
             # Cleanup
             await file_reader.close()
-            sftp_client.exit()
-            conn.close()
-            writer.cancel()
+            await pool.release(key, connection, self._close_host)
+            connection = None
+            if writer is not None:
+                await cancel_task(writer)
+                writer = None
             return url, str(filepath), str(tmpfilepath)
 
         except (Exception, asyncio.CancelledError) as e:
@@ -101,24 +205,63 @@ class SFTPHandler(ProtocolHandler):
                 writer = None
             if file_reader is not None:
                 await file_reader.close()
-            if sftp_client is not None:
-                sftp_client.exit()
-            if conn is not None:
-                conn.close()
+            if connection is not None:
+                await pool.release(key, connection, self._close_host, reuse=False)
             raise FailedDownload(filepath or filepath_partial, url, e) from e
         finally:
             if writer:
                 writer.cancel()
+            if journal is not None:
+                journal.release()
+            if own_pool:
+                await pool.close()
             pb_callback(file_pb)
 
-    async def _download_worker(self, file_reader, offset, chunksize, queue):
-        while True:
-            await file_reader.seek(offset)
-            chunk = await file_reader.read(chunksize)
-            if not chunk:
-                break
-            await queue.put((offset, chunk))
-            offset += len(chunk)
+    async def _download_worker(
+        self, file_reader, scheduler, segment, chunksize, queue, rate_limiter=None
+    ):
+        # Read our segment, then help with the largest unfinished one
+        sizer = chunk_sizer(chunksize, queue)
+        probe = current_probe()
+        while segment is not None:
+            started, start_offset = time.monotonic(), segment.offset
+            while segment.remaining:
+                offset = segment.offset
+                sizer.start()
+                chunk = await file_reader.read(min(sizer.size, segment.remaining), offset)
+                sizer.update(len(chunk))
+                if not chunk:
+                    raise asyncssh.SFTPFailure(
+                        f"File ended {segment.remaining} bytes before its range"
+                    )
+                if probe is not None:
+                    probe.chunk(len(chunk))
+                if rate_limiter is not None:
+                    await rate_limiter.consume(len(chunk))
+                # Another worker may have taken over the end of the segment meanwhile
+                chunk = chunk[: segment.remaining]
+                segment.offset += len(chunk)
+                await queue.put((offset, chunk))
+            if probe is not None:
+                probe.segment(segment.offset - start_offset, time.monotonic() - started)
+            segment = scheduler.steal()
+
+    @staticmethod
+    async def _read_small(file_reader, size, rate_limiter=None):
+        """Read a whole file of ``size`` bytes in one request instead of segments."""
+        probe = current_probe()
+        started = time.monotonic()
+        body = await file_reader.read(size, 0)
+        if len(body) != size:
+            raise asyncssh.SFTPFailure(
+                f"File ended {size - len(body)} bytes before its size"
+            )
+        if probe is not None:
+            probe.chunk(len(body))
+            probe.segment(len(body), time.monotonic() - started)
+        if rate_limiter is not None:
+            await rate_limiter.consume(len(body))
+        return body
 
     @retry_ftp
     async def _connect_host(self, parse, **kwargs):
@@ -133,3 +276,10 @@ class SFTPHandler(ProtocolHandler):
 
         sftp_client = await conn.start_sftp_client()
         return conn, sftp_client
+
+    @staticmethod
+    async def _close_host(connection):
+        conn, sftp_client = connection
+        sftp_client.exit()
+        conn.close()
+        await conn.wait_closed()
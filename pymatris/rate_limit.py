@@ -0,0 +1,87 @@
+import time
+import asyncio
+import urllib.parse
+from typing import Dict, List, Optional
+
+__all__ = ["TokenBucket", "RateLimiter", "BandwidthLimits"]
+
+MIN_SLEEP = 0.005  # Shorter waits are carried over as debt instead of slept
+
+
+class TokenBucket:
+    """
+    Bytes per second allowed through, with bursts of up to ``burst`` bytes.
+
+    Consumers may take more than is available; the bucket then goes into debt
+    and `reserve` tells how long to wait until the debt is paid off.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None) -> None:
+        if rate <= 0:
+            raise ValueError(f"rate must be positive, got {rate!r}")
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else rate)
+        self.tokens = self.burst
+        self._last = time.monotonic()
+
+    def reserve(self, n: int) -> float:
+        """Take ``n`` bytes, returns the seconds to wait before using them."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+        self.tokens -= n
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class RateLimiter:
+    """Buckets that all have to let a chunk through, e.g. global, host and file."""
+
+    def __init__(self, buckets: List[TokenBucket]) -> None:
+        self.buckets = buckets
+        self.waited = 0.0  # Seconds spent throttled
+
+    async def consume(self, n: int) -> None:
+        delay = max(bucket.reserve(n) for bucket in self.buckets)
+        if delay >= MIN_SLEEP:
+            self.waited += delay
+            await asyncio.sleep(delay)
+
+
+class BandwidthLimits:
+    """
+    Bandwidth limits of one download run.
+
+    The global and per-host buckets are shared by every file of the run,
+    each file gets its own bucket when a per-file limit is set.
+    """
+
+    def __init__(
+        self,
+        max_bytes_per_sec: Optional[float] = None,
+        per_host_limits: Optional[Dict[str, float]] = None,
+        file_max_bytes_per_sec: Optional[float] = None,
+    ) -> None:
+        self.total = TokenBucket(max_bytes_per_sec) if max_bytes_per_sec else None
+        self.per_host_limits = per_host_limits or {}
+        self.file_max_bytes_per_sec = file_max_bytes_per_sec
+        self._hosts: Dict[str, TokenBucket] = {}
+
+    def for_file(
+        self, url: str, max_bytes_per_sec: Optional[float] = None
+    ) -> Optional[RateLimiter]:
+        """Limiter for one file, or None when nothing limits it."""
+        buckets = []
+        if self.total is not None:
+            buckets.append(self.total)
+
+        host = urllib.parse.urlparse(url).hostname
+        if self.per_host_limits.get(host):
+            if host not in self._hosts:
+                self._hosts[host] = TokenBucket(self.per_host_limits[host])
+            buckets.append(self._hosts[host])
+
+        file_rate = max_bytes_per_sec or self.file_max_bytes_per_sec
+        if file_rate:
+            buckets.append(TokenBucket(file_rate))
+
+        return RateLimiter(buckets) if buckets else None
@@ -0,0 +1,76 @@
+from typing import Iterable, List, Optional, Tuple
+
+__all__ = ["Segment", "SegmentScheduler", "MIN_SEGMENT_SIZE"]
+
+MIN_SEGMENT_SIZE = 1024 * 1024  # Segments smaller than twice this are never split
+
+
+class Segment:
+    """Byte range ``[offset, end)`` that is still to be fetched by one worker.
+
+    ``offset`` moves forward as chunks are handed to the writer, and ``end``
+    moves back when another worker takes over the second half of the range.
+    """
+
+    __slots__ = ("offset", "end")
+
+    def __init__(self, offset: int, end: int) -> None:
+        self.offset = offset
+        self.end = end
+
+    @property
+    def remaining(self) -> int:
+        return max(0, self.end - self.offset)
+
+    def __repr__(self) -> str:
+        return f"Segment({self.offset}, {self.end})"
+
+
+class SegmentScheduler:
+    """
+    Segments of one file, shared by its download workers.
+
+    A worker that finishes its segment calls `steal` to split the largest
+    unfinished segment in half and take the second half, so a slow connection
+    does not hold up the whole file while the other workers sit idle.
+    """
+
+    def __init__(
+        self,
+        ranges: Iterable[Tuple[int, int]],
+        size: int,
+        min_segment_size: int = MIN_SEGMENT_SIZE,
+    ) -> None:
+        self.size = size
+        self.min_segment_size = max(1, min_segment_size)
+        self.segments: List[Segment] = [Segment(start, end) for start, end in ranges]
+        self.steals = 0
+
+    @classmethod
+    def split(
+        cls, size: int, max_splits: int, min_segment_size: int = MIN_SEGMENT_SIZE
+    ) -> "SegmentScheduler":
+        """Cut ``size`` bytes into at most ``max_splits`` equal segments, the same way as generate_range."""
+        max_splits = max(1, max_splits or 1)
+        # Rounded up, so the remainder never becomes a segment of its own
+        split_length = max(1, -(-size // max_splits))
+        starts = list(range(0, size, split_length))
+        ranges = zip(starts, starts[1:] + [size])
+        return cls(ranges, size, min_segment_size)
+
+    def steal(self) -> Optional[Segment]:
+        """Take the second half of the largest unfinished segment, or None when nothing is worth splitting."""
+        self.segments = [s for s in self.segments if s.remaining]
+        if not self.segments:
+            return None
+
+        victim = max(self.segments, key=lambda s: s.remaining)
+        if victim.remaining < 2 * self.min_segment_size:
+            return None
+
+        middle = victim.offset + victim.remaining // 2
+        segment = Segment(middle, victim.end)
+        victim.end = middle
+        self.segments.append(segment)
+        self.steals += 1
+        return segment
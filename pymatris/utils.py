@@ -2,18 +2,38 @@ import os
 import pathlib
 import asyncio
 import aiohttp
-import aioftp
-import asyncssh
-from typing import Generator, Tuple, Dict, Union, TypeVar, List
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Generator,
+    Tuple,
+    Dict,
+    Optional,
+    Union,
+    TypeVar,
+    List,
+)
 from itertools import count
 import warnings
 import hashlib
 from tqdm import tqdm as tqdm_std
 import socket
+import time
 from concurrent.futures import ThreadPoolExecutor
-from .exceptions import FailedHTTPRequestError, MultiPartDownloadError
+from .exceptions import (
+    ChecksumMismatchError,
+    FailedHTTPRequestError,
+    MultiPartDownloadError,
+)
+from .journal import RangeJournal, journal_path
+from .metrics import current_probe
 import pymatris
 
+if TYPE_CHECKING:
+    # Imported by the FTP/SFTP handlers on first use only
+    import aioftp
+    import asyncssh
+
 _T = TypeVar("_T")
 
 
@@ -45,6 +65,114 @@ class Token:
         return f"Token {self.n}"
 
 
+class FixedChunksize:
+    """Read size of a download worker that never changes."""
+
+    adaptive = False
+
+    def __init__(self, size: int) -> None:
+        self.size = int(size)
+
+    def start(self) -> None:
+        pass
+
+    def update(self, nbytes: int) -> None:
+        pass
+
+
+class AdaptiveChunksize:
+    """
+    Read size of a download worker that follows its observed throughput.
+
+    The size aims at one read every ``TARGET_READ_TIME`` seconds, moving at most
+    a factor of two per read, and halves while the writer queue is backed up.
+    """
+
+    adaptive = True
+    MIN_SIZE = 64 * 1024
+    MAX_SIZE = 8 * 1024 * 1024
+    TARGET_READ_TIME = 0.25
+    QUEUE_HIGH = 32  # Chunks waiting for the writer before reads shrink
+
+    def __init__(self, queue: asyncio.Queue = None) -> None:
+        self.size = self.MIN_SIZE
+        self.queue = queue
+        self.rate = None
+        self._started = None
+
+    def start(self) -> None:
+        self._started = time.monotonic()
+
+    def update(self, nbytes: int) -> None:
+        elapsed = time.monotonic() - self._started
+        if self.queue is not None and self.queue.qsize() > self.QUEUE_HIGH:
+            target = self.size // 2
+        else:
+            if nbytes and elapsed > 0:
+                rate = nbytes / elapsed
+                self.rate = rate if self.rate is None else 0.7 * self.rate + 0.3 * rate
+            if self.rate is None:
+                return
+            target = self.rate * self.TARGET_READ_TIME
+        target = min(max(target, self.size // 2), self.size * 2)
+        self.size = int(min(max(target, self.MIN_SIZE), self.MAX_SIZE))
+
+
+def chunk_sizer(
+    chunksize: Union[int, str], queue: asyncio.Queue = None
+) -> Union[FixedChunksize, AdaptiveChunksize]:
+    if chunksize == "auto":
+        return AdaptiveChunksize(queue)
+    return FixedChunksize(chunksize)
+
+
+async def read_chunk(
+    stream,
+    sizer: Union[FixedChunksize, AdaptiveChunksize],
+    limit: Optional[int] = None,
+) -> bytes:
+    """Read the next chunk, of at most ``limit`` bytes, from an aiohttp or aioftp stream.
+
+    Adaptive sizes wait for a full chunk, so each read really measures the link.
+    """
+    size = sizer.size if limit is None else min(sizer.size, limit)
+    if not sizer.adaptive:
+        return await stream.read(size)
+    sizer.start()
+    try:
+        chunk = await stream.readexactly(size)
+    except asyncio.IncompleteReadError as e:
+        chunk = e.partial  # EOF
+    sizer.update(len(chunk))
+    return chunk
+
+
+async def read_small(
+    stream,
+    chunksize: Union[int, str],
+    limit: Optional[int] = None,
+    rate_limiter=None,
+) -> Tuple[bytearray, bool]:
+    """Read an aiohttp or aioftp stream into one buffer instead of a writer queue.
+
+    Stops once the buffer holds more than ``limit`` bytes. Returns the buffer and
+    whether the stream was read to its end.
+    """
+    buffer = bytearray()
+    sizer = chunk_sizer(chunksize)
+    probe = current_probe()
+    while limit is None or len(buffer) <= limit:
+        chunk = await read_chunk(stream, sizer)
+        if not chunk:
+            return buffer, True
+        if probe is not None:
+            probe.chunk(len(chunk))
+        if rate_limiter is not None:
+            await rate_limiter.consume(len(chunk))
+        buffer += chunk
+    return buffer, False
+
+
 def default_name(
     path: os.PathLike, resp: aiohttp.ClientResponse, url: str
 ) -> os.PathLike:
@@ -61,6 +189,12 @@ def default_name(
     return pathlib.Path(path) / name
 
 
+def given_name(
+    path: os.PathLike, filename: os.PathLike, resp: aiohttp.ClientResponse, url: str
+) -> os.PathLike:
+    return pathlib.Path(path) / filename
+
+
 def parse_header(line: str) -> Tuple[str, Dict[str, str]]:
     parts = _parseparam(";" + line)
     key = parts.__next__()
@@ -179,11 +313,14 @@ def replace_file(old_path: pathlib.Path, new_path: pathlib.Path) -> pathlib.Path
 
 
 def get_filepath(
-    filepath: os.PathLike, overwrite: bool
+    filepath: os.PathLike, overwrite: bool, resume: bool = False
 ) -> Tuple[Union[pathlib.Path, str], bool]:
     """
     Get the filepath to download to and ensure dir exists.
 
+    With ``resume``, a tempfile left behind by an interrupted run (recognised by
+    its range journal) is reused instead of diverting to a replacement name.
+
     Returns
     -------
     `pathlib.Path`, `pathlib.Path`
@@ -195,6 +332,15 @@ def get_filepath(
     if not filepath.exists() and not tempfile_path.exists():
         finalpath = filepath
 
+    # if tempfile was left behind by an interrupted run, continue it
+    elif (
+        resume
+        and tempfile_path.exists()
+        and journal_path(tempfile_path).exists()
+        and not RangeJournal.in_use(tempfile_path)
+    ):
+        finalpath = filepath
+
     # if tempfile exists, the tempfile already allocated
     elif tempfile_path.exists():
         finalpath = replacement_filename(str(filepath))
@@ -212,23 +358,58 @@ def get_filepath(
     return finalpath
 
 
+def claim_filepath(
+    filepath: os.PathLike, overwrite: bool, resume: bool = False
+) -> Tuple[pathlib.Path, pathlib.Path]:
+    """
+    `get_filepath` and `allocate_tempfile` in one step that other processes
+    cannot race.
+
+    A new tempfile is created exclusively, so when another process downloading
+    the same name got there first, the next free name is taken instead.
+
+    Returns
+    -------
+    `pathlib.Path`, `pathlib.Path`
+        The filepath to download to, and its tempfile.
+    """
+    while True:
+        finalpath = get_filepath(filepath, overwrite, resume)
+        tempfile = finalpath.parent / (finalpath.name + ".matris")
+        if resume and journal_path(tempfile).exists():
+            # Continuing the tempfile of an interrupted run
+            return finalpath, allocate_tempfile(finalpath)
+        try:
+            os.close(os.open(str(tempfile), os.O_WRONLY | os.O_CREAT | os.O_EXCL))
+        except FileExistsError:
+            continue
+        return finalpath, tempfile
+
+
 def get_http_size(resp: aiohttp.ClientResponse) -> Union[int, None]:
     size = resp.headers.get("content-length", None)
     return int(size) if size else size
 
 
-async def get_ftp_size(
-    client: Union["aioftp.Client", asyncssh.SFTPClient], filepath: os.PathLike
-) -> int:
+async def get_ftp_info(
+    client: Union["aioftp.Client", "asyncssh.SFTPClient"], filepath: os.PathLike
+) -> Tuple[Optional[int], Optional[str]]:
+    """Size and modification time (FTP MDTM/MLST ``modify``, SFTP mtime) of a remote file."""
     try:
         attr = await client.stat(filepath)
-        if isinstance(client, aioftp.Client):
+        # aioftp answers with a dict of facts, asyncssh with SFTPAttrs
+        if isinstance(attr, dict):
             size = attr.get("size", None)
+            modified = attr.get("modify", None)
         else:
             size = attr.size
+            modified = attr.mtime
     except Exception as e:
         raise e
-    return int(size) if size else size
+    return (
+        int(size) if size else size,
+        str(modified) if modified is not None else None,
+    )
 
 
 async def cancel_task(task: asyncio.Task) -> bool:
@@ -250,6 +431,12 @@ def sha256sum(filename: str) -> str:
     return h.hexdigest()
 
 
+def _count_retry():
+    probe = current_probe()
+    if probe is not None:
+        probe.retry()
+
+
 def retry_http(coro_func):
     async def wrapper(self, *args, **kwargs):
         max_tries = kwargs.pop(
@@ -271,6 +458,7 @@ def retry_http(coro_func):
                 # if config.file_progress:
                 #     tqdm_std.write(message)
                 pymatris.log.debug(message)
+                _count_retry()
                 await asyncio.sleep(1)
             except (
                 MultiPartDownloadError,
@@ -290,6 +478,7 @@ def retry_http(coro_func):
                     # if config.file_progress:
                     #     tqdm_std.write(message)
                     pymatris.log.debug(message)
+                    _count_retry()
                     await asyncio.sleep(sec)
                 else:
                     message = "(%s) failed after %d tries: " % (
@@ -315,7 +504,7 @@ def retry_ftp(coro_func):
             "max_tries"
         )  # Have to use this workaround to get the max_tries without using parameterized decorator
         cur_url = kwargs.pop("url")  # Get URL
-        config = kwargs.pop("config")
+        config = kwargs["config"]  # Left in place for the wrapped coroutine
         tried = 0
         while True:
             tried += 1
@@ -326,9 +515,12 @@ def retry_ftp(coro_func):
                 # if config.file_progress:
                 #     tqdm_std.write(message)
                 pymatris.log.debug(message)
+                _count_retry()
+            except ChecksumMismatchError:
+                # Same bytes again on a retry, fail at once like HTTP and SFTP do
+                raise
             except (
-                asyncssh.SFTPError,
-                aioftp.AIOFTPException,
+                # Includes asyncssh.SFTPError and aioftp.AIOFTPException
                 socket.gaierror,
                 Exception,
             ) as exc:
@@ -344,6 +536,7 @@ def retry_ftp(coro_func):
                     if config.file_progress:
                         tqdm_std.write(message)
                     pymatris.log.debug(message)
+                    _count_retry()
                     await asyncio.sleep(sec)
                 else:
                     message = "(%s) failed after %d tries: " % (
@@ -358,6 +551,23 @@ def retry_ftp(coro_func):
     return wrapper
 
 
+def new_event_loop(
+    loop_factory: Optional[Union[str, Callable[[], asyncio.AbstractEventLoop]]] = None
+) -> asyncio.AbstractEventLoop:
+    """New event loop from ``loop_factory``: None for asyncio's, ``"uvloop"``, or a callable."""
+    if loop_factory is None:
+        return asyncio.new_event_loop()
+    if loop_factory == "uvloop":
+        try:
+            import uvloop
+        except ImportError as e:
+            raise ImportError(
+                "loop_factory='uvloop' needs the optional uvloop package"
+            ) from e
+        return uvloop.new_event_loop()
+    return loop_factory()
+
+
 def run_task_in_thread(loop: asyncio.BaseEventLoop, coro: asyncio.Task):
     with ThreadPoolExecutor(max_workers=1) as aio_pool:
         try:
@@ -372,7 +582,8 @@ def generate_range(content_length, max_splits):
         max_splits = 1
         tqdm_std.write("Max Splits cannot be smaller than 1")
 
-    split_length = max(1, content_length // max_splits)
+    # Rounded up, so there are never more ranges than max_splits
+    split_length = max(1, -(-content_length // max_splits))
     ranges = [
         [start, start + split_length]
         for start in range(0, content_length, split_length)
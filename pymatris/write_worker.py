@@ -1,17 +1,316 @@
-import aiofiles
+import os
+import asyncio
+import functools
+from typing import Dict, List
 
+from pymatris.chunk_queue import FLUSH, ChunkQueue
+from pymatris.io_threads import DeviceWriters
 
-async def async_write_worker(queue, file_pb, filepath):
-    async with aiofiles.open(filepath, mode="wb") as f:
+MAX_BATCH_BYTES = 8 * 1024 * 1024  # Upper bound of bytes handed to one write call
+IOV_MAX = 1024  # Portable lower bound of buffers per pwritev call
+COALESCE_BYTES = 1024 * 1024  # A contiguous run is written once it holds this many
+MAX_PENDING_BYTES = 8 * 1024 * 1024  # Bytes a writer holds back at most
+FLUSH_AFTER = 1.0  # Seconds before held back bytes are written anyway
+
+
+class PendingWrites:
+    """
+    Chunks held back by a writer until they make up large contiguous writes.
+
+    Every chunk extends the run that ends where it starts, so each split of a
+    file grows its own run however their chunks interleave.
+    """
+
+    def __init__(
+        self, run_bytes: int = COALESCE_BYTES, max_bytes: int = MAX_PENDING_BYTES
+    ) -> None:
+        self.run_bytes = run_bytes
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.items = 0  # Queue items whose bytes are held
+        self._runs: Dict[int, list] = {}  # End offset: [start, buffers, bytes, items]
+
+    def add(self, offset: int, chunk: bytes) -> None:
+        run = self._runs.pop(offset, None) or [offset, [], 0, 0]
+        run[1].append(chunk)
+        run[2] += len(chunk)
+        run[3] += 1
+        self._runs[offset + len(chunk)] = run
+        self.nbytes += len(chunk)
+        self.items += 1
+
+    def take(self, everything: bool = False) -> List[tuple]:
+        """
+        Runs of ``(offset, [chunks])`` to write now.
+
+        These are the runs of at least ``run_bytes``, or all of them when asked
+        or once more than ``max_bytes`` are held.
+        """
+        if everything or self.nbytes >= self.max_bytes:
+            ends = list(self._runs)
+        else:
+            ends = [end for end, run in self._runs.items() if run[2] >= self.run_bytes]
+        taken = sorted((self._runs.pop(end) for end in ends), key=lambda run: run[0])
+
+        runs, end = [], None
+        for start, buffers, nbytes, n in taken:
+            self.nbytes -= nbytes
+            self.items -= n
+            if start == end:
+                # Two runs that have grown into each other
+                runs[-1][1].extend(buffers)
+            else:
+                runs.append((start, buffers))
+            end = start + nbytes
+        return runs
+
+
+def _task_done(queue, nbytes: int = 0) -> None:
+    if isinstance(queue, ChunkQueue):
+        queue.task_done(nbytes)  # Gives the bytes back to the memory budgets
+    else:
+        queue.task_done()
+
+
+async def write_coalesced(queue, write, file_pb=None, journal=None):
+    """
+    Hand the chunks of ``queue`` to ``write`` as runs of contiguous bytes.
+
+    Chunks already waiting are taken together. A `ChunkQueue` lets its writer
+    also hold runs back across reads, until they reach ``COALESCE_BYTES``, more
+    than ``MAX_PENDING_BYTES`` are held, ``FLUSH_AFTER`` seconds have passed, a
+    producer waits for memory budget or the queue is joined. Chunks count as
+    done, and against the budget until then, once they are written.
+    """
+    loop = asyncio.get_running_loop()
+    hold = isinstance(queue, ChunkQueue)
+    pending = PendingWrites(COALESCE_BYTES, MAX_PENDING_BYTES)
+    timer = None
+    try:
         while True:
-            offset, chunk = await queue.get()
+            batch = [await queue.get()]
+            nbytes = len(batch[0][1])
+            while nbytes < MAX_BATCH_BYTES and not queue.empty():
+                item = queue.get_nowait()
+                batch.append(item)
+                nbytes += len(item[1])
+            if hold:
+                queue.batch_taken(len(batch))
+
+            flushes = 0
+            for item in batch:
+                if item is FLUSH:
+                    flushes += 1
+                else:
+                    pending.add(*item)
+            # Nothing is held back while producers wait for the memory it takes
+            runs = pending.take(everything=flushes or not hold or queue.starved())
+
+            if runs:
+                await write(runs)
+                written = 0
+                for offset, buffers in runs:
+                    run_bytes = sum(len(b) for b in buffers)
+                    written += run_bytes
+                    if journal is not None:
+                        journal.add(offset, run_bytes)
+                if journal is not None:
+                    journal.checkpoint()
+
+                # Update the progressbar for file
+                if file_pb is not None:
+                    file_pb.update(written)
+
+            if pending.items and timer is None:
+                timer = loop.call_later(FLUSH_AFTER, queue.put_nowait, FLUSH)
+            elif not pending.items and timer is not None:
+                timer.cancel()
+                timer = None
+
+            for _, buffers in runs:
+                for buffer in buffers:
+                    _task_done(queue, len(buffer))
+            for _ in range(flushes):
+                _task_done(queue)
+    finally:
+        if timer is not None:
+            timer.cancel()
+        if hold:
+            # Give the budget back for chunks that will never be written
+            for _, buffers in pending.take(everything=True):
+                for buffer in buffers:
+                    queue.task_done(len(buffer))
+            while not queue.empty():
+                queue.task_done(len(queue.get_nowait()[1]))
+
+
+async def async_write_worker(
+    queue, file_pb, filepath, journal=None, size=None, checksum=None
+):
+    import aiofiles  # Only needed by this writer backend
+
+    # Keep the bytes of an interrupted download that is being resumed
+    mode = "r+b" if journal is not None and journal.ranges else "wb"
+    try:
+        async with aiofiles.open(filepath, mode=mode) as f:
+
+            async def write(runs):
+                for offset, buffers in runs:
+                    await f.seek(offset)
+                    await f.write(b"".join(buffers))
+                    if checksum is not None:
+                        for buffer in buffers:
+                            checksum.update(offset, buffer)
+                            offset += len(buffer)
+                await f.flush()
+
+            await write_coalesced(queue, write, file_pb, journal)
+    finally:
+        if journal is not None:
+            journal.save()
+
+
+async def async_pwrite_worker(
+    queue, file_pb, filepath, journal=None, size=None, checksum=None, writers=None
+):
+    """
+    Write chunks with positional writes on a preallocated file.
+
+    Every run of contiguous chunks is written with one ``pwritev``, and all
+    runs of a flush in a single executor hop without any seek or flush.
+    Hashing, if any, happens in that same hop. Given `DeviceWriters`, the
+    writes go to the threads of the file's filesystem instead of the executor.
+    """
+    loop = asyncio.get_running_loop()
+    keep = journal is not None and bool(journal.ranges)
+    fd = await loop.run_in_executor(None, open_positional, filepath, size, keep)
+    if writers is not None:
+        submit = writers.for_fd(fd).submit
+    else:
+        submit = functools.partial(loop.run_in_executor, None)
+
+    async def write(runs):
+        write = submit(write_runs, fd, runs, checksum)
+        try:
+            # The fd must stay open until the executor is done with it
+            await asyncio.shield(write)
+        finally:
+            if not write.done():
+                await asyncio.wait([write])
+
+    try:
+        await write_coalesced(queue, write, file_pb, journal)
+    finally:
+        os.close(fd)
+        if journal is not None:
+            journal.save()
+
+
+async def async_thread_worker(
+    queue, file_pb, filepath, journal=None, size=None, checksum=None, writers=None
+):
+    """`async_pwrite_worker` on dedicated writer threads, its own ones if not given."""
+    own = writers is None
+    if own:
+        writers = DeviceWriters()
+    try:
+        await async_pwrite_worker(
+            queue, file_pb, filepath, journal, size, checksum, writers=writers
+        )
+    finally:
+        if own:
+            writers.close()
+
+
+def open_positional(filepath, size=None, keep=False):
+    """Open ``filepath`` for positional writes, preallocated to ``size`` bytes."""
+    flags = os.O_WRONLY | os.O_CREAT | getattr(os, "O_BINARY", 0)
+    if not keep:
+        flags |= os.O_TRUNC
+    fd = os.open(str(filepath), flags, 0o644)
+    if size:
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except (AttributeError, OSError):
+            # Not supported by the platform or filesystem, reserve a sparse file
+            os.ftruncate(fd, size)
+    return fd
+
+
+def write_runs(fd, runs, checksum=None):
+    for offset, buffers in runs:
+        start = offset
+        for i in range(0, len(buffers), IOV_MAX):
+            offset = pwritev(fd, buffers[i : i + IOV_MAX], offset)
+        if checksum is not None:
+            for buffer in buffers:
+                checksum.update(start, buffer)
+                start += len(buffer)
+
+
+def pwritev(fd, buffers, offset):
+    """Write all ``buffers`` at ``offset`` and return the offset after them."""
+    if hasattr(os, "pwritev"):
+        total = sum(len(b) for b in buffers)
+        written = os.pwritev(fd, buffers, offset)
+        if written == total:
+            return offset + total
+        # Short write, finish the remainder one buffer at a time
+        data = memoryview(b"".join(buffers))[written:]
+        offset += written
+    else:
+        data = memoryview(b"".join(buffers))
+
+    while data:
+        if hasattr(os, "pwrite"):
+            n = os.pwrite(fd, data, offset)
+        else:
+            os.lseek(fd, offset, os.SEEK_SET)
+            n = os.write(fd, data)
+        data = data[n:]
+        offset += n
+    return offset
+
+
+async def write_buffer(filepath, data, file_pb=None, checksum=None):
+    """
+    Write a whole download held in memory in a single executor hop.
+
+    Small files skip the queue and writer task, the tempfile is written with one
+    open and write and is then renamed into place like any other.
+    """
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, write_file, filepath, data, checksum)
+    if file_pb is not None:
+        file_pb.update(len(data))
+
+
+def write_file(filepath, data, checksum=None):
+    with open(filepath, "wb") as f:
+        f.write(data)
+    if checksum is not None:
+        checksum.update(0, data)
+
 
-            await f.seek(offset)
-            await f.write(chunk)
-            await f.flush()
+WRITE_WORKERS = {
+    "aiofiles": async_write_worker,
+    "pwrite": async_pwrite_worker,
+    "threads": async_thread_worker,
+}
 
-            # Update the progressbar for file
-            if file_pb is not None:
-                file_pb.update(len(chunk))
 
-            queue.task_done()
+def write_worker(
+    config,
+    queue,
+    file_pb,
+    filepath,
+    journal=None,
+    size=None,
+    checksum=None,
+    writers=None,
+):
+    """Writer coroutine of the backend selected by ``config.writer``."""
+    worker = WRITE_WORKERS[config.writer]
+    if worker is async_thread_worker:
+        worker = functools.partial(worker, writers=writers)
+    return worker(queue, file_pb, filepath, journal, size=size, checksum=checksum)
@@ -1,3 +1,6 @@
+import asyncio
+import threading
+import aioftp
 from typing import Callable, Optional
 from pytest_localserver.http import WSGIServer
 from pytest_sftpserver.sftp.server import SFTPServer
@@ -89,3 +92,193 @@ def fail_between_handler(start, end, cur, environ, start_response):
 class SimpleSFTPServer:
     def __init__(self, contents):
         self.server = SFTPServer(content_object=contents)
+
+
+class NoRestFTPServer:
+    """
+    Anonymous FTP server of the files in ``root`` that refuses ``REST``.
+
+    Records the ``(command, argument)`` of every ``REST`` and ``RETR`` it
+    was sent.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.commands = []
+        self.port = None
+        self._loop = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"ftp://127.0.0.1:{self.port}"
+
+    def start(self):
+        ready = threading.Event()
+        self._loop = asyncio.new_event_loop()
+        commands = self.commands
+
+        class Server(aioftp.Server):
+            async def rest(self, connection, rest):
+                commands.append(("REST", rest))
+                connection.response("502", "REST not implemented")
+                return True
+
+            async def retr(self, connection, rest):
+                commands.append(("RETR", rest))
+                return await super().retr(connection, rest)
+
+        server = Server([aioftp.User(base_path=self.root)])
+
+        def run():
+            self._loop.run_until_complete(server.start("127.0.0.1", 0))
+            self.port = server.server.sockets[0].getsockname()[1]
+            ready.set()
+            self._loop.run_forever()
+            self._loop.run_until_complete(server.close())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        ready.wait()
+
+    def stop(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+class H2Server:
+    """
+    Cleartext HTTP/2 server of ``files`` by path, for clients with prior knowledge.
+
+    Answers GET and HEAD, with ``Range`` support, and counts the connections
+    it accepted.
+    """
+
+    def __init__(self, files):
+        self.files = files
+        self.requests = []  # (method, path, headers)
+        self.connections = 0
+        self.port = None
+        self._loop = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self):
+        ready = threading.Event()
+        self._loop = asyncio.new_event_loop()
+
+        def run():
+            server = self._loop.run_until_complete(
+                asyncio.start_server(self._serve, "127.0.0.1", 0)
+            )
+            self.port = server.sockets[0].getsockname()[1]
+            ready.set()
+            self._loop.run_forever()
+            server.close()
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        ready.wait()
+
+    def stop(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    async def _serve(self, reader, writer):
+        import h2.config
+        import h2.connection
+        import h2.events
+
+        self.connections += 1
+        conn = h2.connection.H2Connection(
+            h2.config.H2Configuration(client_side=False, header_encoding="utf-8")
+        )
+        conn.initiate_connection()
+        writer.write(conn.data_to_send())
+        window_open = asyncio.Event()
+        responses = set()
+        try:
+            while True:
+                data = await reader.read(65535)
+                if not data:
+                    break
+                for event in conn.receive_data(data):
+                    if isinstance(event, h2.events.RequestReceived):
+                        task = asyncio.ensure_future(
+                            self._respond(
+                                conn,
+                                writer,
+                                event.stream_id,
+                                event.headers,
+                                window_open,
+                            )
+                        )
+                        responses.add(task)
+                        task.add_done_callback(responses.discard)
+                    elif isinstance(event, h2.events.WindowUpdated):
+                        window_open.set()
+                    elif isinstance(event, h2.events.ConnectionTerminated):
+                        return
+                writer.write(conn.data_to_send())
+        except ConnectionError:
+            pass
+        finally:
+            for task in responses:
+                task.cancel()
+            writer.close()
+
+    async def _respond(self, conn, writer, stream_id, headers, window_open):
+        import h2.exceptions
+
+        headers = dict(headers)
+        method, path = headers[":method"], headers[":path"]
+        self.requests.append((method, path, headers))
+        content = self.files.get(path)
+        if content is None:
+            conn.send_headers(stream_id, [(":status", "404")], end_stream=True)
+            writer.write(conn.data_to_send())
+            return
+
+        status, start, end = "200", 0, len(content)
+        http_range = headers.get("range")
+        if http_range:
+            first, _, last = http_range.split("bytes=")[1].partition("-")
+            status, start = "206", int(first)
+            end = min(int(last) + 1, len(content)) if last else len(content)
+        body = content[start:end]
+        response_headers = [
+            (":status", status),
+            ("content-length", str(len(body))),
+            ("accept-ranges", "bytes"),
+        ]
+        if status == "206":
+            response_headers.append(
+                ("content-range", f"bytes {start}-{end - 1}/{len(content)}")
+            )
+        try:
+            no_body = method == "HEAD" or not body
+            conn.send_headers(stream_id, response_headers, end_stream=no_body)
+            writer.write(conn.data_to_send())
+            if no_body:
+                return
+            while body:
+                size = min(
+                    conn.local_flow_control_window(stream_id),
+                    conn.max_outbound_frame_size,
+                    len(body),
+                )
+                if size <= 0:
+                    window_open.clear()
+                    await window_open.wait()
+                    continue
+                conn.send_data(stream_id, body[:size], end_stream=size == len(body))
+                body = body[size:]
+                writer.write(conn.data_to_send())
+                await writer.drain()
+        except (h2.exceptions.StreamClosedError, ConnectionError):
+            pass  # Reset by the client
@@ -0,0 +1,38 @@
+import json
+
+from benchmarks.cli import main, parse_size
+
+
+def test_parse_size():
+    assert parse_size("512") == 512
+    assert parse_size("64k") == 64 * 1024
+    assert parse_size("16MiB") == 16 * 1024**2
+    assert parse_size("1.5G") == int(1.5 * 1024**3)
+
+
+def test_benchmark_smoke(tmp_path):
+    output = tmp_path / "report.json"
+    main(
+        [
+            "--protocols=http,ftp,sftp",
+            "--files=2",
+            "--file-size=64k",
+            "--max-splits=2",
+            "--chunksize=16k",
+            "--writer=threads",
+            "--repeat=1",
+            "--latency=0.01",
+            "--throttle=10M",
+            f"--output={output}",
+        ]
+    )
+
+    report = json.loads(output.read_text())
+    assert report["meta"]["file_size"] == 64 * 1024
+    assert [r["protocol"] for r in report["results"]] == ["http", "ftp", "sftp"]
+    for result in report["results"]:
+        (run,) = result["runs"]
+        assert run["verified"]
+        assert run["bytes"] == 2 * 64 * 1024
+        assert run["peak_rss_bytes"] > 0
+        assert run["loop_lag_max_seconds"] >= 0
@@ -0,0 +1,152 @@
+import asyncio
+import base64
+import hashlib
+
+import pytest
+
+from pymatris import Downloader, SessionConfig
+from pymatris.checksum import (
+    Checksum,
+    StreamingHash,
+    checksum_from_headers,
+    parse_checksum,
+)
+from pymatris.exceptions import ChecksumMismatchError
+
+from .conftest import validate_test_file_content
+
+MULTIPART_SHA256 = hashlib.sha256(b"multipart" * 100).hexdigest()
+
+
+def test_parse_checksum():
+    assert parse_checksum("SHA256:ABCD") == Checksum("sha256", "abcd")
+    assert parse_checksum("http://host/file.iso.md5") == Checksum(
+        "md5", url="http://host/file.iso.md5"
+    )
+    assert parse_checksum("https://host/SUMS") == Checksum(
+        None, url="https://host/SUMS"
+    )
+    with pytest.raises(ValueError):
+        parse_checksum("abcd")
+    with pytest.raises(ValueError):
+        parse_checksum("sha1:abcd")
+
+
+def test_checksum_from_headers():
+    digest = hashlib.sha256(b"data").digest()
+    b64 = base64.b64encode(digest).decode()
+    assert checksum_from_headers({"Repr-Digest": f"sha-256=:{b64}:"}) == Checksum(
+        "sha256", digest.hex()
+    )
+    assert checksum_from_headers({"Digest": f"SHA-256={b64}"}) == Checksum(
+        "sha256", digest.hex()
+    )
+    md5 = hashlib.md5(b"data").digest()
+    assert checksum_from_headers(
+        {"Content-MD5": base64.b64encode(md5).decode()}
+    ) == Checksum("md5", md5.hex())
+    assert (
+        checksum_from_headers({"Digest": f"sha-256={b64}", "Content-Encoding": "gzip"})
+        is None
+    )
+
+
+def test_streaming_hash_out_of_order(tmp_path):
+    data = bytes(range(256)) * 10
+    path = tmp_path / "file"
+    path.write_bytes(data)
+
+    hasher = StreamingHash(Checksum("sha256", hashlib.sha256(data).hexdigest()))
+    hasher.update(1000, data[1000:2000])
+    hasher.update(0, data[:1200])
+    assert hasher.position == 1200
+    hasher.update(2000, data[2000:])
+
+    asyncio.run(hasher.verify(path))
+    assert hasher.position == len(data)
+
+
+@pytest.mark.parametrize("writer", ["aiofiles", "pwrite"])
+def test_multipart_checksum(multipartserver, tmp_path, writer):
+    dm = Downloader(session_config=SessionConfig(writer=writer))
+    dm.enqueue_file(
+        multipartserver.url,
+        path=tmp_path,
+        max_splits=5,
+        checksum=f"sha256:{MULTIPART_SHA256}",
+    )
+    f = dm.download()
+    assert len(f.errors) == 0
+    validate_test_file_content(f[0], "multipart" * 100)
+
+
+def test_multipart_checksum_mismatch(multipartserver, tmp_path):
+    dm = Downloader()
+    dm.enqueue_file(
+        multipartserver.url, path=tmp_path, max_splits=5, checksum="md5:" + "0" * 32
+    )
+    f = dm.download()
+    assert len(f.errors) == 1
+    assert isinstance(f.errors[0].exception, ChecksumMismatchError)
+    assert not any(tmp_path.iterdir())
+
+
+def test_sidecar_checksum(multipartserver, httpserver, tmp_path):
+    httpserver.serve_content(f"{MULTIPART_SHA256}  multipartfile.txt\n")
+
+    dm = Downloader()
+    dm.enqueue_file(
+        multipartserver.url,
+        path=tmp_path,
+        max_splits=5,
+        checksum=httpserver.url + "/multipartfile.txt.sha256",
+    )
+    f = dm.download()
+    assert len(f.errors) == 0
+    validate_test_file_content(f[0], "multipart" * 100)
+
+
+def test_header_checksum(httpserver, tmp_path):
+    wrong = base64.b64encode(hashlib.md5(b"other").digest()).decode()
+    httpserver.serve_content(
+        "HIRE ME! I'M A TEST FILE!",
+        headers={
+            "Content-Disposition": "attachment; filename=testfile.txt",
+            "Content-MD5": wrong,
+        },
+    )
+
+    dm = Downloader()
+    dm.enqueue_file(httpserver.url, path=tmp_path)
+    assert len(dm.download().errors) == 0
+
+    dm = Downloader(session_config=SessionConfig(verify_header_checksums=True))
+    dm.enqueue_file(httpserver.url, path=tmp_path, overwrite=True)
+    f = dm.download()
+    assert isinstance(f.errors[0].exception, ChecksumMismatchError)
+
+
+def test_ftp_checksum_mismatch_not_retried(ftp_server, tmp_path):
+    ftpfile = list(ftp_server.get_file_contents("testfile.txt", style="url"))[0]
+
+    dm = Downloader(max_tries=3)
+    dm.enqueue_file(ftpfile["path"], path=tmp_path, checksum="md5:" + "0" * 32)
+    f = dm.download()
+
+    assert len(f.errors) == 1
+    assert isinstance(f.errors[0].exception, ChecksumMismatchError)
+    assert dm.metrics.get("retries_total", protocol="ftp") == 0
+
+
+def test_crc32c_checksum(sftp_server, tmp_path):
+    crc32c = pytest.importorskip("crc32c")
+    value = crc32c.crc32c(b"Hello World From SFTP")
+
+    dm = Downloader()
+    dm.enqueue_file(
+        f"{sftp_server.url}/testfile.txt",
+        path=tmp_path,
+        checksum=f"crc32c:{value:08x}",
+    )
+    f = dm.download()
+    assert len(f.errors) == 0
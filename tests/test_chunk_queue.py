@@ -0,0 +1,66 @@
+import asyncio
+
+from pymatris import Downloader, SessionConfig
+from pymatris.chunk_queue import ChunkQueue, MemoryBudget
+
+from .conftest import validate_test_file_content
+
+
+def test_chunk_queue_blocks_until_writer_catches_up():
+    async def run():
+        budget = MemoryBudget(limit=None)
+        queue = ChunkQueue(max_bytes=10, budget=budget)
+        await queue.put((0, b"x" * 6))
+        put = asyncio.create_task(queue.put((6, b"x" * 6)))
+        await asyncio.sleep(0)
+        assert not put.done()  # 12 bytes would exceed the budget
+
+        assert await queue.get() == (0, b"x" * 6)
+        await asyncio.sleep(0)
+        assert not put.done()  # Taken, but not written yet
+
+        queue.task_done(6)
+        await asyncio.wait_for(put, 1)
+        assert queue.backpressure == 1
+        assert budget.backpressure == 1
+
+    asyncio.run(run())
+
+
+def test_shared_budget_across_queues():
+    async def run():
+        budget = MemoryBudget(limit=8)
+        first, second = ChunkQueue(budget=budget), ChunkQueue(budget=budget)
+        await first.put((0, b"x" * 8))
+        put = asyncio.create_task(second.put((0, b"y")))
+        await asyncio.sleep(0)
+        assert not put.done()
+
+        await first.get()
+        first.task_done(8)
+        await asyncio.wait_for(put, 1)
+        assert budget.used == 1
+        assert second.backpressure == 1
+
+    asyncio.run(run())
+
+
+def test_oversized_chunk_passes_alone():
+    async def run():
+        queue = ChunkQueue(max_bytes=4)
+        await asyncio.wait_for(queue.put((0, b"x" * 16)), 1)
+
+    asyncio.run(run())
+
+
+def test_multipartserver_small_buffers(multipartserver, tmp_path):
+    dm = Downloader(
+        session_config=SessionConfig(
+            chunksize=10, file_buffer_bytes=20, total_buffer_bytes=30
+        )
+    )
+    dm.enqueue_file(multipartserver.url, path=tmp_path)
+    f = dm.download()
+
+    assert len(f.errors) == 0
+    validate_test_file_content(f[0], "multipart" * 100)
@@ -1,3 +1,6 @@
+import asyncio
+
+import pytest
 from pymatris import Downloader, SessionConfig
 
 
@@ -22,3 +25,35 @@ def test_modifyconfig():
     assert dl.config.chunksize == 2048
     assert dl.config.timeouts == 600
     assert dl.config.file_progress is False
+
+
+def test_invalid_writer():
+    with pytest.raises(ValueError):
+        SessionConfig(writer="nosuchwriter")
+
+
+def test_http2_modes():
+    assert SessionConfig(http2="prior_knowledge").http2 == "prior_knowledge"
+    with pytest.raises(ValueError):
+        SessionConfig(http2="h2c")
+
+
+def test_chunksize_auto():
+    assert SessionConfig(chunksize="auto").chunksize == "auto"
+    with pytest.raises(ValueError):
+        SessionConfig(chunksize="fast")
+
+
+def test_connector_settings():
+    async def connector(**kwargs):
+        dl = Downloader(**kwargs)
+        async with dl.config.aiohttp_client_session() as session:
+            return session.connector.limit, session.connector.limit_per_host
+
+    assert asyncio.run(connector(max_parallel=4, max_splits=3)) == (12, 0)
+    assert asyncio.run(
+        connector(
+            max_host_connections=2,
+            session_config=SessionConfig(connection_limit=50),
+        )
+    ) == (50, 2)
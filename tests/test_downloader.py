@@ -1,3 +1,9 @@
+import asyncio
+
+import aiohttp
+import pytest
+from aiohttp import web
+from aiohttp import test_utils
 from unittest.mock import patch
 from pymatris import Downloader
 
@@ -14,3 +20,47 @@ def test_raises_other_exception(httpserver, tmp_path):
     dm.enqueue_file(httpserver.url, path=tmp_path)
     res = dm.download()
     assert isinstance(res.errors[0].exception, ValueError)
+
+
+def test_given_session_is_reused(tmp_path):
+    connections = []
+
+    async def on_connection(session, context, params):
+        connections.append(params)
+
+    async def serve(request):
+        return web.Response(
+            body=b"Hello World",
+            headers={"Content-Disposition": "attachment; filename=testfile.txt"},
+        )
+
+    async def run():
+        app = web.Application()
+        app.router.add_get("/", serve)
+        trace = aiohttp.TraceConfig()
+        trace.on_connection_create_end.append(on_connection)
+        async with test_utils.TestServer(app) as server, aiohttp.ClientSession(
+            trace_configs=[trace]
+        ) as session:
+            dm = Downloader(max_splits=1, overwrite=True, session=session)
+            for _ in range(2):
+                dm.enqueue_file(str(server.make_url("/")), path=tmp_path)
+                res = await dm.run_download()
+                assert len(res.errors) == 0
+            # The session belongs to the caller, runs do not close it
+            assert not session.closed
+
+    asyncio.run(run())
+    # The second run picks up the connection kept alive by the first
+    assert len(connections) == 1
+
+
+def test_given_session_needs_run_download(tmp_path):
+    async def make_session():
+        return aiohttp.ClientSession()
+
+    session = asyncio.run(make_session())
+    dm = Downloader(session=session)
+    dm.enqueue_file("http://localhost/file.txt", path=tmp_path)
+    with pytest.raises(RuntimeError):
+        dm.download()
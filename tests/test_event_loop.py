@@ -0,0 +1,72 @@
+import asyncio
+import signal
+
+import pytest
+
+from pymatris import Downloader, SessionConfig
+
+from .conftest import validate_test_file_content
+
+
+class CountingFactory:
+    def __init__(self):
+        self.loops = []
+
+    def __call__(self):
+        loop = asyncio.new_event_loop()
+        self.loops.append(loop)
+        return loop
+
+
+def test_loop_factory(singlepartserver, tmp_path):
+    factory = CountingFactory()
+    dm = Downloader(session_config=SessionConfig(loop_factory=factory))
+    dm.enqueue_file(singlepartserver.url, path=tmp_path)
+
+    f = dm.download()
+    assert len(f.errors) == 0
+    assert len(factory.loops) == 1
+    validate_test_file_content(f[0], "Hello World!")
+
+
+def test_loop_factory_in_thread(singlepartserver, tmp_path):
+    factory = CountingFactory()
+    dm = Downloader(session_config=SessionConfig(loop_factory=factory))
+    dm.enqueue_file(singlepartserver.url, path=tmp_path)
+
+    async def run():
+        # A running loop makes download() run its own loop in a thread
+        return dm.download()
+
+    f = asyncio.run(run())
+    assert len(f.errors) == 0
+    assert len(factory.loops) == 1
+
+
+def test_uvloop(singlepartserver, tmp_path):
+    uvloop = pytest.importorskip("uvloop")
+    dm = Downloader(session_config=SessionConfig(loop_factory="uvloop"))
+    dm.enqueue_file(singlepartserver.url, path=tmp_path)
+
+    loops = []
+    dm.metrics.subscribe(
+        lambda event, probe, values: loops.append(asyncio.get_running_loop())
+    )
+    assert len(dm.download().errors) == 0
+    assert isinstance(loops[0], uvloop.Loop)
+
+
+def test_uvloop_gives_signals_back(singlepartserver, tmp_path):
+    pytest.importorskip("uvloop")
+    dm = Downloader(session_config=SessionConfig(loop_factory="uvloop"))
+    dm.enqueue_file(singlepartserver.url, path=tmp_path)
+
+    assert len(dm.download().errors) == 0
+    # Otherwise SIGTERM is swallowed once the download is done
+    assert signal.getsignal(signal.SIGTERM) is signal.SIG_DFL
+    assert signal.getsignal(signal.SIGINT) is signal.default_int_handler
+
+
+def test_unknown_loop():
+    with pytest.raises(ValueError):
+        SessionConfig(loop_factory="trio")
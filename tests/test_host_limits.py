@@ -0,0 +1,128 @@
+import threading
+import time
+from collections import deque
+
+import pymatris.protocol_handler.sftp_handler
+from pymatris import Downloader
+from pymatris.host_limits import HostSlots
+
+from .conftest import validate_test_file_content
+from .localserver import MultiPartServer
+
+
+def test_host_slots_take_and_release():
+    slots = HostSlots(limit=3)
+    assert slots.take("a", 5) == 3
+    assert slots.take("a", 1) == 0
+    assert slots.take("b", 2) == 2
+
+    slots.release("a", 3)
+    assert slots.free("a") == 3
+    assert HostSlots().take("a", 100) == 100
+
+
+def test_take_ready_skips_full_hosts():
+    slots = HostSlots(limit=1)
+    slots.take("busy.com", 1)
+    waiting = deque([("http://busy.com/a",), ("http://idle.com/b",)])
+
+    download, n = slots.take_ready(waiting, lambda download: 5)
+    assert download == ("http://idle.com/b",) and n == 1
+    assert slots.take_ready(waiting, lambda download: 5) is None
+    assert len(waiting) == 1
+
+
+class ConcurrencyTracker:
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.inflight = self.peak = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, i, environ, start_response):
+        with self.lock:
+            self.inflight += 1
+            self.peak = max(self.peak, self.inflight)
+        time.sleep(self.delay)
+        with self.lock:
+            self.inflight -= 1
+        # Fall through to the default handler
+
+
+def test_max_host_connections_shared_with_splits(tmp_path):
+    tracker = ConcurrencyTracker()
+    server = MultiPartServer(override=tracker)
+    server.start_server()
+    try:
+        dm = Downloader(max_parallel=5, max_splits=5, max_host_connections=2)
+        for i in range(3):
+            dm.enqueue_file(server.url, path=tmp_path, filename=f"file{i}.txt")
+        res = dm.download()
+    finally:
+        server.stop_server()
+
+    assert len(res.errors) == 0
+    for path in res:
+        validate_test_file_content(path, "multipart" * 100)
+    assert tracker.peak <= 2
+
+
+def test_other_hosts_proceed(tmp_path):
+    busy = MultiPartServer(override=ConcurrencyTracker(delay=0.2))
+    seen = []
+    other = MultiPartServer(override=lambda *args: seen.append(time.monotonic()))
+    busy.start_server()
+    other.start_server()
+    try:
+        dm = Downloader(max_parallel=5, max_splits=1, max_host_connections=1)
+        for i in range(3):
+            dm.enqueue_file(busy.url, path=tmp_path, filename=f"busy{i}.txt")
+        # Same server, but a different hostname
+        other_url = other.url.replace("127.0.0.1", "localhost")
+        dm.enqueue_file(other_url, path=tmp_path, filename="other.txt")
+
+        start = time.monotonic()
+        res = dm.download()
+    finally:
+        busy.stop_server()
+        other.stop_server()
+
+    assert len(res.errors) == 0
+    # The busy host is downloaded one file at a time (HEAD + GET each), while
+    # the other host was not held back behind it
+    assert time.monotonic() - start >= 1.2
+    assert len(seen) == 2 and seen[-1] - start < 0.6
+
+
+def test_sftp_files_take_one_slot(sftp_server, tmp_path, monkeypatch):
+    handler = pymatris.protocol_handler.sftp_handler.SFTPHandler
+    run_download = handler.run_download
+    inflight = []
+    peak = 0
+    splits = []
+
+    async def tracking(self, *args, **kwargs):
+        nonlocal peak
+        inflight.append(args)
+        splits.append(kwargs.get("max_splits"))
+        peak = max(peak, len(inflight))
+        try:
+            return await run_download(self, *args, **kwargs)
+        finally:
+            inflight.pop()
+
+    monkeypatch.setattr(handler, "run_download", tracking)
+
+    dm = Downloader(max_parallel=5, max_splits=5, max_host_connections=5)
+    for i in range(5):
+        dm.enqueue_file(
+            f"{sftp_server.url}/testfile.txt", path=tmp_path, filename=f"file{i}.txt"
+        )
+    res = dm.download()
+
+    assert len(res.errors) == 0
+    # One pooled connection each, so all five share the host at once and
+    # keep their splits
+    assert peak == 5
+    assert 1 not in splits
+    for path in res:
+        validate_test_file_content(path, "Hello World From SFTP")
@@ -1,5 +1,9 @@
+import asyncio
+
 import pytest
-from pymatris import Downloader
+from aiohttp import test_utils, web
+
+from pymatris import Downloader, SessionConfig
 from .conftest import validate_test_file
 
 
@@ -20,6 +24,42 @@ def test_http_download(httpserver, tmp_path):
     )  # Generated from echo -n -e "HIRE ME\! I'M A TEST FILE\!" | shasum -a 256
 
 
+def test_http_download_skip_head(httpserver, tmp_path):
+    httpserver.serve_content(
+        "HIRE ME! I'M A TEST FILE!",
+        headers={"Content-Disposition": "attachment; filename=testfile.txt"},
+    )
+    dm = Downloader(session_config=SessionConfig(skip_head=True))
+    dm.enqueue_file(httpserver.url, path=tmp_path)
+
+    f = dm.download()
+    assert len(f.errors) == 0
+    assert [req.method for req in httpserver.requests] == ["GET"]
+    validate_test_file(
+        f[0], "e74f4c92ee3794ed642d88e9a470d9d582e7e946aa5ffdb3b6f7060b9856046e"
+    )
+
+
+def test_http_download_skip_head_empty_file(tmp_path):
+    root = tmp_path / "root"
+    root.mkdir()
+    (root / "empty.txt").write_bytes(b"")
+    out = tmp_path / "out"
+
+    async def run():
+        # aiohttp's static files answer "Range: bytes=0-" on an empty file with 416
+        app = web.Application()
+        app.router.add_static("/", root)
+        async with test_utils.TestServer(app) as server:
+            dm = Downloader(session_config=SessionConfig(skip_head=True))
+            dm.enqueue_file(str(server.make_url("/empty.txt")), path=out)
+            return await dm.run_download()
+
+    f = asyncio.run(run())
+    assert len(f.errors) == 0
+    assert (out / "empty.txt").read_bytes() == b""
+
+
 @pytest.mark.parametrize("max_tries,expected", [(1, 1), (2, 2), (3, 3)])
 def test_http_download_fails(singlepartserverfail, tmp_path, max_tries, expected):
     dm = Downloader(
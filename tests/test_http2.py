@@ -0,0 +1,85 @@
+import pytest
+
+pytest.importorskip("httpx")
+pytest.importorskip("h2")
+
+from pymatris import Downloader, SessionConfig  # noqa: E402
+
+from .localserver import H2Server  # noqa: E402
+
+SMALL_FILES = {f"/file{i}.txt": f"file number {i}\n".encode() * 10 for i in range(20)}
+BIG_FILE = bytes(range(256)) * 1024  # Bigger than the initial flow control window
+
+
+@pytest.fixture
+def h2server():
+    server = H2Server({**SMALL_FILES, "/bigfile.bin": BIG_FILE})
+    server.start()
+    yield server
+    server.stop()
+
+
+def test_http2_many_files_one_connection(h2server, tmp_path):
+    dm = Downloader(
+        max_parallel=10,
+        max_splits=1,
+        session_config=SessionConfig(http2="prior_knowledge"),
+    )
+    for path in SMALL_FILES:
+        dm.enqueue_file(h2server.url + path, path=tmp_path)
+    f = dm.download()
+
+    assert len(f.errors) == 0
+    assert len(f) == len(SMALL_FILES)
+    for path, content in SMALL_FILES.items():
+        assert (tmp_path / path.lstrip("/")).read_bytes() == content
+    # Every HEAD and GET was a stream of the same connection
+    assert h2server.connections == 1
+    assert len(h2server.requests) == 2 * len(SMALL_FILES)
+
+
+def test_http2_split_download(h2server, tmp_path):
+    dm = Downloader(
+        max_splits=4,
+        session_config=SessionConfig(http2="prior_knowledge", min_segment_size=1024),
+    )
+    dm.enqueue_file(h2server.url + "/bigfile.bin", path=tmp_path)
+    f = dm.download()
+
+    assert len(f.errors) == 0
+    assert (tmp_path / "bigfile.bin").read_bytes() == BIG_FILE
+    # Workers that finish early steal halves of the others, over the same connection
+    assert [method for method, *_ in h2server.requests].count("GET") >= 4
+    assert h2server.connections == 1
+
+
+def test_http2_small_file_path(h2server, tmp_path):
+    dm = Downloader(
+        session_config=SessionConfig(
+            http2="prior_knowledge", small_file_size=64 * 1024, skip_head=True
+        ),
+    )
+    dm.enqueue_file(h2server.url + "/file0.txt", path=tmp_path)
+    f = dm.download()
+
+    assert len(f.errors) == 0
+    assert (tmp_path / "file0.txt").read_bytes() == SMALL_FILES["/file0.txt"]
+
+
+def test_http2_not_found(h2server, tmp_path):
+    dm = Downloader(max_tries=2, session_config=SessionConfig(http2="prior_knowledge"))
+    dm.enqueue_file(h2server.url + "/missing.txt", path=tmp_path)
+    f = dm.download()
+
+    assert len(f.errors) == 1
+    assert len(h2server.requests) == 2
+    assert not any(tmp_path.iterdir())
+
+
+def test_http2_connection_refused(tmp_path):
+    dm = Downloader(max_tries=1, session_config=SessionConfig(http2="prior_knowledge"))
+    # Nothing listens on the discard port
+    dm.enqueue_file("http://127.0.0.1:9/file.txt", path=tmp_path)
+    f = dm.download()
+
+    assert len(f.errors) == 1
@@ -1,4 +1,4 @@
-from pymatris import Downloader
+from pymatris import Downloader, SessionConfig
 from tests.conftest import validate_test_file_content
 from .localserver import crash_handler, fail_between_handler, intermittent_fail_handler
 from functools import partial
@@ -30,6 +30,15 @@ def test_multipartserver_ranged_http(multipartserver, tmp_path):
     validate_test_file_content(f[0], "multipart" * 100)
 
 
+def test_multipartserver_auto_chunksize(multipartserver, tmp_path):
+    dm = Downloader(session_config=SessionConfig(chunksize="auto"))
+    dm.enqueue_file(multipartserver.url, path=tmp_path)
+    f = dm.download()
+
+    assert len(f.errors) == 0
+    validate_test_file_content(f[0], "multipart" * 100)
+
+
 def test_multipartserver_default_max_tries(multipartserver, tmp_path):
     # server will fail on only 3rd request
     multipartserver.override = partial(intermittent_fail_handler, 3)
@@ -82,3 +91,17 @@ def test_multipartserver_exceeds_max_tries(
         multipartserver.request_number == expected
     )  # 1 head request + 1 splits + (4 * max_tries)
     assert not any(tmp_path.iterdir())
+
+
+@pytest.mark.parametrize("max_splits", [1, 5])
+def test_multipartserver_skip_head(multipartserver, tmp_path, max_splits):
+    dm = Downloader(max_splits=max_splits, session_config=SessionConfig(skip_head=True))
+    dm.enqueue_file(multipartserver.url, path=tmp_path)
+    f = dm.download()
+
+    assert len(f.errors) == 0
+    validate_test_file_content(f[0], "multipart" * 100)
+    # No HEAD, the opening GET doubles as the first range
+    methods = [req["REQUEST_METHOD"] for req in multipartserver.requests]
+    assert methods == ["GET"] * max_splits
+    assert multipartserver.requests[0]["HTTP_RANGE"] == "bytes=0-"
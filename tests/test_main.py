@@ -0,0 +1,92 @@
+import json
+import os
+
+import pytest
+
+from pymatris.main import parse_args, parse_input_line, run_pymatris
+
+from .conftest import validate_test_file_content
+
+
+def test_parse_input_line():
+    assert parse_input_line("  http://host/a.txt \n") == "http://host/a.txt"
+    assert parse_input_line("# comment") is None
+    assert parse_input_line("") is None
+    assert parse_input_line('{"url": "http://host/a", "filename": "b"}') == {
+        "url": "http://host/a",
+        "filename": "b",
+    }
+    assert parse_input_line("{not json") is None
+    assert parse_input_line('{"filename": "b"}') is None
+    assert parse_input_line('{"url": 5}') is None
+    assert parse_input_line('{"url": "http://host/a", "unknown": 1}') is None
+
+
+def run(argv):
+    with pytest.raises(SystemExit) as exit:
+        run_pymatris(parse_args(argv))
+    return exit.value.code
+
+
+def test_input_file_and_manifest_out(multipartserver, tmp_path):
+    input_file = tmp_path / "urls.txt"
+    input_file.write_text(
+        "\n".join(
+            [
+                multipartserver.url,
+                json.dumps({"url": multipartserver.url, "filename": "named.txt"}),
+                "{broken",
+                "gopher://host/file",
+            ]
+        )
+    )
+    out = tmp_path / "out"
+    manifest = tmp_path / "results.jsonl"
+
+    code = run(
+        [
+            "--input-file",
+            str(input_file),
+            "--manifest-out",
+            str(manifest),
+            "--dir",
+            str(out),
+            "--quiet",
+        ]
+    )
+    assert code == 0
+
+    records = [json.loads(line) for line in manifest.read_text().splitlines()]
+    assert sorted(r["status"] for r in records) == ["error", "success", "success"]
+    paths = sorted(r["path"] for r in records if r["status"] == "success")
+    assert paths == sorted(
+        [str(out / "multipartfile.txt"), str(out / "named.txt")]
+    )
+    for path in paths:
+        validate_test_file_content(path, "multipart" * 100)
+
+
+def test_input_from_stdin(multipartserver, tmp_path, monkeypatch, capsys):
+    read, write = os.pipe()
+    with os.fdopen(write, "w") as w:
+        w.write(multipartserver.url + "\n")
+    with os.fdopen(read) as stdin:
+        monkeypatch.setattr("sys.stdin", stdin)
+        code = run(["--input-file", "-", "--dir", str(tmp_path), "--quiet"])
+
+    assert code == 0
+    assert "multipartfile.txt downloaded" in capsys.readouterr().out
+
+
+def test_no_urls():
+    with pytest.raises(SystemExit):
+        parse_args([])
+
+
+@pytest.mark.parametrize(
+    "stream_args", [["--input-file", "urls.txt"], ["--manifest-out", "out.jsonl"]]
+)
+def test_processes_with_streaming(stream_args, capsys):
+    with pytest.raises(SystemExit):
+        parse_args(["http://host/file", "--processes", "2", *stream_args])
+    assert "--processes" in capsys.readouterr().err
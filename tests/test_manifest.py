@@ -0,0 +1,106 @@
+from datetime import datetime
+from pathlib import Path
+
+import pytest_sftpserver.sftp.interface
+
+from pymatris import Downloader, SessionConfig
+from pymatris.manifest import Manifest, ManifestEntry
+
+from .conftest import validate_test_file_content
+
+
+def test_entry_matches():
+    entry = ManifestEntry("file", 10, '"v1"', "Mon, 01 Jan 2024 00:00:00 GMT")
+    assert entry.matches(10, 'W/"v1"')
+    assert not entry.matches(10, '"v2"', entry.modified)
+    assert not entry.matches(11, '"v1"')
+    assert entry.matches(None, None, entry.modified)
+    # Size alone is not enough to call a file unchanged
+    assert not ManifestEntry("file", 10).matches(10)
+
+
+def test_manifest_roundtrip(tmp_path):
+    target = tmp_path / "file.txt"
+    target.write_bytes(b"0123456789")
+    manifest = Manifest.load(tmp_path / "manifest.json")
+    manifest.record("http://host/file.txt", target, 10, '"v1"')
+    manifest.save()
+
+    manifest = Manifest.load(tmp_path / "manifest.json")
+    assert manifest.get("http://host/file.txt") == ManifestEntry(
+        str(target), 10, '"v1"'
+    )
+    target.write_bytes(b"changed locally")
+    assert manifest.get("http://host/file.txt") is None
+
+
+def sync(url, tmp_path, **config):
+    dm = Downloader(
+        session_config=SessionConfig(manifest=tmp_path / "manifest.json", **config)
+    )
+    dm.enqueue_file(url, path=tmp_path / "data")
+    results = dm.download()
+    assert len(results.errors) == 0
+    return results, dm.metrics
+
+
+def test_http_sync_skips_unchanged(httpserver, tmp_path):
+    headers = {"Content-Disposition": "attachment; filename=testfile.txt"}
+    httpserver.serve_content("version 1", headers={**headers, "ETag": '"v1"'})
+    results, _ = sync(httpserver.url, tmp_path)
+
+    results, metrics = sync(httpserver.url, tmp_path)
+    assert metrics.get("files_total", outcome="skipped") == 1
+    request = httpserver.requests[-1]
+    assert request.method == "HEAD"
+    assert request.headers["If-None-Match"] == '"v1"'
+    assert Path(results[0]) == tmp_path / "data" / "testfile.txt"
+
+    httpserver.serve_content("version 2", headers={**headers, "ETag": '"v2"'})
+    results, metrics = sync(httpserver.url, tmp_path)
+    assert metrics.get("files_total", outcome="success") == 1
+    # The synced file is replaced in place, no testfile.1.txt
+    assert sorted(p.name for p in (tmp_path / "data").iterdir()) == ["testfile.txt"]
+    validate_test_file_content(results[0], "version 2")
+
+
+def test_http_sync_not_modified(httpserver, tmp_path):
+    headers = {
+        "Content-Disposition": "attachment; filename=testfile.txt",
+        "Last-Modified": "Mon, 01 Jan 2024 00:00:00 GMT",
+    }
+    httpserver.serve_content("version 1", headers=headers)
+    sync(httpserver.url, tmp_path, skip_head=True)
+
+    httpserver.serve_content("", 304)
+    results, metrics = sync(httpserver.url, tmp_path, skip_head=True)
+    assert metrics.get("files_total", outcome="skipped") == 1
+    assert (
+        httpserver.requests[-1].headers["If-Modified-Since"]
+        == headers["Last-Modified"]
+    )
+    validate_test_file_content(results[0], "version 1")
+
+
+def test_ftp_sync_skips_unchanged(ftp_server, tmp_path):
+    url = list(ftp_server.get_file_contents("testfile.txt", style="url"))[0]["path"]
+    sync(url, tmp_path)
+    _, metrics = sync(url, tmp_path)
+    assert metrics.get("files_total", outcome="skipped") == 1
+    assert [p.name for p in (tmp_path / "data").iterdir()] == ["testfile.txt"]
+
+
+def test_sftp_sync_skips_unchanged(sftp_server, tmp_path, monkeypatch):
+    # The test server reports the current time as mtime, hold its clock still
+    class FrozenDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime(2024, 1, 1)
+
+    monkeypatch.setattr(pytest_sftpserver.sftp.interface, "datetime", FrozenDatetime)
+
+    url = f"{sftp_server.url}/testfile.txt"
+    sync(url, tmp_path)
+    _, metrics = sync(url, tmp_path)
+    assert metrics.get("files_total", outcome="skipped") == 1
+    assert [p.name for p in (tmp_path / "data").iterdir()] == ["testfile.txt"]
@@ -0,0 +1,94 @@
+import urllib.request
+from functools import partial
+
+from pymatris import Downloader, Metrics
+
+from .localserver import MultiPartServer, intermittent_fail_handler
+
+
+def test_registry_counters_and_summaries():
+    metrics = Metrics()
+    metrics.inc("bytes_total", 10, host="a")
+    metrics.inc("bytes_total", 5, host="a")
+    metrics.inc("bytes_total", 1, host="b")
+    metrics.observe("head_seconds", 0.5, host="a")
+    metrics.observe("head_seconds", 1.5, host="a")
+
+    assert metrics.get("bytes_total", host="a") == 15
+    assert metrics.get("bytes_total") == 16
+    assert metrics.summary("head_seconds") == (2, 2.0, 1.5)
+
+
+def test_queue_samples_reach_the_registry_once_per_segment():
+    metrics = Metrics()
+    probe = metrics.file_probe("http://example.com/file")
+    for depth in range(100):
+        probe.queued(depth, depth / 1000)
+    probe.segment(100, 1.0)
+    probe.finish()  # Nothing queued since the segment
+
+    assert metrics.summary("chunk_queue_depth") == (1, 99, 99)
+    assert metrics.summary("writer_lag_seconds") == (1, 0.099, 0.099)
+
+
+def test_prometheus_text_format():
+    metrics = Metrics()
+    metrics.inc("bytes_total", 900, host="example.com", protocol="http")
+    metrics.observe("head_seconds", 0.25, host='quo"te')
+
+    text = metrics.to_prometheus()
+    assert "# TYPE pymatris_bytes_total counter" in text
+    assert 'pymatris_bytes_total{host="example.com",protocol="http"} 900' in text
+    assert 'pymatris_head_seconds_count{host="quo\\"te"} 1' in text
+    assert 'pymatris_head_seconds_sum{host="quo\\"te"} 0.25' in text
+    assert 'pymatris_head_seconds_max{host="quo\\"te"} 0.25' in text
+
+
+def test_multipartserver_metrics(multipartserver, tmp_path):
+    events = []
+    dm = Downloader()
+    dm.metrics.subscribe(lambda event, probe, values: events.append((event, values)))
+    dm.enqueue_file(multipartserver.url, path=tmp_path)
+    f = dm.download()
+    assert len(f.errors) == 0
+
+    metrics = dm.metrics
+    assert metrics.get("bytes_total", host="127.0.0.1", protocol="http") == 900
+    assert metrics.get("files_total", outcome="success") == 1
+    assert metrics.summary("head_seconds")[0] == 1
+    assert metrics.summary("time_to_first_byte_seconds")[0] == 1
+    assert metrics.summary("segment_bytes")[:2] == (5, 900)
+    assert metrics.summary("writer_lag_seconds")[0] > 0
+    assert metrics.host_throughput()["127.0.0.1"] > 0
+
+    files = [values for event, values in events if event == "file"]
+    assert len(files) == 1 and files[0]["bytes"] == 900 and files[0]["error"] is None
+
+
+def test_retries_are_counted(tmp_path):
+    server = MultiPartServer(override=partial(intermittent_fail_handler, 2))
+    server.start_server()
+    try:
+        dm = Downloader(max_splits=1)
+        dm.enqueue_file(server.url, path=tmp_path)
+        f = dm.download()
+    finally:
+        server.stop_server()
+
+    assert len(f.errors) == 0
+    assert dm.metrics.get("retries_total", protocol="http") == 1
+
+
+def test_serve_prometheus():
+    metrics = Metrics()
+    metrics.inc("files_total", outcome="success", protocol="http")
+    server = metrics.serve_prometheus(port=0)
+    try:
+        url = "http://127.0.0.1:%d/metrics" % server.server_address[1]
+        with urllib.request.urlopen(url) as resp:
+            body = resp.read().decode()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert 'pymatris_files_total{outcome="success",protocol="http"} 1' in body
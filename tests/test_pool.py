@@ -0,0 +1,124 @@
+import asyncio
+
+import pytest
+
+from pymatris.pool import ConnectionPool
+
+
+class FakeConnections:
+    def __init__(self):
+        self.opened = 0
+        self.closed = 0
+
+    async def connect(self):
+        self.opened += 1
+        return object()
+
+    async def close(self, conn):
+        self.closed += 1
+
+
+def test_pool_reuses_connections():
+    conns = FakeConnections()
+
+    async def run():
+        pool = ConnectionPool()
+        key = ("sftp", "localhost", 22, "user", "pass")
+        async with pool.connection(key, conns.connect, conns.close) as first:
+            pass
+        async with pool.connection(key, conns.connect, conns.close) as second:
+            assert second is first
+        async with pool.connection(("sftp", "otherhost", 22, None, None), conns.connect, conns.close):
+            pass
+        await pool.close()
+        return pool
+
+    pool = asyncio.run(run())
+    assert conns.opened == 2
+    assert pool.reused == 1
+    assert conns.closed == 2
+
+
+def test_pool_discards_broken_connections():
+    conns = FakeConnections()
+
+    async def run():
+        pool = ConnectionPool()
+        key = ("ftp", "localhost", 21, None, None)
+        with pytest.raises(ConnectionError):
+            async with pool.connection(key, conns.connect, conns.close):
+                raise ConnectionError()
+        async with pool.connection(key, conns.connect, conns.close):
+            pass
+        await pool.close()
+
+    asyncio.run(run())
+    assert conns.opened == 2
+    assert conns.closed == 2
+
+
+def test_pool_limits_connections_per_host():
+    conns = FakeConnections()
+    active = []
+
+    async def run():
+        pool = ConnectionPool(max_per_host=2)
+        key = ("sftp", "localhost", 22, None, None)
+
+        async def use():
+            async with pool.connection(key, conns.connect, conns.close):
+                active.append(len(active) + 1)
+                await asyncio.sleep(0.01)
+                active.pop()
+
+        peak = []
+
+        async def watch():
+            for _ in range(10):
+                peak.append(len(active))
+                await asyncio.sleep(0.002)
+
+        await asyncio.gather(*[use() for _ in range(5)], watch())
+        await pool.close()
+        return max(peak)
+
+    assert asyncio.run(run()) <= 2
+    assert conns.opened == 2
+
+
+def test_pool_evicts_idle_connections():
+    conns = FakeConnections()
+
+    async def run():
+        pool = ConnectionPool(idle_timeout=0.01)
+        key = ("sftp", "localhost", 22, None, None)
+        async with pool.connection(key, conns.connect, conns.close):
+            pass
+        await asyncio.sleep(0.02)
+        async with pool.connection(key, conns.connect, conns.close):
+            pass
+        await pool.close()
+
+    asyncio.run(run())
+    assert conns.opened == 2
+    assert conns.closed == 2
+
+
+def test_pool_drop_idle():
+    conns = FakeConnections()
+
+    async def run():
+        pool = ConnectionPool()
+        key = ("sftp", "localhost", 22, None, None)
+        first = await pool.acquire(key, conns.connect)
+        second = await pool.acquire(key, conns.connect)
+        await pool.release(key, first, conns.close)
+        await pool.release(key, second, conns.close)
+        await pool.drop_idle(key)
+        async with pool.connection(key, conns.connect, conns.close) as third:
+            assert third not in (first, second)
+        await pool.close()
+
+    asyncio.run(run())
+    assert conns.opened == 3
+    assert conns.closed == 3
@@ -0,0 +1,95 @@
+from pathlib import Path
+
+from pymatris import Downloader, SessionConfig
+from pymatris.config import DownloaderConfig
+from pymatris.manifest import Manifest
+from pymatris.process_pool import process_count, shard, worker_options
+
+from .conftest import validate_test_file_content
+
+
+def test_shard_round_robin():
+    assert shard(list(range(5)), 2) == [[0, 2, 4], [1, 3]]
+    assert shard([1], 4) == [[1]]
+
+
+def test_worker_options_divide_run_limits():
+    config = DownloaderConfig(
+        max_parallel=5,
+        max_host_connections=4,
+        config=SessionConfig(
+            max_bytes_per_sec=1000,
+            per_host_limits={"example.com": 100},
+            file_max_bytes_per_sec=10,
+        ),
+    )
+    options = worker_options(config, 2)
+    assert options["max_parallel"] == 2  # 2 + 2 stays within 5
+    assert options["max_host_connections"] == 2
+    assert options["all_progress"] is False
+    session_config = options["session_config"]
+    assert session_config.max_bytes_per_sec == 500
+    assert session_config.per_host_limits == {"example.com": 50}
+    assert session_config.file_max_bytes_per_sec == 10  # Per file already
+
+
+def test_process_count_leaves_every_process_a_connection():
+    assert process_count(DownloaderConfig(max_parallel=5), 2) == 2
+    assert process_count(DownloaderConfig(max_parallel=5), 8) == 5
+    config = DownloaderConfig(max_parallel=5, max_host_connections=3)
+    assert process_count(config, 4) == 3
+    assert worker_options(config, process_count(config, 4))["max_host_connections"] == 1
+
+
+def test_download_in_processes_same_filename(multipartserver, tmp_path):
+    dm = Downloader(processes=2)
+    for _ in range(4):
+        dm.enqueue_file(multipartserver.url, path=tmp_path, filename="file.txt")
+
+    results = dm.download()
+    assert len(results.errors) == 0
+    # Every copy got a name of its own, across both processes
+    assert len({Path(path).name for path in results}) == 4
+    for path in results:
+        validate_test_file_content(path, "multipart" * 100)
+
+
+def test_download_in_processes(multipartserver, tmp_path):
+    dm = Downloader(processes=2)
+    for i in range(4):
+        dm.enqueue_file(multipartserver.url, path=tmp_path, filename=f"file{i}.txt")
+
+    results = dm.download()
+    assert len(results.errors) == 0
+    assert sorted(Path(path).name for path in results) == [
+        f"file{i}.txt" for i in range(4)
+    ]
+    for path in results:
+        validate_test_file_content(path, "multipart" * 100)
+    assert dm.metrics.get("files_total", outcome="success") == 4
+    assert dm.metrics.get("bytes_total") == 4 * len("multipart" * 100)
+
+
+def test_download_in_processes_errors(singlepartserverfail, tmp_path):
+    dm = Downloader(processes=2, max_tries=1)
+    for i in range(2):
+        dm.enqueue_file(singlepartserverfail.url, path=tmp_path, filename=f"{i}.txt")
+
+    results = dm.download()
+    assert len(results) == 0
+    assert len(results.errors) == 2
+    assert not any(tmp_path.iterdir())
+
+
+def test_download_in_processes_merges_manifest(multipartserver, tmp_path):
+    manifest = tmp_path / "manifest.json"
+    dm = Downloader(processes=2, session_config=SessionConfig(manifest=manifest))
+    for i in range(2):
+        dm.enqueue_file(
+            f"{multipartserver.url}?{i}", path=tmp_path, filename=f"file{i}.txt"
+        )
+    assert len(dm.download().errors) == 0
+
+    assert sorted(Manifest.load(manifest).entries) == [
+        f"{multipartserver.url}?{i}" for i in range(2)
+    ]
@@ -0,0 +1,65 @@
+import json
+
+import pytest
+
+from pymatris import Downloader, SessionConfig
+from pymatris.progress import ProgressAggregator
+
+MULTIPART_SIZE = len("multipart" * 100)
+
+
+def test_aggregator_counts_files():
+    snapshots = []
+    progress = ProgressAggregator(snapshots.append)
+    first = progress.file(desc="a", total=100, initial=40)
+    second = progress.file(desc="b")
+    first.update(60)
+    second.update(10)
+    first.close()
+    first.close()
+
+    progress.render()
+    snapshot = snapshots[-1]
+    assert snapshot["bytes"] == 70
+    assert snapshot["total"] == 60  # Resumed bytes are not downloaded again
+    assert snapshot["files_active"] == 1
+    assert snapshot["files_done"] == 1
+
+
+def download(multipartserver, tmp_path, progress):
+    dm = Downloader(
+        session_config=SessionConfig(progress=progress, progress_interval=0.01)
+    )
+    for i in range(3):
+        dm.enqueue_file(multipartserver.url, path=tmp_path, filename=f"{i}.txt")
+    assert len(dm.download().errors) == 0
+
+
+def test_progress_callback(multipartserver, tmp_path):
+    snapshots = []
+    download(multipartserver, tmp_path, snapshots.append)
+
+    last = snapshots[-1]
+    assert last["bytes"] == last["total"] == 3 * MULTIPART_SIZE
+    assert last["files_done"] == 3
+    assert last["files_active"] == 0
+
+
+def test_progress_json(multipartserver, tmp_path, capsys):
+    download(multipartserver, tmp_path, "json")
+
+    lines = [
+        json.loads(line)
+        for line in capsys.readouterr().err.splitlines()
+        if line.startswith("{")
+    ]
+    assert lines[-1]["bytes"] == 3 * MULTIPART_SIZE
+
+
+def test_progress_aggregate(multipartserver, tmp_path):
+    download(multipartserver, tmp_path, "aggregate")
+
+
+def test_unknown_progress():
+    with pytest.raises(ValueError):
+        SessionConfig(progress="rich")
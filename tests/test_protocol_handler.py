@@ -0,0 +1,32 @@
+import subprocess
+import sys
+
+from pymatris.protocol_handler import ProtocolResolver, SFTPHandler
+
+
+def test_handlers_registered_by_name():
+    assert set(ProtocolResolver.supported_protocols()) >= {
+        "http",
+        "https",
+        "ftp",
+        "sftp",
+    }
+    assert isinstance(ProtocolResolver.get_handler("sftp"), SFTPHandler)
+
+
+def test_backends_imported_on_first_use(httpserver, tmp_path):
+    httpserver.serve_content("Hello World!")
+    code = f"""
+import sys
+import pymatris.main
+from pymatris import Downloader
+
+backends = ("aioftp", "asyncssh", "cryptography")
+assert not [m for m in backends if m in sys.modules], sys.modules.keys()
+
+dm = Downloader(all_progress=False)
+dm.enqueue_file({httpserver.url!r} + "/file.txt", path={str(tmp_path)!r})
+assert not dm.download().errors
+assert not [m for m in backends if m in sys.modules]
+"""
+    subprocess.run([sys.executable, "-c", code], check=True)
@@ -0,0 +1,111 @@
+import hashlib
+import json
+from pathlib import Path
+
+from pymatris import Downloader, SessionConfig
+from pymatris.exceptions import ChecksumMismatchError
+from pymatris.journal import RangeJournal, journal_path
+from pymatris.utils import get_filepath
+
+from .conftest import ftp_testfile, validate_test_file_content
+
+
+def write_partial(tmp_path, name, content, ranges, size):
+    tempfile = tmp_path / (name + ".matris")
+    with open(tempfile, "wb") as f:
+        for start, end in ranges:
+            f.seek(start)
+            f.write(content[start:end])
+    with open(journal_path(tempfile), "w") as f:
+        json.dump({"size": size, "ranges": ranges}, f)
+    return tempfile
+
+
+def test_journal_merges_ranges(tmp_path):
+    journal = RangeJournal(tmp_path / "test.txt.matris")
+    journal.add(0, 10)
+    journal.add(20, 10)
+    journal.add(10, 5)
+    assert journal.ranges == [[0, 15], [20, 30]]
+    journal.add(15, 5)
+    assert journal.ranges == [[0, 30]]
+    assert journal.completed == 30
+
+
+def test_journal_missing_ranges(tmp_path):
+    journal = RangeJournal(tmp_path / "test.txt.matris")
+    journal.add(10, 10)
+    journal.add(50, 10)
+    assert journal.missing(100) == [(0, 10), (20, 50), (60, 100)]
+
+
+def test_journal_save_and_load(tmp_path):
+    tempfile = tmp_path / "test.txt.matris"
+    open(tempfile, "a").close()
+    journal = RangeJournal.load(tempfile)
+    journal.reset(100)
+    journal.add(0, 40)
+    journal.save()
+    journal.release()
+
+    loaded = RangeJournal.load(tempfile)
+    assert loaded.validate(100)
+    assert loaded.ranges == [[0, 40]]
+    assert not loaded.validate(200)  # remote file changed, start over
+    assert loaded.ranges == []
+    loaded.release()
+
+
+def test_get_filepath_resume(tmp_path):
+    filepath = tmp_path / "test.txt"
+    write_partial(tmp_path, "test.txt", b"0123456789", [[0, 5]], 10)
+
+    assert get_filepath(filepath, overwrite=False, resume=True) == filepath
+    assert get_filepath(filepath, overwrite=False, resume=False) != filepath
+
+
+def test_http_resume(multipartserver, tmp_path):
+    content = b"multipart" * 100
+    write_partial(tmp_path, "multipartfile.txt", content, [[0, 300]], len(content))
+
+    dm = Downloader(session_config=SessionConfig(resume=True))
+    dm.enqueue_file(multipartserver.url, path=tmp_path)
+    f = dm.download()
+
+    assert len(f.errors) == 0
+    assert Path(f[0]).name == "multipartfile.txt"
+    assert multipartserver.request_number == 2  # 1 head request + 1 missing range
+    assert multipartserver.requests[-1]["HTTP_RANGE"] == "bytes=300-"
+    assert [p.name for p in tmp_path.iterdir()] == ["multipartfile.txt"]
+    validate_test_file_content(f[0], "multipart" * 100)
+
+
+def test_sftp_resume(sftp_server, tmp_path):
+    content = b"Hello World From SFTP"
+    write_partial(tmp_path, "testfile.txt", content, [[0, 6]], len(content))
+
+    dm = Downloader(session_config=SessionConfig(resume=True))
+    dm.enqueue_file(f"{sftp_server.url}/testfile.txt", path=tmp_path)
+    f = dm.download()
+
+    assert len(f.errors) == 0
+    assert [p.name for p in tmp_path.iterdir()] == ["testfile.txt"]
+    validate_test_file_content(f[0], "Hello World From SFTP")
+
+
+def test_ftp_resume_complete_file_is_verified(ftp_server, tmp_path):
+    content = ftp_testfile.read_bytes()
+    corrupt = bytes(b ^ 1 for b in content)
+    write_partial(tmp_path, "testfile.txt", corrupt, [[0, len(content)]], len(content))
+    ftpfile = list(ftp_server.get_file_contents("testfile.txt", style="url"))[0]
+
+    dm = Downloader(session_config=SessionConfig(resume=True))
+    dm.enqueue_file(
+        ftpfile["path"],
+        path=tmp_path,
+        checksum="sha256:" + hashlib.sha256(content).hexdigest(),
+    )
+    f = dm.download()
+
+    assert len(f.errors) == 1
+    assert isinstance(f.errors[0].exception, ChecksumMismatchError)
@@ -0,0 +1,152 @@
+import asyncio
+import time
+
+import aiohttp
+from aiohttp import test_utils, web
+
+from pymatris import Downloader, SessionConfig
+from pymatris.segments import SegmentScheduler
+from pymatris.utils import generate_range
+
+from .conftest import validate_test_file_content
+from .localserver import MultiPartServer
+
+
+def test_split_matches_generate_range():
+    scheduler = SegmentScheduler.split(900, 5)
+    assert [(s.offset, s.end) for s in scheduler.segments] == [
+        (0, 180),
+        (180, 360),
+        (360, 540),
+        (540, 720),
+        (720, 900),
+    ]
+    assert SegmentScheduler.split(0, 5).segments == []
+
+
+def test_split_never_exceeds_max_splits():
+    scheduler = SegmentScheduler.split(10, 3)
+    assert [(s.offset, s.end) for s in scheduler.segments] == [(0, 4), (4, 8), (8, 10)]
+    for size, max_splits in [(1000, 7), (901, 5), (3, 5)]:
+        segments = SegmentScheduler.split(size, max_splits).segments
+        assert len(segments) <= max_splits
+        assert segments[-1].end == size
+        ranges = generate_range(size, max_splits)
+        assert [start for start, _ in ranges] == [s.offset for s in segments]
+
+
+def test_steal_splits_largest_segment():
+    scheduler = SegmentScheduler([(0, 100), (100, 500)], 500, min_segment_size=10)
+    slow = scheduler.segments[1]
+    slow.offset = 200
+
+    stolen = scheduler.steal()
+    assert (stolen.offset, stolen.end) == (350, 500)
+    assert (slow.offset, slow.end) == (200, 350)
+    assert scheduler.steals == 1
+
+
+def test_steal_respects_min_segment_size():
+    scheduler = SegmentScheduler([(0, 100)], 100, min_segment_size=60)
+    assert scheduler.steal() is None
+
+    scheduler.segments[0].offset = 100
+    assert scheduler.steal() is None
+    assert scheduler.segments == []
+
+
+def slow_first_range(i, environ, start_response):
+    # Trickle out the range starting at 0, every other range is served at once
+    if environ.get("HTTP_RANGE", "").startswith("bytes=0-"):
+        content = b"multipart" * 100
+        end = int(environ["HTTP_RANGE"].split("-")[1])
+        start_response(
+            "200 OK", [("Content-Length", str(end)), ("Accept-Ranges", "bytes")]
+        )
+
+        def trickle():
+            for start in range(0, end, 10):
+                time.sleep(0.02)
+                yield content[start : min(start + 10, end)]
+
+        return trickle()
+
+
+def test_idle_worker_steals_from_slow_range(tmp_path):
+    server = MultiPartServer(override=slow_first_range)
+    server.start_server()
+    try:
+        dm = Downloader(
+            max_splits=2,
+            session_config=SessionConfig(chunksize=10, min_segment_size=50),
+        )
+        dm.enqueue_file(server.url, path=tmp_path)
+        f = dm.download()
+    finally:
+        server.stop_server()
+
+    assert len(f.errors) == 0
+    validate_test_file_content(f[0], "multipart" * 100)
+    # HEAD, the two initial ranges, then at least one stolen half of the slow one
+    assert len(server.requests) > 3
+
+
+def test_steal_against_server_honouring_range_end(tmp_path):
+    content = bytes(range(256)) * 64
+    held = asyncio.Event()
+    requests = []
+
+    async def serve(request):
+        http_range = request.headers.get("Range")
+        requests.append(http_range)
+        if len(requests) == 4:
+            held.set()  # HEAD, the two ranges, then the half stolen from 0
+        start, end = 0, len(content)
+        if http_range:
+            first, _, last = http_range.split("bytes=")[1].partition("-")
+            start = int(first)
+            end = min(int(last) + 1, len(content)) if last else len(content)
+        resp = web.StreamResponse(
+            status=206 if http_range else 200,
+            headers={"Accept-Ranges": "bytes", "Content-Length": str(end - start)},
+        )
+        await resp.prepare(request)
+        if request.method == "GET":
+            if start == 0:
+                # Trickle the first KiB, the rest comes once stolen from
+                await resp.write(content[:1024])
+                await held.wait()
+                start = 1024
+            await resp.write(content[start:end])
+        return resp
+
+    async def run():
+        app = web.Application()
+        app.router.add_route("*", "/file.bin", serve)
+        # A small read buffer pauses the connection with the rest of the held
+        # range buffered, which a reused connection would never resume from
+        async with test_utils.TestServer(app) as server, aiohttp.ClientSession(
+            read_bufsize=1024
+        ) as session:
+            dm = Downloader(
+                max_splits=2,
+                max_tries=1,
+                overwrite=True,
+                session=session,
+                session_config=SessionConfig(
+                    chunksize=1024, min_segment_size=1024, timeouts=5
+                ),
+            )
+            # The second download picks up the connections the first left
+            for _ in range(2):
+                dm.enqueue_file(str(server.make_url("/file.bin")), path=tmp_path)
+                f = await dm.run_download()
+                assert len(f.errors) == 0
+                assert (tmp_path / "file.bin").read_bytes() == content
+            return dm
+
+    dm = asyncio.run(run())
+
+    assert "bytes=0-8192" in requests
+    # A request on a connection left paused would only end with its timeout
+    assert dm.metrics.get("retries_total") == 0
@@ -1,4 +1,5 @@
-from pymatris import Downloader
+from pymatris import Downloader, SessionConfig
+from pymatris.pool import ConnectionPool
 from .conftest import validate_test_file_content
 from pathlib import Path
 
@@ -13,6 +14,15 @@ def test_sftp_download(sftp_server, tmp_path):
     validate_test_file_content(f[0], "Hello World From SFTP")
 
 
+def test_sftp_download_auto_chunksize(sftp_server, tmp_path):
+    dm = Downloader(session_config=SessionConfig(chunksize="auto"))
+    dm.enqueue_file(f"{sftp_server.url}/testfile.txt", path=tmp_path)
+
+    f = dm.download()
+    assert len(f.urls) == 1
+    validate_test_file_content(f[0], "Hello World From SFTP")
+
+
 def test_sftp_nosuchfile(sftp_server, tmp_path):
     dm = Downloader()
     dm.enqueue_file(f"{sftp_server.url}/nonexistentfile.txt", path=tmp_path)
@@ -34,3 +44,39 @@ def test_sftp_nosuchfile(sftp_server, tmp_path):
 #     assert len(f.urls) == 0
 #     assert len(f.errors) == 1
 #     assert not any(tmp_path.iterdir())  # Make sure tmp_path is empty
+
+
+def test_sftp_multiple_files_one_host(sftp_server, tmp_path):
+    dm = Downloader(max_parallel=3, max_host_connections=1)
+    for i in range(3):
+        dm.enqueue_file(
+            f"{sftp_server.url}/testfile.txt", path=tmp_path, filename=f"testfile{i}.txt"
+        )
+    f = dm.download()
+
+    assert len(f.errors) == 0
+    for path in f:
+        validate_test_file_content(path, "Hello World From SFTP")
+
+
+def test_sftp_pooled_connection_closed_by_server(sftp_server, tmp_path, monkeypatch):
+    release = ConnectionPool.release
+
+    async def close_then_release(self, key, conn, close, reuse=True):
+        if reuse:
+            # The server times the idle connection out
+            conn[0].close()
+            await conn[0].wait_closed()
+        await release(self, key, conn, close, reuse)
+
+    monkeypatch.setattr(ConnectionPool, "release", close_then_release)
+    dm = Downloader(max_parallel=1)
+    for i in range(2):
+        dm.enqueue_file(
+            f"{sftp_server.url}/testfile.txt", path=tmp_path, filename=f"testfile{i}.txt"
+        )
+    f = dm.download()
+
+    assert len(f.errors) == 0
+    for path in f:
+        validate_test_file_content(path, "Hello World From SFTP")
@@ -0,0 +1,163 @@
+import asyncio
+import hashlib
+
+import pytest
+from aiohttp import test_utils, web
+from pytest_localserver.http import Chunked
+
+import pymatris.protocol_handler.ftp_handler
+import pymatris.protocol_handler.http_handler
+import pymatris.protocol_handler.sftp_handler
+from pymatris import Downloader, SessionConfig
+from pymatris.utils import read_small
+
+from .conftest import validate_test_file_content
+
+
+@pytest.fixture
+def writer_calls(monkeypatch):
+    """Count the writer tasks started by every handler."""
+    calls = []
+
+    for module in (
+        pymatris.protocol_handler.http_handler,
+        pymatris.protocol_handler.ftp_handler,
+        pymatris.protocol_handler.sftp_handler,
+    ):
+        write_worker = module.write_worker
+
+        def counting(*args, _write_worker=write_worker, **kwargs):
+            calls.append(args)
+            return _write_worker(*args, **kwargs)
+
+        monkeypatch.setattr(module, "write_worker", counting)
+    return calls
+
+
+class FakeStream:
+    def __init__(self, data):
+        self.data = data
+
+    async def read(self, n):
+        chunk, self.data = self.data[:n], self.data[n:]
+        return chunk
+
+
+def test_read_small():
+    body, complete = asyncio.run(read_small(FakeStream(b"x" * 10), 3, limit=10))
+    assert (bytes(body), complete) == (b"x" * 10, True)
+
+    # Stops at the first chunk past the limit
+    body, complete = asyncio.run(read_small(FakeStream(b"x" * 10), 3, limit=4))
+    assert (bytes(body), complete) == (b"x" * 6, False)
+
+
+@pytest.mark.parametrize("skip_head", [False, True])
+def test_http_small_file(multipartserver, tmp_path, writer_calls, skip_head):
+    dm = Downloader(
+        session_config=SessionConfig(small_file_size=64 * 1024, skip_head=skip_head)
+    )
+    dm.enqueue_file(
+        multipartserver.url,
+        path=tmp_path,
+        checksum="sha256:" + hashlib.sha256(b"multipart" * 100).hexdigest(),
+    )
+    f = dm.download()
+
+    assert len(f.errors) == 0
+    assert writer_calls == []
+    validate_test_file_content(f[0], "multipart" * 100)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["multipartfile.txt"]
+
+
+def test_http_small_file_checksum_mismatch(multipartserver, tmp_path):
+    dm = Downloader(session_config=SessionConfig(small_file_size=64 * 1024))
+    dm.enqueue_file(multipartserver.url, path=tmp_path, checksum="sha256:" + "0" * 64)
+    f = dm.download()
+
+    assert len(f.errors) == 1
+    assert not any(tmp_path.iterdir())
+
+
+def test_http_larger_than_threshold(multipartserver, tmp_path, writer_calls):
+    dm = Downloader(session_config=SessionConfig(small_file_size=100))
+    dm.enqueue_file(multipartserver.url, path=tmp_path)
+    f = dm.download()
+
+    assert len(f.errors) == 0
+    assert len(writer_calls) == 1
+    validate_test_file_content(f[0], "multipart" * 100)
+
+
+def test_http_small_empty_file(tmp_path, writer_calls):
+    root = tmp_path / "root"
+    root.mkdir()
+    (root / "empty.txt").write_bytes(b"")
+    out = tmp_path / "out"
+    methods = []
+
+    @web.middleware
+    async def record(request, handler):
+        methods.append(request.method)
+        return await handler(request)
+
+    async def run():
+        # aiohttp's static files answer "Range: bytes=0-" on an empty file with 416
+        app = web.Application(middlewares=[record])
+        app.router.add_static("/", root)
+        async with test_utils.TestServer(app) as server:
+            dm = Downloader(session_config=SessionConfig(small_file_size=64 * 1024))
+            dm.enqueue_file(str(server.make_url("/empty.txt")), path=out)
+            return await dm.run_download()
+
+    f = asyncio.run(run())
+
+    assert len(f.errors) == 0
+    assert writer_calls == []
+    assert methods == ["HEAD"]
+    assert (out / "empty.txt").read_bytes() == b""
+
+
+@pytest.mark.parametrize("size,writers", [(500, 0), (5000, 1)])
+def test_http_unknown_size(httpserver, tmp_path, writer_calls, size, writers):
+    # A chunked response has no Content-Length, the body is read until it
+    # turns out bigger than the threshold and then streams on to the writer
+    content = "".join(chr(ord("a") + i % 26) for i in range(size))
+    httpserver.serve_content(
+        [content[i : i + 300] for i in range(0, size, 300)],
+        headers={
+            "Content-Disposition": "attachment; filename=testfile.txt",
+            "Transfer-Encoding": "chunked",
+        },
+        chunked=Chunked.YES,
+    )
+    dm = Downloader(session_config=SessionConfig(small_file_size=1000, chunksize=256))
+    dm.enqueue_file(httpserver.url, path=tmp_path)
+    f = dm.download()
+
+    assert len(f.errors) == 0
+    assert len(writer_calls) == writers
+    # What was read into memory is not requested again
+    assert [req.method for req in httpserver.requests] == ["HEAD", "GET"]
+    validate_test_file_content(f[0], content)
+
+
+def test_sftp_small_file(sftp_server, tmp_path, writer_calls):
+    dm = Downloader(session_config=SessionConfig(small_file_size=64 * 1024))
+    dm.enqueue_file(f"{sftp_server.url}/testfile.txt", path=tmp_path)
+    f = dm.download()
+
+    assert len(f.errors) == 0
+    assert writer_calls == []
+    validate_test_file_content(f[0], "Hello World From SFTP")
+
+
+def test_ftp_small_file(ftp_server, tmp_path, writer_calls):
+    ftpfile = list(ftp_server.get_file_contents("testfile.txt", style="url"))[0]
+    dm = Downloader(session_config=SessionConfig(small_file_size=64 * 1024))
+    dm.enqueue_file(ftpfile["path"], path=tmp_path)
+    f = dm.download()
+
+    assert len(f.errors) == 0
+    assert writer_calls == []
+    validate_test_file_content(f[0], ftpfile["content"])
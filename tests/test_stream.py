@@ -0,0 +1,66 @@
+import asyncio
+
+from pymatris import Downloader
+from pymatris.results import Error, Success
+
+from .conftest import validate_test_file_content
+
+
+def collect(dm, downloads, **kwargs):
+    async def run():
+        return [result async for result in dm.stream(downloads, **kwargs)]
+
+    return asyncio.run(run())
+
+
+def test_stream_async_iterable(multipartserver, sftp_server, tmp_path):
+    async def urls():
+        yield multipartserver.url
+        yield f"{sftp_server.url}/testfile.txt"
+
+    results = collect(Downloader(), urls(), path=tmp_path)
+
+    assert len(results) == 2
+    assert all(isinstance(res, Success) for res in results)
+    paths = {res.url: res.path for res in results}
+    validate_test_file_content(paths[multipartserver.url], "multipart" * 100)
+    validate_test_file_content(
+        paths[f"{sftp_server.url}/testfile.txt"], "Hello World From SFTP"
+    )
+
+
+def test_stream_pulls_lazily(singlepartserver, tmp_path):
+    pulled = []
+
+    def urls():
+        for i in range(4):
+            pulled.append(i)
+            yield {"url": singlepartserver.url, "filename": f"file{i}.txt"}
+
+    async def run():
+        dm = Downloader(max_parallel=1)
+        stream = dm.stream(urls(), path=tmp_path)
+        first = await stream.__anext__()
+        # Only one slot, so the next URL is pulled once the first file is done
+        assert len(pulled) <= 2
+        rest = [res async for res in stream]
+        return [first, *rest]
+
+    results = asyncio.run(run())
+    assert len(results) == 4
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        f"file{i}.txt" for i in range(4)
+    ]
+
+
+def test_stream_yields_errors(singlepartserverfail, tmp_path):
+    results = collect(
+        Downloader(),
+        [singlepartserverfail.url, "gopher://example.com", {"url": 5}],
+        path=tmp_path,
+    )
+
+    assert len(results) == 3
+    assert any(isinstance(res.exception, TypeError) for res in results)
+    assert all(isinstance(res, Error) for res in results)
+    assert [*tmp_path.iterdir()] == []
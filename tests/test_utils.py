@@ -1,5 +1,10 @@
+import asyncio
+
 from pymatris.utils import (
+    AdaptiveChunksize,
+    chunk_sizer,
     allocate_tempfile,
+    claim_filepath,
     replace_tempfile,
     remove_file,
     replace_file,
@@ -19,6 +24,19 @@ def test_allocate_tempfile(tmp_path):
     assert tempfile_path.suffix == ".matris"
 
 
+def test_claim_filepath_skips_taken_tempfiles(tmp_path):
+    filepath = tmp_path / "test.txt"
+    first, first_tempfile = claim_filepath(filepath, overwrite=True)
+    # Another process checked the same name, but claimed it first
+    second, second_tempfile = claim_filepath(filepath, overwrite=True)
+
+    assert first == filepath
+    assert first_tempfile == tmp_path / "test.txt.matris"
+    assert second != first
+    assert second_tempfile.exists()
+    assert second_tempfile.name == second.name + ".matris"
+
+
 def test_replace_tempfile(tmp_path):
     original_path = tmp_path / "test.txt"
     open(original_path, "a").close()  # create original file
@@ -87,3 +105,38 @@ def test_replacement_filename(tmp_path):
     assert new_path != filepath
     assert new_path.name.startswith("test")
     assert "".join(new_path.suffixes) == ".1.txt"
+
+
+def test_adaptive_chunksize_follows_throughput():
+    sizer = AdaptiveChunksize()
+    assert sizer.size == AdaptiveChunksize.MIN_SIZE
+
+    # Fast reads grow the size, at most doubling per read, up to the maximum
+    for _ in range(20):
+        sizer.start()
+        sizer._started -= 0.001
+        sizer.update(sizer.size)
+    assert sizer.size == AdaptiveChunksize.MAX_SIZE
+
+    # Slow reads shrink it back once the average rate catches up
+    for _ in range(50):
+        sizer.start()
+        sizer._started -= 10
+        sizer.update(sizer.size)
+    assert sizer.size == AdaptiveChunksize.MIN_SIZE
+
+
+def test_adaptive_chunksize_backs_off_on_deep_queue():
+    queue = asyncio.Queue()
+    sizer = AdaptiveChunksize(queue)
+    sizer.size = AdaptiveChunksize.MAX_SIZE
+    for i in range(AdaptiveChunksize.QUEUE_HIGH + 1):
+        queue.put_nowait(i)
+    sizer.start()
+    sizer.update(sizer.size)
+    assert sizer.size == AdaptiveChunksize.MAX_SIZE // 2
+
+
+def test_chunk_sizer():
+    assert isinstance(chunk_sizer("auto"), AdaptiveChunksize)
+    assert chunk_sizer(2048).size == 2048
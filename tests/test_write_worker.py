@@ -0,0 +1,207 @@
+import asyncio
+import os
+import threading
+
+import pytest
+
+from pymatris import Downloader, SessionConfig, write_worker
+from pymatris.chunk_queue import ChunkQueue, MemoryBudget
+from pymatris.io_threads import DeviceWriters
+from pymatris.utils import cancel_task
+from pymatris.write_worker import (
+    PendingWrites,
+    async_pwrite_worker,
+    async_write_worker,
+)
+
+from .conftest import validate_test_file_content
+
+
+def test_pending_writes_holds_short_runs():
+    pending = PendingWrites(run_bytes=6, max_bytes=100)
+    for offset, chunk in [(0, b"abc"), (10, b"klm"), (3, b"def"), (13, b"n")]:
+        pending.add(offset, chunk)
+
+    # Only the run from 0 is long enough
+    assert pending.take() == [(0, [b"abc", b"def"])]
+    assert (pending.nbytes, pending.items) == (4, 2)
+    assert pending.take(everything=True) == [(10, [b"klm", b"n"])]
+    assert (pending.nbytes, pending.items) == (0, 0)
+
+
+def test_pending_writes_merges_runs_and_caps_bytes():
+    pending = PendingWrites(run_bytes=100, max_bytes=9)
+    # Two splits, the second starting where the first ends
+    for offset, chunk in [(0, b"abc"), (6, b"ghi"), (3, b"def")]:
+        pending.add(offset, chunk)
+
+    assert pending.take() == [(0, [b"abc", b"def", b"ghi"])]
+
+
+def _interleaved_chunks(splits, chunks, chunksize):
+    # Chunk i of every split, then chunk i + 1 of every split...
+    split_size = chunks * chunksize
+    for i in range(chunks):
+        for split in range(splits):
+            offset = split * split_size + i * chunksize
+            yield offset, bytes([split]) * chunksize
+
+
+def test_writer_coalesces_interleaved_splits(tmp_path, monkeypatch):
+    calls = []
+    write_runs = write_worker.write_runs
+    monkeypatch.setattr(write_worker, "MAX_BATCH_BYTES", 1024)
+    monkeypatch.setattr(write_worker, "COALESCE_BYTES", 4096)
+    monkeypatch.setattr(
+        write_worker,
+        "write_runs",
+        lambda fd, runs, checksum=None: (
+            calls.append(runs),
+            write_runs(fd, runs, checksum),
+        ),
+    )
+    filepath = tmp_path / "test.bin.matris"
+    chunks = list(_interleaved_chunks(splits=4, chunks=64, chunksize=256))
+
+    async def run():
+        queue = ChunkQueue()
+        writer = asyncio.create_task(async_pwrite_worker(queue, None, filepath))
+        for item in chunks:
+            await queue.put(item)
+            # Let the writer take a few chunks at a time
+            await asyncio.sleep(0)
+        await queue.join()
+        await cancel_task(writer)
+
+    asyncio.run(run())
+    assert filepath.read_bytes() == b"".join(bytes([s]) * 64 * 256 for s in range(4))
+    # Every split is written in runs of 4096 bytes, not a chunk or a batch at a time
+    runs = [run for runs in calls for run in runs]
+    assert len(runs) < 4 * 64 * 256 // 1024
+    assert all(sum(map(len, buffers)) >= 4096 for _, buffers in runs)
+
+
+def test_held_chunks_count_against_the_budget(tmp_path, monkeypatch):
+    # Only a blocked producer can make the writer let go of its chunks
+    monkeypatch.setattr(write_worker, "FLUSH_AFTER", 60)
+    filepath = tmp_path / "test.bin.matris"
+    chunks = list(_interleaved_chunks(splits=4, chunks=64, chunksize=1024))
+    budget = MemoryBudget(limit=64 * 1024)
+
+    async def run():
+        queue = ChunkQueue(budget=budget)
+        writer = asyncio.create_task(async_pwrite_worker(queue, None, filepath))
+        used = []
+        for item in chunks:
+            await queue.put(item)
+            used.append(budget.used)
+        await asyncio.wait_for(queue.join(), 5)
+        await cancel_task(writer)
+        return used
+
+    used = asyncio.run(run())
+    assert max(used) <= budget.limit
+    assert budget.used == 0
+    assert budget.backpressure > 1
+    assert filepath.read_bytes() == b"".join(bytes([s]) * 64 * 1024 for s in range(4))
+
+
+def test_cancelled_writer_gives_the_budget_back(tmp_path):
+    budget = MemoryBudget(limit=64 * 1024)
+
+    async def run():
+        queue = ChunkQueue(budget=budget)
+        writer = asyncio.create_task(
+            async_pwrite_worker(queue, None, tmp_path / "test.bin.matris")
+        )
+        await queue.put((0, b"x" * 1024))
+        await asyncio.sleep(0.01)  # Held back by the writer
+        await queue.put((4096, b"y" * 1024))
+        await cancel_task(writer)
+
+    asyncio.run(run())
+    assert budget.used == 0
+
+
+def test_writer_flushes_held_chunks_after_a_while(tmp_path, monkeypatch):
+    monkeypatch.setattr(write_worker, "FLUSH_AFTER", 0.05)
+    filepath = tmp_path / "test.txt.matris"
+
+    async def run():
+        queue = ChunkQueue()
+        writer = asyncio.create_task(async_write_worker(queue, None, filepath))
+        await queue.put((0, b"Hello"))
+        await asyncio.sleep(0.01)
+        # Held back, far from a full run
+        assert queue._unfinished_tasks == 1
+        await asyncio.sleep(0.2)
+        assert queue._unfinished_tasks == 0
+        assert filepath.read_bytes() == b"Hello"
+        await cancel_task(writer)
+
+    asyncio.run(run())
+
+
+def test_pwrite_worker_preallocates(tmp_path):
+    filepath = tmp_path / "test.txt.matris"
+
+    async def run():
+        queue = asyncio.Queue()
+        for offset, chunk in [(5, b"World"), (0, b"Hello"), (10, b"!")]:
+            queue.put_nowait((offset, chunk))
+        writer = asyncio.create_task(
+            async_pwrite_worker(queue, None, filepath, size=11)
+        )
+        await queue.join()
+        await cancel_task(writer)
+
+    asyncio.run(run())
+    validate_test_file_content(filepath, "HelloWorld!")
+
+
+def test_multipartserver_pwrite(multipartserver, tmp_path):
+    dm = Downloader(session_config=SessionConfig(writer="pwrite"))
+    dm.enqueue_file(multipartserver.url, path=tmp_path, max_splits=10)
+    f = dm.download()
+
+    assert len(f.errors) == 0
+    assert len([*tmp_path.iterdir()]) == 1
+    validate_test_file_content(f[0], "multipart" * 100)
+
+
+def test_device_writers_share_threads_per_filesystem(tmp_path):
+    writers = DeviceWriters(threads=2)
+    fds = [os.open(tmp_path / name, os.O_WRONLY | os.O_CREAT) for name in "ab"]
+
+    def fail():
+        raise OSError("disk full")
+
+    async def run():
+        device = writers.for_fd(fds[0])
+        assert writers.for_fd(fds[1]) is device
+        assert len(device.threads) == 2
+        assert await device.submit(threading.current_thread) is None
+        with pytest.raises(OSError, match="disk full"):
+            await device.submit(fail)
+        return device
+
+    try:
+        device = asyncio.run(run())
+    finally:
+        for fd in fds:
+            os.close(fd)
+        writers.close()
+    assert not any(thread.is_alive() for thread in device.threads)
+
+
+def test_multipartserver_threads(multipartserver, tmp_path):
+    dm = Downloader(session_config=SessionConfig(writer="threads", writer_threads=2))
+    for i in range(3):
+        dm.enqueue_file(multipartserver.url, path=tmp_path / str(i), max_splits=10)
+    f = dm.download()
+
+    assert len(f.errors) == 0
+    for path in f:
+        validate_test_file_content(path, "multipart" * 100)
+    # The run stopped its writer threads
+    assert not [t for t in threading.enumerate() if t.name.startswith("pymatris-writer")]